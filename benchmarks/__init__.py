@@ -0,0 +1,4 @@
+# -*- coding: utf-8 -*-
+"""
+性能测试，在仓库根目录用 `python -m benchmarks.xxx` 运行
+"""
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""
+对比旧的分包方式（切片复制包体、每个包构造HeaderTuple、解压后递归）和ws_base.iter_packets
+
+用法：python -m benchmarks.frame_split [--packets 200] [--frames 200]
+"""
+import argparse
+import gc
+import json
+import time
+import tracemalloc
+from typing import *
+
+import brotli
+
+from blivedm.clients import ws_base
+from . import frames
+
+
+def legacy_parse(data: bytes, commands: list):
+    """
+    旧版_parse_ws_message + _parse_business_message的同步等价实现
+    """
+    offset = 0
+    header = ws_base.HeaderTuple(*ws_base.HEADER_STRUCT.unpack_from(data, offset))
+    while True:
+        body = data[offset + header.raw_header_size: offset + header.pack_len]
+        if header.ver == ws_base.ProtoVer.BROTLI:
+            legacy_parse(brotli.decompress(body), commands)
+        elif header.ver == ws_base.ProtoVer.NORMAL:
+            commands.append(json.loads(body.decode('utf-8')))
+
+        offset += header.pack_len
+        if offset >= len(data):
+            break
+        header = ws_base.HeaderTuple(*ws_base.HEADER_STRUCT.unpack_from(data, offset))
+
+
+def new_parse(data: bytes, commands: list):
+    """
+    新版_parse_ws_message + _parse_business_message的同步等价实现
+    """
+    packet_iters = [ws_base.iter_packets(data)]
+    while packet_iters:
+        packet = next(packet_iters[-1], None)
+        if packet is None:
+            packet_iters.pop()
+            continue
+        _operation, ver, body = packet
+        if ver == ws_base.ProtoVer.BROTLI:
+            packet_iters.append(ws_base.iter_packets(brotli.decompress(body)))
+        elif ver == ws_base.ProtoVer.NORMAL:
+            commands.append(json.loads(str(body, 'utf-8')))
+
+
+def legacy_split(data: bytes, bodies: list):
+    """
+    旧的方式只分包，不解压不反序列化
+    """
+    offset = 0
+    while offset < len(data):
+        header = ws_base.HeaderTuple(*ws_base.HEADER_STRUCT.unpack_from(data, offset))
+        bodies.append(data[offset + header.raw_header_size: offset + header.pack_len])
+        offset += header.pack_len
+
+
+def new_split(data: bytes, bodies: list):
+    """
+    新的方式只分包，不解压不反序列化
+    """
+    for _operation, _ver, body in ws_base.iter_packets(data):
+        bodies.append(body)
+
+
+def measure_time(func: Callable[[bytes, list], None], frame_list: List[bytes], repeat: int) -> float:
+    """
+    :return: 每个WebSocket消息的耗时（微秒），取repeat次中最快的
+    """
+    best = float('inf')
+    # 和timeit一样关掉GC，否则解析出来的大量dict会让GC的时间算到后跑的那一边
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for data in frame_list:
+                func(data, [])
+            best = min(best, time.perf_counter() - start)
+    finally:
+        if gc_enabled:
+            gc.enable()
+    return best / len(frame_list) * 1e6
+
+
+def measure_memory(func: Callable[[bytes, list], None], frame_list: List[bytes]) -> Tuple[float, float]:
+    """
+    :return: (每个WebSocket消息解析后留下的内存块数, 每个WebSocket消息的内存峰值字节数)
+    """
+    total_blocks = 0
+    total_peak = 0
+    for data in frame_list:
+        results = []
+        tracemalloc.start()
+        func(data, results)
+        snapshot = tracemalloc.take_snapshot()
+        _current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        total_blocks += sum(stat.count for stat in snapshot.statistics('filename'))
+        total_peak += peak
+        del results
+    return total_blocks / len(frame_list), total_peak / len(frame_list)
+
+
+def count_copied_bytes(data: bytes) -> int:
+    """
+    旧的方式切片时复制的包体字节数
+    """
+    copied = 0
+    for _operation, ver, body in ws_base.iter_packets(data):
+        copied += len(body)
+        if ver == ws_base.ProtoVer.BROTLI:
+            copied += count_copied_bytes(brotli.decompress(body))
+    return copied
+
+
+def print_comparison(title: str, legacy_func, new_func, frame_list: List[bytes], repeat: int, copied: float):
+    legacy_us = measure_time(legacy_func, frame_list, repeat)
+    new_us = measure_time(new_func, frame_list, repeat)
+    legacy_blocks, legacy_peak = measure_memory(legacy_func, frame_list)
+    new_blocks, new_peak = measure_memory(new_func, frame_list)
+
+    print(title)
+    print(f'{"":8}{"us/frame":>12}{"blocks/frame":>16}{"peak bytes/frame":>20}{"copied bytes/frame":>20}')
+    print(f'{"legacy":8}{legacy_us:12.1f}{legacy_blocks:16.1f}{legacy_peak:20.0f}{copied:20.0f}')
+    print(f'{"new":8}{new_us:12.1f}{new_blocks:16.1f}{new_peak:20.0f}{0:20.0f}')
+    print(f'saved {legacy_us - new_us:.1f} us/frame ({(1 - new_us / legacy_us) * 100:.1f}%), '
+          f'{legacy_blocks - new_blocks:.1f} blocks/frame, {legacy_peak - new_peak:.0f} peak bytes/frame')
+    print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--packets', type=int, default=200, help='每个WebSocket消息包含的业务消息数')
+    parser.add_argument('--frames', type=int, default=200, help='WebSocket消息数')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    command_lists = [frames.make_commands(args.packets, seed) for seed in range(args.frames)]
+    payload_list = [frames.make_normal_payload(commands) for commands in command_lists]
+    frame_list = [frames.make_brotli_frame(commands) for commands in command_lists]
+
+    commands_legacy, commands_new = [], []
+    legacy_parse(frame_list[0], commands_legacy)
+    new_parse(frame_list[0], commands_new)
+    assert commands_legacy == commands_new
+
+    print(f'{args.packets} packets/frame, {args.frames} frames\n')
+    # 只分包，blocks/frame是留下的包体对象数，旧的方式每个包体是一个bytes
+    copied = sum(count_copied_bytes(data) for data in payload_list) / len(payload_list)
+    print_comparison('split decompressed payload', legacy_split, new_split, payload_list, args.repeat, copied)
+    # 整个流程，大部分时间花在解压和反序列化
+    copied = sum(count_copied_bytes(data) for data in frame_list) / len(frame_list)
+    print_comparison('brotli + split + json.loads', legacy_parse, new_parse, frame_list, args.repeat, copied)
+
+
+if __name__ == '__main__':
+    main()
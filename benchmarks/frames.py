@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+"""
+生成测试用的WebSocket消息数据
+"""
+import json
+import random
+import zlib
+from typing import *
+
+import brotli
+
+from blivedm.clients import ws_base
+
+
+def make_danmaku_command(rnd: int) -> dict:
+    return {
+        'cmd': 'DANMU_MSG',
+        'info': [
+            [0, 1, 25, 16777215, 1700000000000 + rnd, rnd, 0, 'a1b2c3d4', 0, 0, 0, '', 0, '{}', '{}',
+             {'mode': 0, 'show_player_type': 0, 'extra': '{"send_from_me":false}'}],
+            f'弹幕内容{rnd}',
+            [10000 + rnd % 1000, f'用户{rnd % 1000}', 0, 0, 0, 10000, 1, ''],
+            [12, '勋章', '主播', 30015166, 6126494, '', 0],
+            [20, 0, 6406234, '>50000'],
+            ['', ''],
+            0,
+            0,
+            None,
+            {'ts': 1700000000, 'ct': 'ABCDEF'},
+            0,
+            0,
+        ],
+    }
+
+
+def make_interact_word_command(rnd: int) -> dict:
+    return {
+        'cmd': 'INTERACT_WORD',
+        'data': {
+            'contribution': {'grade': 0},
+            'fans_medal': {'anchor_roomid': 0, 'medal_level': 0, 'medal_name': '', 'target_id': 0},
+            'identities': [1],
+            'msg_type': 1,
+            'roomid': 30015166,
+            'timestamp': 1700000000 + rnd,
+            'uid': 10000 + rnd % 1000,
+            'uname': f'用户{rnd % 1000}',
+        },
+    }
+
+
+COMMAND_FACTORIES: List[Callable[[int], dict]] = [
+    make_danmaku_command,
+    make_interact_word_command,
+]
+
+
+def make_packet(body: bytes, operation: int, ver: int) -> bytes:
+    header = ws_base.HEADER_STRUCT.pack(*ws_base.HeaderTuple(
+        pack_len=ws_base.HEADER_STRUCT.size + len(body),
+        raw_header_size=ws_base.HEADER_STRUCT.size,
+        ver=ver,
+        operation=operation,
+        seq_id=0,
+    ))
+    return header + body
+
+
+def make_commands(n: int, seed: int = 0) -> List[dict]:
+    rand = random.Random(seed)
+    return [rand.choice(COMMAND_FACTORIES)(i) for i in range(n)]
+
+
+def make_normal_payload(commands: Iterable[dict]) -> bytes:
+    """
+    多个未压缩的业务消息包拼在一起
+    """
+    return b''.join(
+        make_packet(json.dumps(command).encode('utf-8'), ws_base.Operation.SEND_MSG_REPLY, ws_base.ProtoVer.NORMAL)
+        for command in commands
+    )
+
+
+def make_brotli_frame(commands: Iterable[dict]) -> bytes:
+    """
+    和服务器发的一样，一个WebSocket消息只有一个brotli压缩过的包
+    """
+    return make_packet(
+        brotli.compress(make_normal_payload(commands)), ws_base.Operation.SEND_MSG_REPLY, ws_base.ProtoVer.BROTLI
+    )
+
+
+def make_deflate_frame(commands: Iterable[dict]) -> bytes:
+    """
+    旧版协议，一个WebSocket消息只有一个zlib压缩过的包
+    """
+    return make_packet(
+        zlib.compress(make_normal_payload(commands)), ws_base.Operation.SEND_MSG_REPLY, ws_base.ProtoVer.DEFLATE
+    )
+
+
+def make_heartbeat_command(rnd: int) -> dict:
+    return {'cmd': '_HEARTBEAT', 'data': {'popularity': 10000 + rnd}}
+
+
+def make_gift_command(rnd: int) -> dict:
+    return {
+        'cmd': 'SEND_GIFT',
+        'data': {
+            'giftName': '小心心',
+            'num': 1 + rnd % 5,
+            'uname': f'用户{rnd % 1000}',
+            'face': 'https://i0.hdslb.com/bfs/face/member/noface.jpg',
+            'guard_level': 0,
+            'uid': 10000 + rnd % 1000,
+            'timestamp': 1700000000 + rnd,
+            'giftId': 30607,
+            'giftType': 5,
+            'action': '投喂',
+            'price': 0,
+            'rnd': f'1700000000{rnd}',
+            'coin_type': 'silver',
+            'total_coin': 0,
+            'tid': f'1700000000{rnd}',
+            'medal_info': {'medal_level': 12, 'medal_name': '勋章', 'target_id': 6126494},
+            'batch_combo_id': '',
+        },
+    }
+
+
+def make_guard_buy_command(rnd: int) -> dict:
+    return {
+        'cmd': 'GUARD_BUY',
+        'data': {
+            'uid': 10000 + rnd % 1000,
+            'username': f'用户{rnd % 1000}',
+            'guard_level': 3,
+            'num': 1,
+            'price': 198000,
+            'gift_id': 10003,
+            'gift_name': '舰长',
+            'start_time': 1700000000 + rnd,
+            'end_time': 1700000000 + rnd,
+        },
+    }
+
+
+def make_super_chat_command(rnd: int) -> dict:
+    return {
+        'cmd': 'SUPER_CHAT_MESSAGE',
+        'data': {
+            'price': 30,
+            'message': f'醒目留言{rnd}',
+            'message_trans': '',
+            'start_time': 1700000000 + rnd,
+            'end_time': 1700000060 + rnd,
+            'time': 60,
+            'id': rnd,
+            'gift': {'gift_id': 12000, 'gift_name': '醒目留言', 'num': 1},
+            'uid': 10000 + rnd % 1000,
+            'user_info': {
+                'uname': f'用户{rnd % 1000}',
+                'face': 'https://i0.hdslb.com/bfs/face/member/noface.jpg',
+                'guard_level': 0,
+                'user_level': 20,
+            },
+            'background_bottom_color': '#2A60B2',
+            'background_color': '#EDF5FF',
+            'background_icon': '',
+            'background_image': 'https://i0.hdslb.com/bfs/live/a712efa5c6ebc67bafbe8352d3e74b820a00c13e.png',
+            'background_price_color': '#7497CD',
+        },
+    }
+
+
+def make_super_chat_delete_command(rnd: int) -> dict:
+    return {'cmd': 'SUPER_CHAT_MESSAGE_DELETE', 'data': {'ids': [rnd]}}
+
+
+def make_generic_command(cmd: str, rnd: int) -> dict:
+    """
+    blivedm不处理的cmd，只需要大小和结构差不多
+    """
+    return {
+        'cmd': cmd,
+        'data': {
+            'count': rnd % 10000,
+            'text_small': str(rnd % 10000),
+            'roomid': 30015166,
+            'timestamp': 1700000000 + rnd,
+            'uname': f'用户{rnd % 1000}',
+            'extra': {'a': [1, 2, 3], 'b': '', 'c': None},
+        },
+    }
+
+
+def _make_generic_command_factory(cmd: str) -> Callable[[int], dict]:
+    def factory(rnd: int) -> dict:
+        return make_generic_command(cmd, rnd)
+    return factory
+
+
+WEB_COMMAND_FACTORIES: Dict[str, Callable[[int], dict]] = {
+    '_HEARTBEAT': make_heartbeat_command,
+    'DANMU_MSG': make_danmaku_command,
+    'SEND_GIFT': make_gift_command,
+    'GUARD_BUY': make_guard_buy_command,
+    'SUPER_CHAT_MESSAGE': make_super_chat_command,
+    'SUPER_CHAT_MESSAGE_DELETE': make_super_chat_delete_command,
+}
+"""BaseHandler处理的web端cmd -> 生成函数"""
+
+CMD_MIX: Dict[str, float] = {
+    'INTERACT_WORD': 0.35,
+    'DANMU_MSG': 0.20,
+    'SEND_GIFT': 0.10,
+    'ONLINE_RANK_COUNT': 0.08,
+    'WATCHED_CHANGE': 0.05,
+    'ENTRY_EFFECT': 0.05,
+    'LIKE_INFO_V3_UPDATE': 0.05,
+    'COMBO_SEND': 0.03,
+    'STOP_LIVE_ROOM_LIST': 0.03,
+    'NOTICE_MSG': 0.02,
+    'ROOM_REAL_TIME_MESSAGE_UPDATE': 0.02,
+    'SUPER_CHAT_MESSAGE': 0.005,
+    'GUARD_BUY': 0.002,
+    'SUPER_CHAT_MESSAGE_DELETE': 0.003,
+}
+"""热门直播间里各cmd的大致比例"""
+
+
+def get_command_factory(cmd: str) -> Callable[[int], dict]:
+    if cmd in WEB_COMMAND_FACTORIES:
+        return WEB_COMMAND_FACTORIES[cmd]
+    if cmd == 'INTERACT_WORD':
+        return make_interact_word_command
+    return _make_generic_command_factory(cmd)
+
+
+def make_mixed_commands(n: int, seed: int = 0, mix: Optional[Dict[str, float]] = None) -> List[dict]:
+    """
+    按cmd比例生成业务消息
+
+    :param n: 消息数
+    :param seed: 随机数种子
+    :param mix: cmd -> 比例，None表示CMD_MIX
+    """
+    if mix is None:
+        mix = CMD_MIX
+    rand = random.Random(seed)
+    factories = [get_command_factory(cmd) for cmd in mix]
+    weights = list(mix.values())
+    return [factory(i) for i, factory in enumerate(rand.choices(factories, weights, k=n))]
+
+
+def make_mixed_frames(
+    n: int, seed: int = 0, mix: Optional[Dict[str, float]] = None, max_commands_per_frame: int = 30
+) -> List[bytes]:
+    """
+    生成按cmd比例的brotli压缩的WebSocket消息，每个消息的业务消息数在1~max_commands_per_frame之间随机
+
+    :param n: WebSocket消息数
+    :param seed: 随机数种子
+    :param mix: cmd -> 比例，None表示CMD_MIX
+    :param max_commands_per_frame: 每个WebSocket消息最多多少条业务消息
+    """
+    rand = random.Random(seed)
+    sizes = [rand.randint(1, max_commands_per_frame) for _ in range(n)]
+    commands = make_mixed_commands(sum(sizes), seed, mix)
+    res = []
+    offset = 0
+    for size in sizes:
+        res.append(make_brotli_frame(commands[offset: offset + size]))
+        offset += size
+    return res
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+检查已安装的JSON编解码器和标准库结果一致，然后测试每个编解码器的吞吐量
+
+用法：python -m benchmarks.json_codec [--messages 2000]
+"""
+import argparse
+import json
+import time
+from typing import *
+
+from blivedm import json_codec
+from . import frames
+
+PARITY_CORPUS: List[bytes] = [
+    b'{"cmd":"DANMU_MSG","info":[[0,1,25,16777215],"\\u4f60\\u597d",[1,"\\ud83d\\ude00"]]}',
+    '{"cmd":"SEND_GIFT","data":{"giftName":"小心心","num":1,"price":0.5,"rnd":"1700000000"}}'.encode('utf-8'),
+    b'{"code":0}',
+    b'{"code":-101,"message":"\\"quoted\\" \\\\ back\\/slash\\n"}',
+    b'{"int64":9223372036854775807,"uint64":18446744073709551615,"neg":-9223372036854775808}',
+    b'{"nan":NaN,"inf":-Infinity}',
+    b'{"float":1.5e300,"small":-0.0,"exp":1E-7}',
+    b'{"nested":{"a":[{"b":[[],{}]}],"t":true,"f":false,"n":null}}',
+    b'  {"cmd" : "WITH_SPACES" , "data" : [ 1 , 2 ] }  ',
+    b'{"dup":1,"dup":2}',
+    b'[]',
+    b'"just a string"',
+]
+"""边界情况，加上生成的真实消息一起检查一致性"""
+
+BIG_INT_CORPUS: List[bytes] = [
+    b'{"big":123456789012345678901234567890,"neg":-9223372036854775809}',
+]
+"""超过64位的整数，orjson会解析成float，只打印不一致的编解码器"""
+
+
+def find_mismatch(codec: json_codec.JsonCodec, data: bytes) -> Optional[str]:
+    expected = json.loads(data)
+    for variant in (data, memoryview(data), data.decode('utf-8')):
+        actual = codec.loads(variant)
+        if repr(actual) != repr(expected):  # 用repr比较，这样NaN和-0.0也能比较
+            return f'{codec.name}.loads({variant!r}) = {actual!r}, expected {expected!r}'
+
+    # 序列化的格式可以不一样，但是反序列化回来要一样。NaN不是标准JSON，不要求能序列化
+    if 'NaN' in repr(expected) or 'inf' in repr(expected):
+        return None
+    for other in (json_codec.StdlibJsonCodec(), codec):
+        round_trip = other.loads(codec.dumps(expected))
+        if repr(round_trip) != repr(expected):
+            return f'{codec.name}.dumps({expected!r}) round trip by {other.name} = {round_trip!r}'
+    return None
+
+
+def check_parity(codec: json_codec.JsonCodec, corpus: List[bytes]):
+    for data in corpus:
+        mismatch = find_mismatch(codec, data)
+        if mismatch is not None:
+            raise AssertionError(mismatch)
+    for data in BIG_INT_CORPUS:
+        mismatch = find_mismatch(codec, data)
+        if mismatch is not None:
+            print(f'known mismatch: {mismatch}')
+
+
+def measure_throughput(func: Callable[[Any], Any], inputs: list, total_bytes: int, repeat: int) -> Tuple[float, float]:
+    """
+    :return: (MB/s, 每条消息微秒数)，取repeat次中最快的
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for item in inputs:
+            func(item)
+        best = min(best, time.perf_counter() - start)
+    return total_bytes / best / 1e6, best / len(inputs) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    commands = frames.make_commands(args.messages)
+    bodies = [json.dumps(command, ensure_ascii=False).encode('utf-8') for command in commands]
+    views = [memoryview(body) for body in bodies]
+    total_bytes = sum(len(body) for body in bodies)
+
+    names = json_codec.get_available_codec_names()
+    print(f'available codecs: {names}, default: {json_codec.get_default_codec().name}')
+    print(f'{args.messages} messages, {total_bytes / args.messages:.0f} bytes/message\n')
+    print(f'{"codec":10}{"loads MB/s":>12}{"loads us":>10}{"dumps MB/s":>12}{"dumps us":>10}')
+    for name in names:
+        codec = json_codec.get_codec(name)
+        check_parity(codec, PARITY_CORPUS + bodies[:200])
+        loads_mbps, loads_us = measure_throughput(codec.loads, views, total_bytes, args.repeat)
+        dumps_mbps, dumps_us = measure_throughput(codec.dumps, commands, total_bytes, args.repeat)
+        print(f'{name:10}{loads_mbps:12.1f}{loads_us:10.2f}{dumps_mbps:12.1f}{dumps_us:10.2f}')
+
+
+if __name__ == '__main__':
+    main()
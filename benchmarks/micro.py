@@ -0,0 +1,367 @@
+# -*- coding: utf-8 -*-
+"""
+微基准测试：分包、解压、JSON反序列化、BaseHandler分发、每个消息类型的from_command、按真实cmd比例的完整解析流程、统计的开销
+
+结果可以保存成JSON，用来对比不同提交的性能
+
+用法：python -m benchmarks.micro [--filter json] [--output result.json] [--compare old.json]
+"""
+import argparse
+import asyncio
+import dataclasses
+import gc
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import zlib
+from typing import *
+
+import brotli
+
+import blivedm
+from blivedm import json_codec
+from blivedm.clients import ws_base
+from . import frames
+
+
+class Case(NamedTuple):
+    name: str
+    """分组.名字"""
+    func: Callable[[], Any]
+    """执行一次操作"""
+    ops_per_call: int = 1
+    """调用一次func相当于多少次操作"""
+
+
+_cleanup_callbacks: List[Callable[[], Any]] = []
+"""所有用例运行完后调用，释放用例创建的资源"""
+
+
+def measure(func: Callable[[], Any], repeat: int, min_time: float) -> List[float]:
+    """
+    :return: 每次重复里每次调用的秒数
+    """
+    # 先找到总耗时超过min_time的调用次数
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        number *= 2 if elapsed == 0 else max(2, min(10, int(min_time / elapsed) + 1))
+
+    res = []
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for _ in range(number):
+                func()
+            res.append((time.perf_counter() - start) / number)
+    finally:
+        if gc_enabled:
+            gc.enable()
+    return res
+
+
+#
+# 测试用例
+#
+
+def make_protocol_cases() -> List[Case]:
+    commands = frames.make_mixed_commands(50)
+    payload = frames.make_normal_payload(commands)
+    header_data = payload[:ws_base.HEADER_STRUCT.size]
+
+    def unpack_header():
+        ws_base.HeaderTuple(*ws_base.HEADER_STRUCT.unpack_from(header_data, 0))
+
+    def split_packets():
+        for _packet in ws_base.iter_packets(payload):
+            pass
+
+    return [
+        Case('protocol.unpack_header', unpack_header),
+        Case('protocol.iter_packets_50', split_packets, len(commands)),
+    ]
+
+
+def make_decompress_cases() -> List[Case]:
+    payload = frames.make_normal_payload(frames.make_mixed_commands(30))
+    brotli_body = brotli.compress(payload)
+    zlib_body = zlib.compress(payload)
+    return [
+        Case(f'decompress.brotli_{len(payload)}B', lambda: brotli.decompress(brotli_body)),
+        Case(f'decompress.zlib_{len(payload)}B', lambda: zlib.decompress(zlib_body)),
+    ]
+
+
+def make_json_cases() -> List[Case]:
+    cases = []
+    codecs = [json_codec.get_codec(name) for name in json_codec.get_available_codec_names()]
+    cmds = list(frames.WEB_COMMAND_FACTORIES) + ['INTERACT_WORD']
+    for cmd in cmds:
+        body = memoryview(json.dumps(frames.get_command_factory(cmd)(1), ensure_ascii=False).encode('utf-8'))
+        for codec in codecs:
+            cases.append(Case(f'json.{codec.name}.{cmd}', lambda loads=codec.loads, body=body: loads(body)))
+    return cases
+
+
+def _get_open_live_command(cmd: str, message_cls) -> dict:
+    """
+    开放平台消息的字段名和JSON的键一样，用默认值构造一个再转成dict
+    """
+    return {'cmd': cmd, 'data': dataclasses.asdict(message_cls())}
+
+
+def get_model_commands() -> Dict[str, dict]:
+    """
+    BaseHandler处理的每个cmd -> 样例消息
+    """
+    res = {}
+    for cmd, callback in blivedm.BaseHandler._CMD_CALLBACK_DICT.items():  # noqa
+        message_cls = getattr(callback, 'message_cls', None)
+        if message_cls is None:
+            continue
+        if cmd in frames.WEB_COMMAND_FACTORIES:
+            res[cmd] = frames.WEB_COMMAND_FACTORIES[cmd](1)
+        else:
+            res[cmd] = _get_open_live_command(cmd, message_cls)
+    return res
+
+
+def make_model_cases() -> List[Case]:
+    cases = []
+    for cmd, command in get_model_commands().items():
+        callback = blivedm.BaseHandler._CMD_CALLBACK_DICT[cmd]  # noqa
+        message_cls = callback.message_cls
+        data = command[callback.data_key]
+        module_name = message_cls.__module__.rsplit('.', 1)[-1]
+        cases.append(Case(
+            f'model.{module_name}.{message_cls.__name__}.from_command',
+            lambda from_command=message_cls.from_command, data=data: from_command(data),
+        ))
+    return cases
+
+
+class _CountingHandler(blivedm.BaseHandler):
+    """
+    重写所有_on_xxx方法，这样每条消息都会构造消息对象
+    """
+
+    def __init__(self):
+        self.count = 0
+
+    def _count(self, client, message):
+        self.count += 1
+
+
+for _callback in blivedm.BaseHandler._CMD_CALLBACK_DICT.values():  # noqa
+    if getattr(_callback, 'method_name', None) is not None:
+        setattr(_CountingHandler, _callback.method_name, _CountingHandler._count)  # noqa
+
+
+def make_dispatch_cases() -> List[Case]:
+    client = ws_base.WebSocketClientBase.__new__(ws_base.WebSocketClientBase)
+    client._room_id = 1  # noqa
+    client._parsed_messages = None  # noqa
+    handler = _CountingHandler()
+    cases = []
+    for cmd, command in get_model_commands().items():
+        cases.append(Case(f'dispatch.{cmd}', lambda command=command: handler.handle(client, command)))
+
+    # BaseHandler不处理的cmd，只有查表的开销
+    blivedm.handlers.logged_unknown_cmds.add('ONLINE_RANK_COUNT')
+    unknown_command = frames.make_generic_command('ONLINE_RANK_COUNT', 1)
+    cases.append(Case('dispatch.unhandled', lambda: handler.handle(client, unknown_command)))
+
+    mixed = frames.make_mixed_commands(1000)
+    for command in mixed:
+        blivedm.handlers.logged_unknown_cmds.add(command['cmd'])
+
+    def dispatch_mixed():
+        handle = handler.handle
+        for command in mixed:
+            handle(client, command)
+    cases.append(Case('dispatch.mixed_1000', dispatch_mixed, len(mixed)))
+    return cases
+
+
+def make_pipeline_cases() -> List[Case]:
+    mixed_frames = frames.make_mixed_frames(100)
+    message_count = 0
+    for frame in mixed_frames:
+        for _ in ws_base.iter_packets(brotli.decompress(memoryview(frame)[ws_base.HEADER_STRUCT.size:])):
+            message_count += 1
+
+    loop = asyncio.new_event_loop()
+    cases = []
+    for name, handler in (('all_cmds', _CountingHandler()), ('wanted_cmds', blivedm.BaseHandler())):
+        client = loop.run_until_complete(_make_client(handler))
+        _cleanup_callbacks.append(lambda client=client: loop.run_until_complete(client.close()))
+
+        async def parse_all(client=client):
+            for frame in mixed_frames:
+                await client._parse_ws_message(frame)  # noqa
+
+        cases.append(Case(
+            f'pipeline.parse_ws_message_{name}',
+            lambda parse_all=parse_all: loop.run_until_complete(parse_all()),
+            message_count,
+        ))
+
+    # 记录耗时的开销，和客户端收到WebSocket消息时一样先调用on_frame，对比上面不调用on_frame、从不记录耗时的all_cmds
+    for timing_sample_interval in (1, 16):
+        client = loop.run_until_complete(_make_client(_CountingHandler()))
+        _cleanup_callbacks.append(lambda client=client: loop.run_until_complete(client.close()))
+        metrics = blivedm.ClientMetrics(timing_sample_interval)
+        client.set_metrics(metrics)
+
+        async def parse_all_with_metrics(client=client, metrics=metrics):
+            for frame in mixed_frames:
+                metrics.on_frame(len(frame))
+                await client._parse_ws_message(frame)  # noqa
+
+        cases.append(Case(
+            f'pipeline.parse_ws_message_all_cmds_timing_1_in_{timing_sample_interval}',
+            lambda parse_all=parse_all_with_metrics: loop.run_until_complete(parse_all()),
+            message_count,
+        ))
+    _cleanup_callbacks.append(loop.close)
+    return cases
+
+
+def make_metrics_cases() -> List[Case]:
+    metrics = blivedm.ClientMetrics()
+    histogram = blivedm.Histogram()
+    values = [int(value) for value in (1e3, 5e4, 2e5, 1e6, 3e7)]
+
+    def record_values():
+        record = histogram.record
+        for value in values:
+            record(value)
+
+    def timed_noop():
+        # 抽样到的WebSocket消息每个计时点的开销
+        start_time = time.perf_counter_ns()
+        metrics.json_decode_time.record(time.perf_counter_ns() - start_time)
+
+    def count_frame():
+        # 没抽样到的WebSocket消息的全部开销：on_frame加上按WebSocket消息累加的计数
+        metrics.on_frame(1000)
+        metrics.compressed_bytes += 1000
+        metrics.decompressed_bytes += 4000
+        metrics.decoded_messages += 17
+
+    return [
+        Case('metrics.on_frame', lambda: metrics.on_frame(1000)),
+        Case('metrics.count_frame', count_frame),
+        Case('metrics.histogram_record', record_values, len(values)),
+        Case('metrics.timed_noop', timed_noop),
+    ]
+
+
+async def _make_client(handler) -> ws_base.WebSocketClientBase:
+    client = ws_base.WebSocketClientBase()
+    client._room_id = 1  # noqa
+    client.set_handler(handler)
+    # 大包也在事件循环线程解压，只测CPU耗时
+    client.set_decompressor(blivedm.decompressor.Decompressor(inline_threshold=1 << 30))
+    for cmd in frames.CMD_MIX:
+        blivedm.handlers.logged_unknown_cmds.add(cmd)
+    return client
+
+
+CASE_GROUPS: Dict[str, Callable[[], List[Case]]] = {
+    'protocol': make_protocol_cases,
+    'decompress': make_decompress_cases,
+    'json': make_json_cases,
+    'model': make_model_cases,
+    'dispatch': make_dispatch_cases,
+    'pipeline': make_pipeline_cases,
+    'metrics': make_metrics_cases,
+}
+
+
+#
+# 运行和输出
+#
+
+def get_git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True, timeout=10
+        ).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run_cases(cases: List[Case], repeat: int, min_time: float) -> Dict[str, dict]:
+    results = {}
+    for case in cases:
+        times = [t / case.ops_per_call for t in measure(case.func, repeat, min_time)]
+        best = min(times)
+        results[case.name] = {
+            'ns_per_op': best * 1e9,
+            'median_ns_per_op': statistics.median(times) * 1e9,
+            'ops_per_sec': 1 / best if best > 0 else float('inf'),
+        }
+        print(f'{case.name:70}{best * 1e9:12.1f} ns/op')
+    return results
+
+
+def print_comparison(results: Dict[str, dict], old_results: Dict[str, dict]):
+    print(f'\n{"case":70}{"old ns/op":>12}{"new ns/op":>12}{"change":>9}')
+    for name, result in results.items():
+        old = old_results.get(name, None)
+        if old is None:
+            continue
+        change = result['ns_per_op'] / old['ns_per_op'] - 1
+        print(f'{name:70}{old["ns_per_op"]:12.1f}{result["ns_per_op"]:12.1f}{change:+9.1%}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--filter', default='', help='只运行名字包含这个字符串的用例')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--min-time', type=float, default=0.05, help='每次重复至少运行多少秒')
+    parser.add_argument('--output', help='把结果保存到这个JSON文件')
+    parser.add_argument('--compare', help='和之前保存的JSON文件对比')
+    args = parser.parse_args()
+
+    cases = [
+        case
+        for make_cases in CASE_GROUPS.values()
+        for case in make_cases()
+        if args.filter in case.name
+    ]
+    try:
+        results = run_cases(cases, args.repeat, args.min_time)
+    finally:
+        for callback in _cleanup_callbacks:
+            callback()
+
+    report = {
+        'revision': get_git_revision(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': sys.version,
+        'platform': platform.platform(),
+        'json_codec': json_codec.get_default_codec().name,
+        'results': results,
+    }
+    if args.output is not None:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    if args.compare is not None:
+        with open(args.compare, encoding='utf-8') as f:
+            print_comparison(results, json.load(f)['results'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,413 @@
+# -*- coding: utf-8 -*-
+"""
+本地模拟的弹幕服务器，实现和B站一样的二进制协议，用来做压力测试和故障注入
+
+支持认证、心跳回复人气值、按设定的速率推送brotli/deflate压缩的业务消息、注入断线和认证失败。
+客户端用BLiveClient(host_server_list=server.host_server_list, use_wss=False)连接
+
+一台机器模拟上万个连接时要调高文件描述符限制，例如`ulimit -n 65536`
+
+用法：python -m benchmarks.mock_danmaku_server [--port 2244] [--message-rate 10] [--compression brotli]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import random
+import struct
+import weakref
+from typing import *
+
+import aiohttp
+import aiohttp.web
+
+from blivedm.clients import ws_base
+from . import frames
+
+logger = logging.getLogger('blivedm.mock')
+
+_HEARTBEAT_REPLY_SUFFIX = b'[object Object]'
+"""服务器心跳回复人气值后面跟着的内容"""
+
+COMPRESSION_NAMES = {
+    'none': ws_base.ProtoVer.NORMAL,
+    'deflate': ws_base.ProtoVer.DEFLATE,
+    'brotli': ws_base.ProtoVer.BROTLI,
+}
+
+
+class _Connection:
+    def __init__(self, websocket: aiohttp.web.WebSocketResponse, room_id: int):
+        self.websocket = websocket
+        self.room_id = room_id
+        self.push_task: Optional[asyncio.Task] = None
+        self.disconnect_timer_handle: Optional[asyncio.TimerHandle] = None
+
+
+class MockDanmakuServer:
+    """
+    模拟的弹幕服务器
+
+    :param host: 监听的地址
+    :param port: 监听的端口，0表示随机选一个空闲端口
+    :param message_rate: 每个房间每秒推送多少条业务消息，0表示不推送
+    :param commands_per_frame: 每个WebSocket消息打包多少条业务消息
+    :param compression: 业务消息的压缩方式，ProtoVer.BROTLI、DEFLATE或NORMAL
+    :param popularity: 心跳回复的人气值
+    :param auth_timeout: 连接后多少秒内没收到认证包则断开
+    :param auth_delay: 收到认证包后等多少秒再回复，模拟慢的服务器
+    :param heartbeat_timeout: 多少秒没收到客户端的消息则断开
+    :param auth_failure_rate: 认证随机失败的概率，0~1
+    :param required_token: 认证包必须带这个key，None表示不检查
+    :param disconnect_interval: 每个连接平均多少秒后被服务器断开（指数分布），None表示不主动断开
+    :param frame_pool_size: 预先生成多少个WebSocket消息循环推送，避免服务器在压缩上花太多CPU
+    :param seed: 随机数种子
+    """
+
+    def __init__(
+        self,
+        host: str = '127.0.0.1',
+        port: int = 0,
+        *,
+        message_rate: float = 10.0,
+        commands_per_frame: int = 10,
+        compression: int = ws_base.ProtoVer.BROTLI,
+        popularity: int = 1,
+        auth_timeout: float = 5.0,
+        auth_delay: float = 0.0,
+        heartbeat_timeout: float = 70.0,
+        auth_failure_rate: float = 0.0,
+        required_token: Optional[str] = None,
+        disconnect_interval: Optional[float] = None,
+        frame_pool_size: int = 64,
+        seed: int = 0,
+    ):
+        if compression not in COMPRESSION_NAMES.values():
+            raise ValueError(f'unsupported compression {compression}')
+        self._host = host
+        self._port = port
+        self._message_rate = message_rate
+        self._commands_per_frame = commands_per_frame
+        self._compression = compression
+        self._popularity = popularity
+        self._auth_timeout = auth_timeout
+        self._auth_delay = auth_delay
+        self._heartbeat_timeout = heartbeat_timeout
+        self._auth_failure_rate = auth_failure_rate
+        self._required_token = required_token
+        self._disconnect_interval = disconnect_interval
+
+        self._random = random.Random(seed)
+        self._frame_pool = self._make_frame_pool(frame_pool_size, seed)
+        """循环推送的WebSocket消息"""
+        self._runner: Optional[aiohttp.web.AppRunner] = None
+        self._connections: Dict[int, Set[_Connection]] = {}
+        """room_id -> 认证成功的连接"""
+        self._websockets: weakref.WeakSet = weakref.WeakSet()
+        """所有连接，包括还没认证的"""
+        self._fail_auth_counts: Dict[int, int] = {}
+        """room_id -> 接下来还要认证失败多少次"""
+
+        # 统计
+        self._total_connections = 0
+        self._auth_succeeded = 0
+        self._auth_failed = 0
+        self._frames_sent = 0
+        self._bytes_sent = 0
+        self._heartbeats = 0
+        self._injected_disconnects = 0
+
+    def _make_frame_pool(self, size: int, seed: int) -> List[bytes]:
+        commands = frames.make_mixed_commands(size * self._commands_per_frame, seed)
+        res = []
+        for i in range(size):
+            chunk = commands[i * self._commands_per_frame: (i + 1) * self._commands_per_frame]
+            if self._compression == ws_base.ProtoVer.BROTLI:
+                res.append(frames.make_brotli_frame(chunk))
+            elif self._compression == ws_base.ProtoVer.DEFLATE:
+                res.append(frames.make_deflate_frame(chunk))
+            else:
+                res.append(frames.make_normal_payload(chunk))
+        return res
+
+    @property
+    def port(self) -> int:
+        """
+        实际监听的端口，start()后可用
+        """
+        return self._port
+
+    @property
+    def url(self) -> str:
+        return f'ws://{self._host}:{self._port}/sub'
+
+    @property
+    def host_server_list(self) -> List[dict]:
+        """
+        和getDanmuInfo返回的格式一样的服务器列表，传给BLiveClient的host_server_list
+        """
+        return [{'host': self._host, 'port': self._port, 'wss_port': self._port, 'ws_port': self._port}]
+
+    @property
+    def stats(self) -> dict:
+        """
+        统计信息的快照
+        """
+        return {
+            'connections': len(self._websockets),
+            'authed_connections': sum(len(conns) for conns in self._connections.values()),
+            'rooms': len(self._connections),
+            'total_connections': self._total_connections,
+            'auth_succeeded': self._auth_succeeded,
+            'auth_failed': self._auth_failed,
+            'frames_sent': self._frames_sent,
+            'bytes_sent': self._bytes_sent,
+            'heartbeats': self._heartbeats,
+            'injected_disconnects': self._injected_disconnects,
+        }
+
+    def set_message_rate(self, message_rate: float):
+        """
+        修改每个房间每秒推送的业务消息数，对已有的连接也生效
+        """
+        self._message_rate = message_rate
+
+    def fail_next_auth(self, room_id: int, count: int = 1):
+        """
+        让这个房间接下来的count次认证失败
+        """
+        self._fail_auth_counts[room_id] = self._fail_auth_counts.get(room_id, 0) + count
+
+    async def disconnect_room(self, room_id: int) -> int:
+        """
+        断开这个房间的所有连接
+
+        :return: 断开的连接数
+        """
+        conns = list(self._connections.get(room_id, ()))
+        for conn in conns:
+            await self._inject_disconnect(conn)
+        return len(conns)
+
+    async def disconnect_all(self) -> int:
+        """
+        断开所有认证成功的连接
+
+        :return: 断开的连接数
+        """
+        conns = [conn for room_conns in self._connections.values() for conn in room_conns]
+        await asyncio.gather(*(self._inject_disconnect(conn) for conn in conns))
+        return len(conns)
+
+    async def start(self):
+        app = aiohttp.web.Application()
+        app.router.add_get('/sub', self._handle_websocket)
+        self._runner = aiohttp.web.AppRunner(app, handle_signals=False)
+        await self._runner.setup()
+        # 大量连接同时建立时默认的backlog不够
+        site = aiohttp.web.TCPSite(self._runner, self._host, self._port, backlog=4096)
+        await site.start()
+        if self._port == 0:
+            self._port = site._server.sockets[0].getsockname()[1]  # noqa
+        logger.info('mock danmaku server is listening on %s', self.url)
+
+    async def close(self):
+        if self._runner is None:
+            return
+        await self._runner.cleanup()
+        self._runner = None
+
+    async def _handle_websocket(self, request: aiohttp.web.Request):
+        websocket = aiohttp.web.WebSocketResponse()
+        await websocket.prepare(request)
+        self._total_connections += 1
+        self._websockets.add(websocket)
+
+        room_id = await self._authenticate(websocket)
+        if room_id is None:
+            await websocket.close()
+            return websocket
+
+        conn = _Connection(websocket, room_id)
+        room_conns = self._connections.get(room_id, None)
+        if room_conns is None:
+            room_conns = self._connections[room_id] = set()
+        room_conns.add(conn)
+        if self._message_rate > 0:
+            conn.push_task = asyncio.create_task(self._push_loop(conn))
+        if self._disconnect_interval is not None:
+            conn.disconnect_timer_handle = asyncio.get_running_loop().call_later(
+                self._random.expovariate(1 / self._disconnect_interval),
+                lambda: asyncio.create_task(self._inject_disconnect(conn))
+            )
+
+        try:
+            await self._receive_loop(conn)
+        finally:
+            if conn.push_task is not None:
+                conn.push_task.cancel()
+            if conn.disconnect_timer_handle is not None:
+                conn.disconnect_timer_handle.cancel()
+            room_conns.discard(conn)
+            if not room_conns:
+                self._connections.pop(room_id, None)
+            await websocket.close()
+        return websocket
+
+    async def _authenticate(self, websocket: aiohttp.web.WebSocketResponse) -> Optional[int]:
+        """
+        :return: 认证成功则返回room_id
+        """
+        try:
+            message = await websocket.receive(timeout=self._auth_timeout)
+        except asyncio.TimeoutError:
+            return None
+        if message.type != aiohttp.WSMsgType.BINARY:
+            return None
+        try:
+            header = ws_base.HeaderTuple(*ws_base.HEADER_STRUCT.unpack_from(message.data, 0))
+            if header.operation != ws_base.Operation.AUTH:
+                return None
+            body = json.loads(message.data[header.raw_header_size: header.pack_len])
+            room_id = int(body['roomid'])
+        except (struct.error, ValueError, KeyError, TypeError):
+            logger.warning('mock server received invalid auth packet: %s', message.data)
+            return None
+
+        if self._auth_delay > 0:
+            await asyncio.sleep(self._auth_delay)
+        if self._should_fail_auth(room_id, body):
+            self._auth_failed += 1
+            await self._send_auth_reply(websocket, ws_base.AuthReplyCode.TOKEN_ERROR)
+            return None
+        self._auth_succeeded += 1
+        await self._send_auth_reply(websocket, ws_base.AuthReplyCode.OK)
+        return room_id
+
+    def _should_fail_auth(self, room_id: int, body: dict) -> bool:
+        count = self._fail_auth_counts.get(room_id, 0)
+        if count > 0:
+            if count == 1:
+                del self._fail_auth_counts[room_id]
+            else:
+                self._fail_auth_counts[room_id] = count - 1
+            return True
+        if self._required_token is not None and body.get('key', None) != self._required_token:
+            return True
+        return self._auth_failure_rate > 0 and self._random.random() < self._auth_failure_rate
+
+    async def _send_auth_reply(self, websocket: aiohttp.web.WebSocketResponse, code: int):
+        body = json.dumps({'code': code}).encode('utf-8')
+        await self._send(websocket, frames.make_packet(body, ws_base.Operation.AUTH_REPLY, ws_base.ProtoVer.HEARTBEAT))
+
+    async def _receive_loop(self, conn: _Connection):
+        websocket = conn.websocket
+        while True:
+            try:
+                message = await websocket.receive(timeout=self._heartbeat_timeout)
+            except asyncio.TimeoutError:
+                logger.info('room=%d mock server heartbeat timeout', conn.room_id)
+                return
+            if message.type in (aiohttp.WSMsgType.CLOSE, aiohttp.WSMsgType.CLOSING, aiohttp.WSMsgType.CLOSED,
+                                aiohttp.WSMsgType.ERROR):
+                return
+            if message.type != aiohttp.WSMsgType.BINARY:
+                continue
+            try:
+                header = ws_base.HeaderTuple(*ws_base.HEADER_STRUCT.unpack_from(message.data, 0))
+            except struct.error:
+                continue
+            if header.operation == ws_base.Operation.HEARTBEAT:
+                self._heartbeats += 1
+                await self._send_heartbeat_reply(websocket)
+
+    async def _send_heartbeat_reply(self, websocket: aiohttp.web.WebSocketResponse):
+        # 和真的服务器一样，pack_len不包括人气值后面的内容
+        header = ws_base.HEADER_STRUCT.pack(*ws_base.HeaderTuple(
+            pack_len=ws_base.HEADER_STRUCT.size + 4,
+            raw_header_size=ws_base.HEADER_STRUCT.size,
+            ver=ws_base.ProtoVer.HEARTBEAT,
+            operation=ws_base.Operation.HEARTBEAT_REPLY,
+            seq_id=0,
+        ))
+        await self._send(websocket, header + self._popularity.to_bytes(4, 'big') + _HEARTBEAT_REPLY_SUFFIX)
+
+    async def _push_loop(self, conn: _Connection):
+        loop = asyncio.get_running_loop()
+        frame_pool = self._frame_pool
+        index = self._random.randrange(len(frame_pool))
+        # 错开各个连接的推送时间
+        next_time = loop.time() + self._random.random() * self._commands_per_frame / self._message_rate
+        while not conn.websocket.closed:
+            delay = next_time - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if self._message_rate <= 0:
+                await asyncio.sleep(1)
+                next_time = loop.time()
+                continue
+            # 落后太多时不补发，否则恢复后会集中推送
+            next_time = max(next_time + self._commands_per_frame / self._message_rate, loop.time() - 1)
+            if not await self._send(conn.websocket, frame_pool[index]):
+                return
+            index = (index + 1) % len(frame_pool)
+
+    async def _send(self, websocket: aiohttp.web.WebSocketResponse, data: bytes) -> bool:
+        try:
+            await websocket.send_bytes(data)
+        except (ConnectionResetError, RuntimeError):
+            # 连接已经关闭
+            return False
+        self._frames_sent += 1
+        self._bytes_sent += len(data)
+        return True
+
+    async def _inject_disconnect(self, conn: _Connection):
+        if conn.websocket.closed:
+            return
+        self._injected_disconnects += 1
+        await conn.websocket.close()
+
+
+async def _run_forever(server: MockDanmakuServer, stats_interval: float):
+    await server.start()
+    try:
+        while True:
+            await asyncio.sleep(stats_interval)
+            logger.info('mock server stats: %s', server.stats)
+    finally:
+        await server.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=2244)
+    parser.add_argument('--message-rate', type=float, default=10.0, help='每个房间每秒推送多少条业务消息')
+    parser.add_argument('--commands-per-frame', type=int, default=10)
+    parser.add_argument('--compression', choices=list(COMPRESSION_NAMES), default='brotli')
+    parser.add_argument('--auth-failure-rate', type=float, default=0.0)
+    parser.add_argument('--auth-delay', type=float, default=0.0, help='收到认证包后等多少秒再回复')
+    parser.add_argument('--disconnect-interval', type=float, default=None, help='每个连接平均多少秒后断开')
+    parser.add_argument('--stats-interval', type=float, default=10.0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    server = MockDanmakuServer(
+        args.host,
+        args.port,
+        message_rate=args.message_rate,
+        commands_per_frame=args.commands_per_frame,
+        compression=COMPRESSION_NAMES[args.compression],
+        auth_failure_rate=args.auth_failure_rate,
+        auth_delay=args.auth_delay,
+        disconnect_interval=args.disconnect_interval,
+    )
+    try:
+        asyncio.run(_run_forever(server, args.stats_interval))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
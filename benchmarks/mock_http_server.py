@@ -0,0 +1,480 @@
+# -*- coding: utf-8 -*-
+"""
+本地模拟的B站HTTP接口，用来离线测试和性能测试房间初始化
+
+实现了BLiveClient.init_room用到的nav、B站首页、getInfoByRoom、getDanmuInfo，
+以及OpenLiveClient用到的/v2/app/start、/v2/app/heartbeat、/v2/app/end。
+可以设置延迟、注入错误码（例如-101、7003、7000）、限流
+
+客户端用web.set_base_urls(server.url, server.url, server.url)和open_live.set_base_url(server.url)指向模拟服务器。
+注意B站的cookie是发给域名的，客户端的session要用aiohttp.CookieJar(unsafe=True)才能保存127.0.0.1发的cookie
+
+用法：python -m benchmarks.mock_http_server [--port 8080] [--latency 0.05] [--rate-limit 100]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import random
+import threading
+import time
+import uuid
+import zlib
+from typing import *
+
+import aiohttp.web
+
+logger = logging.getLogger('blivedm.mock')
+
+ENDPOINT_PATHS = {
+    'nav': '/x/web-interface/nav',
+    'home': '/',
+    'room_init': '/xlive/web-room/v1/index/getInfoByRoom',
+    'danmu_info': '/xlive/web-room/v1/index/getDanmuInfo',
+    'start': '/v2/app/start',
+    'heartbeat': '/v2/app/heartbeat',
+    'end': '/v2/app/end',
+}
+"""接口名 -> 路径"""
+_ENDPOINT_NAMES = {path: name for name, path in ENDPOINT_PATHS.items()}
+
+ERROR_MESSAGES = {
+    -101: '账号未登录',
+    -400: '请求错误',
+    -412: '请求被拦截',
+    7000: '项目已经结束',
+    7003: '心跳过期或GameId错误',
+}
+
+DEFAULT_WBI_IMG = {
+    'img_url': 'https://i0.hdslb.com/bfs/wbi/7cd084941338484aae1ad9425b84077c.png',
+    'sub_url': 'https://i0.hdslb.com/bfs/wbi/4932caff0ff746eab6f01bf08b70ac45.png',
+}
+
+
+class _InjectedError(NamedTuple):
+    code: int
+    """JSON的code，如果是HTTP状态码（>=400且<600）则直接返回这个状态码"""
+    remaining: Optional[int]
+    """还要返回多少次，None表示一直返回"""
+
+
+class _Game:
+    def __init__(self, game_id: str, room_id: int):
+        self.game_id = game_id
+        self.room_id = room_id
+        self.last_heartbeat_time = time.monotonic()
+
+
+class MockHttpServer:
+    """
+    模拟的B站HTTP接口
+
+    :param host: 监听的地址
+    :param port: 监听的端口，0表示随机选一个空闲端口
+    :param latency: 每个请求的平均延迟（秒）
+    :param latency_jitter: 延迟在[latency - jitter, latency + jitter]之间均匀分布
+    :param rate_limit: 每秒最多处理多少个请求，超过的返回HTTP 412，和B站的风控一样。None表示不限流
+    :param rate_limit_burst: 限流的令牌桶容量
+    :param host_server_list: getDanmuInfo返回的弹幕服务器列表，例如模拟弹幕服务器的host_server_list
+    :param danmaku_token: getDanmuInfo返回的token
+    :param open_live_ws_urls: /v2/app/start返回的弹幕服务器URL列表
+    :param game_heartbeat_timeout: 开放平台项目多少秒没收到心跳则过期，之后心跳返回7003
+    :param home_page_size: 模拟的B站首页大小，真的首页有几百KB
+    :param seed: 随机数种子
+    """
+
+    def __init__(
+        self,
+        host: str = '127.0.0.1',
+        port: int = 0,
+        *,
+        latency: float = 0.0,
+        latency_jitter: float = 0.0,
+        rate_limit: Optional[float] = None,
+        rate_limit_burst: int = 10,
+        host_server_list: Optional[List[dict]] = None,
+        danmaku_token: str = 'mock-token',
+        open_live_ws_urls: Optional[List[str]] = None,
+        game_heartbeat_timeout: float = 60.0,
+        home_page_size: int = 256 * 1024,
+        seed: int = 0,
+    ):
+        self._host = host
+        self._port = port
+        self._latency = latency
+        self._latency_jitter = latency_jitter
+        self._rate_limit = rate_limit
+        self._rate_limit_burst = rate_limit_burst
+        self._host_server_list = host_server_list if host_server_list is not None else [
+            {'host': 'broadcastlv.chat.bilibili.com', 'port': 2243, 'wss_port': 443, 'ws_port': 2244}
+        ]
+        self._danmaku_token = danmaku_token
+        self._open_live_ws_urls = open_live_ws_urls if open_live_ws_urls is not None else [
+            'wss://broadcastlv.chat.bilibili.com:443/sub'
+        ]
+        self._game_heartbeat_timeout = game_heartbeat_timeout
+        self._home_page = b'<!DOCTYPE html><html>' + b' ' * home_page_size + b'</html>'
+
+        self._random = random.Random(seed)
+        self._runner: Optional[aiohttp.web.AppRunner] = None
+        self._errors: Dict[str, _InjectedError] = {}
+        """接口名 -> 注入的错误"""
+        self._tokens = float(rate_limit_burst)
+        """限流的令牌桶里剩下的令牌"""
+        self._tokens_update_time = time.monotonic()
+        self._games: Dict[str, _Game] = {}
+        """game_id -> 开放平台项目"""
+
+        # 统计
+        self._requests: Dict[str, int] = {name: 0 for name in ENDPOINT_PATHS}
+        """接口名 -> 请求数"""
+        self._rate_limited = 0
+        self._injected_errors = 0
+
+    @property
+    def port(self) -> int:
+        """
+        实际监听的端口，start()后可用
+        """
+        return self._port
+
+    @property
+    def url(self) -> str:
+        return f'http://{self._host}:{self._port}'
+
+    @property
+    def stats(self) -> dict:
+        """
+        统计信息的快照
+        """
+        return {
+            'requests': dict(self._requests),
+            'total_requests': sum(self._requests.values()),
+            'rate_limited': self._rate_limited,
+            'injected_errors': self._injected_errors,
+            'games': len(self._games),
+        }
+
+    def reset_stats(self):
+        for name in self._requests:
+            self._requests[name] = 0
+        self._rate_limited = 0
+        self._injected_errors = 0
+
+    def set_latency(self, latency: float, latency_jitter: float = 0.0):
+        self._latency = latency
+        self._latency_jitter = latency_jitter
+
+    def set_error(self, endpoint: str, code: int, count: Optional[int] = None):
+        """
+        让一个接口返回错误
+
+        :param endpoint: 接口名，见ENDPOINT_PATHS
+        :param code: JSON里的code，例如-101、7003、7000；400~599表示直接返回这个HTTP状态码
+        :param count: 返回多少次错误后恢复正常，None表示一直返回直到clear_error
+        """
+        if endpoint not in ENDPOINT_PATHS:
+            raise ValueError(f'unknown endpoint {endpoint}')
+        self._errors[endpoint] = _InjectedError(code, count)
+
+    def clear_error(self, endpoint: Optional[str] = None):
+        """
+        :param endpoint: 接口名，None表示所有接口
+        """
+        if endpoint is None:
+            self._errors.clear()
+        else:
+            self._errors.pop(endpoint, None)
+
+    def expire_game(self, game_id: str) -> bool:
+        """
+        让开放平台项目过期，之后的心跳返回7003
+
+        :return: 项目是否存在
+        """
+        return self._games.pop(game_id, None) is not None
+
+    async def start(self):
+        app = aiohttp.web.Application(middlewares=[self._middleware])
+        app.router.add_get(ENDPOINT_PATHS['nav'], self._handle_nav)
+        app.router.add_get(ENDPOINT_PATHS['home'], self._handle_home)
+        app.router.add_get(ENDPOINT_PATHS['room_init'], self._handle_room_init)
+        app.router.add_get(ENDPOINT_PATHS['danmu_info'], self._handle_danmu_info)
+        app.router.add_post(ENDPOINT_PATHS['start'], self._handle_start)
+        app.router.add_post(ENDPOINT_PATHS['heartbeat'], self._handle_heartbeat)
+        app.router.add_post(ENDPOINT_PATHS['end'], self._handle_end)
+        self._runner = aiohttp.web.AppRunner(app, handle_signals=False, access_log=None)
+        await self._runner.setup()
+        site = aiohttp.web.TCPSite(self._runner, self._host, self._port, backlog=4096)
+        await site.start()
+        if self._port == 0:
+            self._port = site._server.sockets[0].getsockname()[1]  # noqa
+        logger.info('mock http server is listening on %s', self.url)
+
+    async def close(self):
+        if self._runner is None:
+            return
+        await self._runner.cleanup()
+        self._runner = None
+
+    @aiohttp.web.middleware
+    async def _middleware(self, request: aiohttp.web.Request, handler):
+        endpoint = _ENDPOINT_NAMES.get(request.path, None)
+        if endpoint is None:
+            return await handler(request)
+        self._requests[endpoint] += 1
+
+        if self._latency > 0 or self._latency_jitter > 0:
+            delay = self._latency + self._random.uniform(-self._latency_jitter, self._latency_jitter)
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+        if not self._acquire_token():
+            self._rate_limited += 1
+            return aiohttp.web.Response(status=412, text='Precondition Failed')
+
+        error = self._errors.get(endpoint, None)
+        if error is not None:
+            if error.remaining is not None:
+                if error.remaining <= 1:
+                    del self._errors[endpoint]
+                else:
+                    self._errors[endpoint] = error._replace(remaining=error.remaining - 1)
+            self._injected_errors += 1
+            if 400 <= error.code < 600:
+                return aiohttp.web.Response(status=error.code)
+            return self._make_response(None, error.code)
+
+        return await handler(request)
+
+    def _acquire_token(self) -> bool:
+        if self._rate_limit is None:
+            return True
+        now = time.monotonic()
+        self._tokens = min(self._rate_limit_burst, self._tokens + (now - self._tokens_update_time) * self._rate_limit)
+        self._tokens_update_time = now
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+    @staticmethod
+    def _make_response(data: Any, code: int = 0) -> aiohttp.web.Response:
+        body = {
+            'code': code,
+            'message': ERROR_MESSAGES.get(code, '0' if code == 0 else 'error'),
+            'ttl': 1,
+            'request_id': uuid.uuid4().hex,
+            'data': data,
+        }
+        return aiohttp.web.Response(body=json.dumps(body, ensure_ascii=False), content_type='application/json')
+
+    @staticmethod
+    def _get_room_id(value: str) -> Optional[int]:
+        try:
+            room_id = int(value)
+        except ValueError:
+            return None
+        return room_id if room_id > 0 else None
+
+    async def _handle_nav(self, request: aiohttp.web.Request):
+        sessdata = request.cookies.get('SESSDATA', '')
+        if sessdata == '':
+            # 和B站一样，未登录也返回WBI密钥
+            return self._make_response({'isLogin': False, 'wbi_img': DEFAULT_WBI_IMG}, -101)
+        return self._make_response({
+            'isLogin': True,
+            'mid': zlib.crc32(sessdata.encode('utf-8')) % 1_000_000_000 + 1,
+            'uname': 'mock',
+            'wbi_img': DEFAULT_WBI_IMG,
+        })
+
+    async def _handle_home(self, request: aiohttp.web.Request):
+        res = aiohttp.web.Response(body=self._home_page, content_type='text/html')
+        if 'buvid3' not in request.cookies:
+            res.set_cookie('buvid3', f'{uuid.uuid4()}infoc', max_age=365 * 24 * 3600, path='/')
+        return res
+
+    async def _handle_room_init(self, request: aiohttp.web.Request):
+        room_id = self._get_room_id(request.query.get('room_id', ''))
+        if room_id is None:
+            return self._make_response(None, -400)
+        return self._make_response({
+            'room_info': {
+                'room_id': room_id,
+                'short_id': 0,
+                'uid': room_id + 1_000_000,
+                'title': f'模拟直播间{room_id}',
+                'live_status': 1,
+            },
+        })
+
+    async def _handle_danmu_info(self, request: aiohttp.web.Request):
+        if self._get_room_id(request.query.get('id', '')) is None:
+            return self._make_response(None, -400)
+        return self._make_response({
+            'group': 'live',
+            'business_id': 0,
+            'refresh_row_factor': 0.125,
+            'refresh_rate': 100,
+            'max_delay': 5000,
+            'token': self._danmaku_token,
+            'host_list': self._host_server_list,
+        })
+
+    async def _handle_start(self, request: aiohttp.web.Request):
+        body = await request.json()
+        code = str(body.get('code', ''))
+        if code == '':
+            return self._make_response(None, -400)
+        # 身份码是数字则当成房间ID，否则哈希成房间ID
+        room_id = self._get_room_id(code) or zlib.crc32(code.encode('utf-8')) % 100_000_000 + 1
+        game_id = str(uuid.uuid4())
+        self._games[game_id] = _Game(game_id, room_id)
+        return self._make_response({
+            'game_info': {'game_id': game_id},
+            'websocket_info': {
+                'auth_body': json.dumps({'roomid': room_id, 'protoover': 2, 'key': self._danmaku_token}),
+                'wss_link': self._open_live_ws_urls,
+            },
+            'anchor_info': {
+                'room_id': room_id,
+                'uid': room_id + 1_000_000,
+                'open_id': str(uuid.uuid5(uuid.NAMESPACE_OID, str(room_id))),
+                'uname': f'主播{room_id}',
+                'uface': '',
+            },
+        })
+
+    def _get_alive_game(self, game_id: str) -> Optional[_Game]:
+        game = self._games.get(game_id, None)
+        if game is None:
+            return None
+        if time.monotonic() - game.last_heartbeat_time > self._game_heartbeat_timeout:
+            del self._games[game_id]
+            return None
+        return game
+
+    async def _handle_heartbeat(self, request: aiohttp.web.Request):
+        body = await request.json()
+        game = self._get_alive_game(str(body.get('game_id', '')))
+        if game is None:
+            return self._make_response(None, 7003)
+        game.last_heartbeat_time = time.monotonic()
+        return self._make_response({})
+
+    async def _handle_end(self, request: aiohttp.web.Request):
+        body = await request.json()
+        game_id = str(body.get('game_id', ''))
+        if self._get_alive_game(game_id) is None:
+            return self._make_response(None, 7000)
+        del self._games[game_id]
+        return self._make_response({})
+
+
+class ServerThread:
+    """
+    在单独的线程和事件循环运行模拟服务器，这样客户端阻塞事件循环时服务器也能响应，服务器的CPU时间也不算在客户端的事件循环里
+
+    :param server: 有start()和close()协程的模拟服务器
+    """
+
+    def __init__(self, server):
+        self._server = server
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, name='blivedm-mock-server', daemon=True)
+        self._started = threading.Event()
+        self._start_exception: Optional[BaseException] = None
+
+    @property
+    def server(self):
+        return self._server
+
+    def start(self):
+        """
+        启动线程，等待服务器开始监听
+        """
+        self._thread.start()
+        self._started.wait()
+        if self._start_exception is not None:
+            raise self._start_exception
+
+    def stop(self):
+        """
+        关闭服务器，等待线程退出
+        """
+        asyncio.run_coroutine_threadsafe(self._server.close(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+    def call(self, func: Callable, *args):
+        """
+        在服务器线程调用func，返回结果，用来修改服务器设置
+        """
+        async def wrapper():
+            return func(*args)
+        return asyncio.run_coroutine_threadsafe(wrapper(), self._loop).result()
+
+    def _run(self):
+        asyncio.set_event_loop(self._loop)
+        try:
+            self._loop.run_until_complete(self._server.start())
+        except BaseException as e:
+            self._start_exception = e
+            self._started.set()
+            return
+        self._started.set()
+        try:
+            self._loop.run_forever()
+        finally:
+            self._loop.close()
+
+
+async def _run_forever(server: MockHttpServer, stats_interval: float):
+    await server.start()
+    try:
+        while True:
+            await asyncio.sleep(stats_interval)
+            logger.info('mock http server stats: %s', server.stats)
+    finally:
+        await server.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--latency-jitter', type=float, default=0.0)
+    parser.add_argument('--rate-limit', type=float, default=None, help='每秒最多处理多少个请求')
+    parser.add_argument('--danmaku-port', type=int, default=None, help='getDanmuInfo返回的模拟弹幕服务器端口')
+    parser.add_argument('--stats-interval', type=float, default=10.0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    host_server_list = None
+    open_live_ws_urls = None
+    if args.danmaku_port is not None:
+        host_server_list = [
+            {'host': args.host, 'port': args.danmaku_port, 'wss_port': args.danmaku_port,
+             'ws_port': args.danmaku_port}
+        ]
+        open_live_ws_urls = [f'ws://{args.host}:{args.danmaku_port}/sub']
+    server = MockHttpServer(
+        args.host,
+        args.port,
+        latency=args.latency,
+        latency_jitter=args.latency_jitter,
+        rate_limit=args.rate_limit,
+        host_server_list=host_server_list,
+        open_live_ws_urls=open_live_ws_urls,
+    )
+    try:
+        asyncio.run(_run_forever(server, args.stats_interval))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
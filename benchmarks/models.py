@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+对比普通dataclass消息模型和models.compact里__slots__版本的内存占用、from_command和读取字段的速度
+
+内存用tracemalloc统计构造count个实例新分配的字节数，字段值是从同一个命令里取的，所以主要是实例本身的开销
+
+用法：python -m benchmarks.models [--count 100000] [--filter Danmaku]
+"""
+import argparse
+import dataclasses
+import gc
+import tracemalloc
+from typing import *
+
+import blivedm
+from blivedm.models import compact
+from . import micro
+
+VARIANTS = ('dataclass', 'slots', 'frozen_slots')
+
+
+def get_variant_classes(message_cls: type) -> Dict[str, type]:
+    """
+    :return: 变体名 -> 消息类
+    """
+    namespace_name = message_cls.__module__.rsplit('.', 1)[-1]
+    return {
+        'dataclass': message_cls,
+        'slots': getattr(getattr(compact, namespace_name), message_cls.__name__),
+        'frozen_slots': getattr(getattr(compact, f'frozen_{namespace_name}'), message_cls.__name__),
+    }
+
+
+def measure_memory(from_command: Callable[[Any], Any], data: Any, count: int) -> float:
+    """
+    :return: 每个实例占用的字节数
+    """
+    gc.collect()
+    tracemalloc.start()
+    try:
+        start_size, _ = tracemalloc.get_traced_memory()
+        messages = [from_command(data) for _ in range(count)]
+        end_size, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    # 减去列表本身
+    list_size = messages.__sizeof__()
+    del messages
+    return (end_size - start_size - list_size) / count
+
+
+def run(args):
+    print(f'{"model":45}{"variant":>14}{"bytes/obj":>12}{"from_command":>15}{"getattr":>10}')
+    summary: Dict[str, List[float]] = {variant: [] for variant in VARIANTS}
+    for cmd, command in micro.get_model_commands().items():
+        callback = blivedm.BaseHandler._CMD_CALLBACK_DICT[cmd]  # noqa
+        message_cls = callback.message_cls
+        data = command[callback.data_key]
+        module_name = message_cls.__module__.rsplit('.', 1)[-1]
+        model_name = f'{module_name}.{message_cls.__name__}'
+        if args.filter not in model_name:
+            continue
+
+        base_bytes = None
+        for variant, cls in get_variant_classes(message_cls).items():
+            from_command = cls.from_command
+            bytes_per_obj = measure_memory(from_command, data, args.count)
+            construct_ns = min(micro.measure(lambda: from_command(data), args.repeat, args.min_time)) * 1e9
+            message = from_command(data)
+            field_name = dataclasses.fields(message)[0].name
+            getattr_ns = min(micro.measure(
+                lambda: getattr(message, field_name), args.repeat, args.min_time
+            )) * 1e9
+
+            if base_bytes is None:
+                base_bytes = bytes_per_obj
+            summary[variant].append(bytes_per_obj / base_bytes)
+            print(f'{model_name:45}{variant:>14}{bytes_per_obj:12.0f}{construct_ns:12.0f} ns{getattr_ns:7.0f} ns')
+
+    if summary['dataclass']:
+        print()
+        for variant, ratios in summary.items():
+            print(f'{variant:>14}: mean memory {sum(ratios) / len(ratios):.0%} of dataclass')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--count', type=int, default=100000, help='统计内存时构造多少个实例')
+    parser.add_argument('--filter', default='', help='只测试名字包含这个字符串的模型')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--min-time', type=float, default=0.05, help='每次重复至少运行多少秒')
+    args = parser.parse_args()
+    run(args)
+
+
+if __name__ == '__main__':
+    main()
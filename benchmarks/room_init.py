@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+用本地模拟的HTTP接口测试大量房间init_room的耗时和请求数
+
+模拟服务器在单独的线程运行，客户端的URL用web.set_base_urls、open_live.set_base_url指向它
+
+用--room-init-cache指定缓存文件并运行两次，可以测试重启后用缓存初始化的耗时
+
+用法：python -m benchmarks.room_init [--rooms 1000] [--concurrency 100] [--latency 0.02] [--open-live]
+    [--room-init-cache room_cache.db]
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from typing import *
+
+import aiohttp
+
+import blivedm
+from blivedm.clients import open_live, web
+from . import mock_http_server
+
+
+def make_session() -> aiohttp.ClientSession:
+    # 模拟服务器是IP地址，默认的CookieJar不保存IP地址发的cookie
+    return aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=0),
+        cookie_jar=aiohttp.CookieJar(unsafe=True),
+        timeout=aiohttp.ClientTimeout(total=30),
+    )
+
+
+def make_web_client(room_id: int, session: aiohttp.ClientSession) -> blivedm.BLiveClient:
+    return blivedm.BLiveClient(room_id, session=session)
+
+
+def make_open_live_client(room_id: int, session: aiohttp.ClientSession) -> blivedm.OpenLiveClient:
+    return blivedm.OpenLiveClient('mock', 'mock', 1, str(room_id), session=session)
+
+
+async def init_rooms(
+    clients: List[blivedm.clients.ws_base.WebSocketClientBase], concurrency: int
+) -> Tuple[float, List[float], int]:
+    """
+    :return: (总耗时, 每个房间的耗时, 失败的房间数)
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    durations = []
+    failures = 0
+
+    async def init_room(client):
+        nonlocal failures
+        async with semaphore:
+            start_time = time.perf_counter()
+            if not await client.init_room():
+                failures += 1
+            durations.append(time.perf_counter() - start_time)
+
+    start_time = time.perf_counter()
+    await asyncio.gather(*(init_room(client) for client in clients))
+    return time.perf_counter() - start_time, durations, failures
+
+
+async def run(args, server_thread: mock_http_server.ServerThread):
+    client_factory = make_open_live_client if args.open_live else make_web_client
+    session = make_session()
+    room_init_cache = None
+    if args.room_init_cache is not None and not args.open_live:
+        room_init_cache = blivedm.RoomInitCache(args.room_init_cache)
+    try:
+        clients = [client_factory(room_id, session) for room_id in range(1, args.rooms + 1)]
+        if room_init_cache is not None:
+            for client in clients:
+                client.set_room_init_cache(room_init_cache)
+        total_seconds, durations, failures = await init_rooms(clients, args.concurrency)
+        durations.sort()
+        print(f'{args.rooms} rooms initialized in {total_seconds:.2f}s ({args.rooms / total_seconds:.0f} rooms/s), '
+              f'failures: {failures}')
+        print(f'init_room latency: mean={statistics.mean(durations) * 1e3:.1f}ms '
+              f'p50={durations[len(durations) // 2] * 1e3:.1f}ms '
+              f'p99={durations[min(len(durations) - 1, len(durations) * 99 // 100)] * 1e3:.1f}ms')
+
+        stats = server_thread.call(lambda: server_thread.server.stats)
+        print(f'requests: {stats["total_requests"]} ({stats["total_requests"] / args.rooms:.2f} per room), '
+              f'{stats["requests"]}')
+
+        for client in clients:
+            await client.close()
+    finally:
+        if room_init_cache is not None:
+            await room_init_cache.close()
+        await session.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rooms', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=100, help='最多同时初始化多少个房间')
+    parser.add_argument('--latency', type=float, default=0.0, help='模拟服务器每个请求的延迟（秒）')
+    parser.add_argument('--rate-limit', type=float, default=None, help='模拟服务器每秒最多处理多少个请求')
+    parser.add_argument('--open-live', action='store_true', help='测试OpenLiveClient，否则测试BLiveClient')
+    parser.add_argument('--room-init-cache', default=None, help='BLiveClient使用的房间初始化缓存文件')
+    args = parser.parse_args()
+
+    server_thread = mock_http_server.ServerThread(mock_http_server.MockHttpServer(
+        latency=args.latency,
+        rate_limit=args.rate_limit,
+        rate_limit_burst=max(10, int(args.rate_limit or 0)),
+    ))
+    server_thread.start()
+    url = server_thread.server.url
+    web.set_base_urls(url, url, url)
+    open_live.set_base_url(url)
+    try:
+        asyncio.run(run(args, server_thread))
+    finally:
+        web.set_base_urls()
+        open_live.set_base_url()
+        server_thread.stop()
+
+
+if __name__ == '__main__':
+    main()
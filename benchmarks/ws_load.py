@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+用RoomPool连接本地模拟弹幕服务器的大量房间，测试建立连接的耗时和接收、解析消息的吞吐量
+
+默认在同一个进程启动模拟服务器，用--port连接另外启动的`python -m benchmarks.mock_danmaku_server`可以让服务器不占用本进程的CPU
+
+用法：python -m benchmarks.ws_load [--rooms 1000] [--duration 30] [--message-rate 10] [--port 2244]
+"""
+import argparse
+import asyncio
+import time
+from typing import *
+
+import aiohttp
+import yarl
+
+import blivedm
+from blivedm.clients import web
+from . import mock_danmaku_server
+
+
+class OfflineClient(blivedm.BLiveClient):
+    """
+    不请求B站接口的客户端，房间ID直接用构造时的ID
+    """
+
+    async def _init_room_id_and_owner(self):
+        self._room_id = self._tmp_room_id
+        self._room_owner_uid = 0
+        return True
+
+
+def make_offline_session() -> aiohttp.ClientSession:
+    session = blivedm.RoomPool._create_session()  # noqa
+    # 有buvid就不会请求B站首页
+    session.cookie_jar.update_cookies({'buvid3': 'mock'}, yarl.URL(web.BUVID_INIT_URL))
+    return session
+
+
+async def wait_connected(pool: blivedm.RoomPool, timeout: float) -> float:
+    """
+    :return: 所有房间连接成功的耗时，超时返回inf
+    """
+    start_time = time.perf_counter()
+    while time.perf_counter() - start_time < timeout:
+        if all(pool.get_client(room_id).is_connected for room_id in pool.room_ids):
+            return time.perf_counter() - start_time
+        await asyncio.sleep(0.05)
+    return float('inf')
+
+
+async def run(args):
+    server = None
+    if args.port is None:
+        server = mock_danmaku_server.MockDanmakuServer(
+            message_rate=args.message_rate,
+            commands_per_frame=args.commands_per_frame,
+            compression=mock_danmaku_server.COMPRESSION_NAMES[args.compression],
+        )
+        await server.start()
+        host_server_list = server.host_server_list
+    else:
+        host_server_list = [{'host': args.host, 'port': args.port, 'wss_port': args.port, 'ws_port': args.port}]
+
+    metrics = blivedm.ClientMetrics()
+
+    def client_factory(room_id: int, session: aiohttp.ClientSession):
+        client = OfflineClient(room_id, uid=0, session=session, host_server_list=host_server_list, use_wss=False)
+        client.set_metrics(metrics)
+        return client
+
+    pool = blivedm.RoomPool(
+        blivedm.BaseHandler(),
+        session=make_offline_session(),
+        max_concurrent_starts=args.max_concurrent_starts,
+        client_factory=client_factory,
+    )
+    try:
+        pool.add_rooms(range(1, args.rooms + 1))
+        connect_seconds = await wait_connected(pool, args.connect_timeout)
+        print(f'{args.rooms} rooms connected in {connect_seconds:.2f}s')
+
+        start_frames = metrics.frames
+        start_messages = metrics.decoded_messages + metrics.skipped_messages
+        start_time = time.perf_counter()
+        start_cpu_time = time.process_time()
+        await asyncio.sleep(args.duration)
+        elapsed = time.perf_counter() - start_time
+        cpu_time = time.process_time() - start_cpu_time
+
+        frames = metrics.frames - start_frames
+        messages = metrics.decoded_messages + metrics.skipped_messages - start_messages
+        print(f'frames: {frames / elapsed:.0f}/s, messages: {messages / elapsed:.0f}/s, '
+              f'cpu: {cpu_time / elapsed:.0%}')
+        print(f'pool status: {pool.status}')
+        print(f'reconnects: {metrics.reconnect_count}')
+        if server is not None:
+            print(f'server stats: {server.stats}')
+    finally:
+        await pool.close()
+        if server is not None:
+            await server.close()
+        await pool.session.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rooms', type=int, default=1000)
+    parser.add_argument('--duration', type=float, default=30.0, help='连接成功后测试多少秒')
+    parser.add_argument('--connect-timeout', type=float, default=120.0)
+    parser.add_argument('--max-concurrent-starts', type=int, default=200)
+    parser.add_argument('--message-rate', type=float, default=10.0, help='同一进程的模拟服务器每个房间每秒推送多少条业务消息')
+    parser.add_argument('--commands-per-frame', type=int, default=10)
+    parser.add_argument('--compression', choices=list(mock_danmaku_server.COMPRESSION_NAMES), default='brotli')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=None, help='连接另外启动的模拟服务器，不指定则在本进程启动')
+    args = parser.parse_args()
+
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
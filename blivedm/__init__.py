@@ -3,3 +3,12 @@ __version__ = '1.1.0-dev'
 
 from .handlers import *
 from .clients import *
+from .event_stream import *
+from .metrics import *
+from .profiler import *
+from .recorder import *
+from .room_cache import *
+from .host_selector import *
+from .dedup import *
+from .pool import *
+from .sharding import *
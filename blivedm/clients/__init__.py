@@ -1,3 +1,5 @@
 # -*- coding: utf-8 -*-
 from .web import *
 from .open_live import *
+from .replay import *
+from .redundant import *
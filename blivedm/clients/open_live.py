@@ -3,7 +3,6 @@ import asyncio
 import datetime
 import hashlib
 import hmac
-import json
 import logging
 import uuid
 from typing import *
@@ -11,6 +10,7 @@ from typing import *
 import aiohttp
 
 from . import ws_base
+from .. import heartbeat
 
 __all__ = (
     'OpenLiveClient',
@@ -18,9 +18,23 @@ __all__ = (
 
 logger = logging.getLogger('blivedm')
 
-START_URL = 'https://live-open.biliapi.com/v2/app/start'
-HEARTBEAT_URL = 'https://live-open.biliapi.com/v2/app/heartbeat'
-END_URL = 'https://live-open.biliapi.com/v2/app/end'
+OPEN_LIVE_BASE_URL = 'https://live-open.biliapi.com'
+
+START_URL = OPEN_LIVE_BASE_URL + '/v2/app/start'
+HEARTBEAT_URL = OPEN_LIVE_BASE_URL + '/v2/app/heartbeat'
+END_URL = OPEN_LIVE_BASE_URL + '/v2/app/end'
+
+
+def set_base_url(base_url: str = OPEN_LIVE_BASE_URL):
+    """
+    修改开放平台接口的域名，例如指向本地的模拟服务器。不传参数则恢复成B站的域名
+
+    :param base_url: live-open.biliapi.com的替代
+    """
+    global START_URL, HEARTBEAT_URL, END_URL
+    START_URL = base_url + '/v2/app/start'
+    HEARTBEAT_URL = base_url + '/v2/app/heartbeat'
+    END_URL = base_url + '/v2/app/end'
 
 
 class OpenLiveClient(ws_base.WebSocketClientBase):
@@ -38,6 +52,11 @@ class OpenLiveClient(ws_base.WebSocketClientBase):
     :param game_heartbeat_interval: 发送项目心跳包的间隔时间（秒）
     """
 
+    _REQUIRED_CMDS = frozenset({
+        # 服务器主动停止推送
+        'LIVE_OPEN_PLATFORM_INTERACTION_END',
+    })
+
     def __init__(
         self,
         access_key_id: str,
@@ -70,8 +89,8 @@ class OpenLiveClient(ws_base.WebSocketClientBase):
         """项目场次ID"""
 
         # 在运行时初始化的字段
-        self._game_heartbeat_timer_handle: Optional[asyncio.TimerHandle] = None
-        """发项目心跳包定时器的handle"""
+        self._game_heartbeat_entry: Optional[heartbeat.HeartbeatEntry] = None
+        """注册到心跳调度器的项目心跳"""
 
     @property
     def room_owner_uid(self) -> Optional[int]:
@@ -115,15 +134,15 @@ class OpenLiveClient(ws_base.WebSocketClientBase):
         if self.is_running:
             logger.warning('room=%s is calling close(), but client is running', self.room_id)
 
-        if self._game_heartbeat_timer_handle is not None:
-            self._game_heartbeat_timer_handle.cancel()
-            self._game_heartbeat_timer_handle = None
+        if self._game_heartbeat_entry is not None:
+            heartbeat.get_heartbeat_scheduler(self._game_heartbeat_interval).unregister(self._game_heartbeat_entry)
+            self._game_heartbeat_entry = None
         await self._end_game()
 
         await super().close()
 
     def _request_open_live(self, url, body: dict):
-        body_bytes = json.dumps(body).encode('utf-8')
+        body_bytes = self._get_json_codec().dumps(body)
         headers = {
             'x-bili-accesskeyid': self._access_key_id,
             'x-bili-content-md5': hashlib.md5(body_bytes).hexdigest(),
@@ -155,9 +174,9 @@ class OpenLiveClient(ws_base.WebSocketClientBase):
         if not await self._start_game():
             return False
 
-        if self._game_id != '' and self._game_heartbeat_timer_handle is None:
-            self._game_heartbeat_timer_handle = asyncio.get_running_loop().call_later(
-                self._game_heartbeat_interval, self._on_send_game_heartbeat
+        if self._game_id != '' and self._game_heartbeat_entry is None:
+            self._game_heartbeat_entry = heartbeat.get_heartbeat_scheduler(self._game_heartbeat_interval).register(
+                self._send_game_heartbeat
             )
         return True
 
@@ -224,18 +243,9 @@ class OpenLiveClient(ws_base.WebSocketClientBase):
             return False
         return True
 
-    def _on_send_game_heartbeat(self):
-        """
-        定时发送项目心跳包的回调
-        """
-        self._game_heartbeat_timer_handle = asyncio.get_running_loop().call_later(
-            self._game_heartbeat_interval, self._on_send_game_heartbeat
-        )
-        asyncio.create_task(self._send_game_heartbeat())
-
     async def _send_game_heartbeat(self):
         """
-        发送项目心跳包
+        发送项目心跳包，由心跳调度器定时调用
         """
         if self._game_id in (None, ''):
             logger.warning('game=%d _send_game_heartbeat() failed, game_id not found', self._game_id)
@@ -280,11 +290,11 @@ class OpenLiveClient(ws_base.WebSocketClientBase):
             self._need_init_room = True
         await super()._on_before_ws_connect(retry_count)
 
-    def _get_ws_url(self, retry_count) -> str:
+    def _get_ws_urls(self) -> List[str]:
         """
-        返回WebSocket连接的URL，可以在这里做故障转移和负载均衡
+        返回所有候选的WebSocket连接URL
         """
-        return self._host_server_url_list[retry_count % len(self._host_server_url_list)]
+        return self._host_server_url_list
 
     async def _send_auth(self):
         """
@@ -292,7 +302,22 @@ class OpenLiveClient(ws_base.WebSocketClientBase):
         """
         await self._websocket.send_bytes(self._make_packet(self._auth_body, ws_base.Operation.AUTH))
 
+    def _handle_commands(self, commands: List[dict]):
+        commands = [command for command in commands if not self._check_game_end(command)]
+        if commands:
+            super()._handle_commands(commands)
+
     def _handle_command(self, command: dict):
+        if self._check_game_end(command):
+            return
+        super()._handle_command(command)
+
+    def _check_game_end(self, command: dict):
+        """
+        检查是不是服务器主动停止推送的消息，如果是则准备重新开启项目
+
+        :return: True表示这条消息已经处理了，不要再交给消息处理器
+        """
         cmd = command.get('cmd', '')
         if cmd == 'LIVE_OPEN_PLATFORM_INTERACTION_END' and command['data']['game_id'] == self._game_id:
             # 服务器主动停止推送，可能是心跳超时，需要重新开启项目
@@ -301,6 +326,5 @@ class OpenLiveClient(ws_base.WebSocketClientBase):
             self._need_init_room = True
             if self._websocket is not None and not self._websocket.closed:
                 asyncio.create_task(self._websocket.close())
-            return
-
-        super()._handle_command(command)
+            return True
+        return False
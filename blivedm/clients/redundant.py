@@ -0,0 +1,321 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import collections
+import logging
+import time
+from typing import *
+
+from . import ws_base
+from .. import dedup, event_stream as ev_stream, handlers
+
+__all__ = (
+    'RedundantClient',
+)
+
+logger = logging.getLogger('blivedm')
+
+
+class _MemberDeduplicator:
+    """
+    设置到每个成员客户端的去重器，有唯一标识的消息用共享的去重器去重，没有唯一标识的消息只保留主连接的
+
+    不是主连接时收到的没有唯一标识的消息先缓存一会，这个成员接替主连接时补发原主连接最后一次收到消息之后的部分
+    """
+
+    def __init__(self, owner: 'RedundantClient', member: ws_base.WebSocketClientBase):
+        self._owner = owner
+        self._member = member
+        self.last_frame_time = 0.0
+        """上次收到业务消息的time.monotonic()，不包括自造的心跳消息"""
+        self._unkeyed_buffer: Deque[Tuple[float, dict]] = collections.deque(maxlen=owner.max_buffered_unkeyed)
+        """不是主连接时收到的没有唯一标识的消息，(time.monotonic(), command)"""
+        self.replay_since: Optional[float] = None
+        """接替主连接时设置，下次收到消息时补发缓存里这个时间之后的消息"""
+
+    @property
+    def stats(self) -> dict:
+        return self._owner.deduplicator.stats
+
+    def filter(self, room_id: Optional[int], commands: List[dict], keep_unkeyed: bool = True) -> List[dict]:
+        # 服务器心跳包每个连接各自的周期不一样，不能用来判断连接是否还活着
+        is_heartbeat = len(commands) == 1 and commands[0].get('cmd', None) == '_HEARTBEAT'
+        now = time.monotonic()
+        if not is_heartbeat:
+            self.last_frame_time = now
+        is_primary = self._owner._on_member_frame(self._member, not is_heartbeat)  # noqa
+        res = self._owner.deduplicator.filter(room_id, commands, keep_unkeyed and is_primary)
+        if not is_primary:
+            if keep_unkeyed and not is_heartbeat:
+                self._buffer_unkeyed(commands, now)
+            return res
+
+        if self.replay_since is not None:
+            replay_commands = self._take_unkeyed(self.replay_since)
+            self.replay_since = None
+            if replay_commands:
+                res = replay_commands + res
+        return res
+
+    def _buffer_unkeyed(self, commands: List[dict], now: float):
+        buffer = self._unkeyed_buffer
+        expire_time = now - 2 * self._owner.primary_stall_timeout
+        while buffer and buffer[0][0] < expire_time:
+            buffer.popleft()
+        for command in commands:
+            if dedup.get_message_key(command) is None:
+                buffer.append((now, command))
+
+    def _take_unkeyed(self, since: float) -> List[dict]:
+        res = [command for receive_time, command in self._unkeyed_buffer if receive_time > since]
+        self._unkeyed_buffer.clear()
+        return res
+
+
+class RedundantClient:
+    """
+    同一个房间同时保持多个WebSocket连接的客户端，每个连接优先连不同的服务器，一个连接断开时其他连接还在接收消息，不会丢消息
+
+    所有连接收到的消息合并成一个流，消息处理器和事件流只会收到一份：
+    有唯一标识的消息（弹幕、礼物、上舰、醒目留言、开放平台消息）不管哪个连接先收到都会立即处理，其他连接收到的丢弃；
+    没有唯一标识的消息只处理主连接的。一开始主连接是已连接的成员里序号最小的，主连接断开，或者超过primary_stall_timeout
+    没有收到业务消息而其他成员还在收到时，由收到消息的成员接替。
+    其他成员不是主连接时收到的没有唯一标识的消息会缓存2 * primary_stall_timeout秒，接替主连接时补发原主连接最后一次
+    收到业务消息之后的部分，所以主连接半死不活或者断开时不会丢消息，不过不同连接收到同一条消息有时间差，可能重复几条。
+    消息很少的房间判断不出主连接卡住，要等主连接接收超时断开
+
+    消息处理器的client参数是收到消息的成员客户端，room_id和本客户端相同。
+    可以作为RoomPool的client_factory返回值，例如：
+    client_factory=lambda room_id, session: RedundantClient([BLiveClient(room_id, session=session) for _ in range(2)])
+
+    :param clients: 同一个房间的客户端，不需要设置消息处理器
+    :param deduplicator: 所有连接共享的去重器，None表示创建一个默认配置的
+    :param primary_stall_timeout: 主连接超过多少秒没收到业务消息、其他成员收到了业务消息时换主连接
+    :param max_buffered_unkeyed: 每个成员最多缓存多少条没有唯一标识的消息用来补发
+    """
+
+    def __init__(
+        self,
+        clients: Sequence[ws_base.WebSocketClientBase],
+        deduplicator: Optional['dedup.MessageDeduplicator'] = None,
+        *,
+        primary_stall_timeout: float = 5.0,
+        max_buffered_unkeyed: int = 1000,
+    ):
+        if not clients:
+            raise ValueError('clients must not be empty')
+        self._clients = list(clients)
+        self._deduplicator = deduplicator if deduplicator is not None else dedup.MessageDeduplicator()
+        self._primary_stall_timeout = primary_stall_timeout
+        self._max_buffered_unkeyed = max_buffered_unkeyed
+        self._primary: Optional[ws_base.WebSocketClientBase] = None
+        """当前的主连接，可能已经断开"""
+        self._member_deduplicators: Dict[ws_base.WebSocketClientBase, _MemberDeduplicator] = {}
+        self._event_streams: List['ev_stream.EventStream'] = []
+        """推送业务消息的事件流，会添加到所有成员"""
+        self._need_init_room = True
+        """给RoomPool用的，成员客户端的这个字段在init_room里设置"""
+
+        for index, client in enumerate(self._clients):
+            client.set_host_offset(index)
+            member_deduplicator = self._member_deduplicators[client] = _MemberDeduplicator(self, client)
+            client.set_deduplicator(member_deduplicator)  # noqa
+
+    @property
+    def clients(self) -> List[ws_base.WebSocketClientBase]:
+        """
+        成员客户端
+        """
+        return self._clients
+
+    @property
+    def deduplicator(self) -> 'dedup.MessageDeduplicator':
+        return self._deduplicator
+
+    @property
+    def primary_stall_timeout(self) -> float:
+        return self._primary_stall_timeout
+
+    @property
+    def max_buffered_unkeyed(self) -> int:
+        return self._max_buffered_unkeyed
+
+    @property
+    def primary(self) -> Optional[ws_base.WebSocketClientBase]:
+        """
+        当前的主连接，都没连接则为None
+        """
+        primary = self._primary
+        if primary is not None and primary.is_connected:
+            return primary
+        for client in self._clients:
+            if client.is_connected:
+                self._set_primary(client)
+                return client
+        return None
+
+    def _set_primary(self, client: ws_base.WebSocketClientBase):
+        old_primary = self._primary
+        self._primary = client
+        # 第一次选主连接时没有要补发的
+        if old_primary is not None:
+            self._member_deduplicators[client].replay_since = self._member_deduplicators[old_primary].last_frame_time
+
+    def _on_member_frame(self, member: ws_base.WebSocketClientBase, is_business: bool) -> bool:
+        """
+        成员收到消息时调用，必要时换主连接
+
+        :param member: 收到消息的成员
+        :param is_business: 是否是业务消息，只有业务消息能说明连接还活着
+        :return: member是否是主连接
+        """
+        primary = self.primary
+        if primary is member or primary is None or not is_business:
+            return primary is member
+
+        # 换了主连接之后一直用新的，直到它也卡住或者断开，不会切回序号小的，避免来回切换导致消息重复
+        silent_time = time.monotonic() - self._member_deduplicators[primary].last_frame_time
+        if silent_time <= self._primary_stall_timeout:
+            return False
+        logger.info('room=%s primary connection received nothing for %.1fs, switching to member %d',
+                    member.room_id, silent_time, self._clients.index(member))
+        self._set_primary(member)
+        return True
+
+    @property
+    def is_running(self) -> bool:
+        """
+        有成员正在运行
+        """
+        return any(client.is_running for client in self._clients)
+
+    @property
+    def is_connected(self) -> bool:
+        """
+        有成员已经连接
+        """
+        return self.primary is not None
+
+    @property
+    def connected_count(self) -> int:
+        """
+        已连接的成员数
+        """
+        return sum(1 for client in self._clients if client.is_connected)
+
+    @property
+    def room_id(self) -> Optional[int]:
+        """
+        房间ID，调用init_room后初始化
+        """
+        for client in self._clients:
+            if client.room_id is not None:
+                return client.room_id
+        return None
+
+    def set_handler(self, handler: Optional['handlers.HandlerInterface']):
+        """
+        设置所有成员共享的消息处理器
+
+        :param handler: 消息处理器
+        """
+        for client in self._clients:
+            client.set_handler(handler)
+
+    def events(
+        self,
+        maxsize: int = ev_stream.DEFAULT_MAX_SIZE,
+        policy: 'ev_stream.OverflowPolicy' = ev_stream.OverflowPolicy.BLOCK,
+        *,
+        cmd_priorities: Optional[Dict[str, int]] = None,
+        default_priority: int = 0,
+        wanted_cmds: Optional[Iterable[str]] = None,
+    ) -> 'ev_stream.EventStream':
+        """
+        创建一个合并所有连接的业务消息事件流，和消息处理器互不影响。事件流在关闭或者客户端close()时停止接收消息
+
+        :param maxsize: 缓冲区大小
+        :param policy: 缓冲区满时的策略
+        :param cmd_priorities: cmd -> 优先级，数字越大越重要，只在DROP_BY_PRIORITY时使用
+        :param default_priority: 不在cmd_priorities里的cmd的优先级
+        :param wanted_cmds: 要接收的cmd，None表示全部都要
+        """
+        stream = ev_stream.EventStream(
+            maxsize, policy, cmd_priorities=cmd_priorities, default_priority=default_priority,
+            wanted_cmds=wanted_cmds
+        )
+        stream.add_source(self)
+        self._add_event_stream(stream)
+        return stream
+
+    def _add_event_stream(self, stream: 'ev_stream.EventStream'):
+        self._event_streams.append(stream)
+        for client in self._clients:
+            client._add_event_stream(stream)  # noqa
+
+    def _remove_event_stream(self, stream: 'ev_stream.EventStream'):
+        try:
+            self._event_streams.remove(stream)
+        except ValueError:
+            return
+        for client in self._clients:
+            client._remove_event_stream(stream)  # noqa
+
+    async def init_room(self) -> bool:
+        """
+        初始化所有成员
+
+        :return: 是否全部成功，失败的成员会在连接前再初始化
+        """
+        results = await asyncio.gather(*(client.init_room() for client in self._clients), return_exceptions=True)
+        all_ok = True
+        for client, res in zip(self._clients, results):
+            if isinstance(res, BaseException):
+                logger.error('room=%s init_room() failed:', client.room_id, exc_info=res)
+                all_ok = False
+            elif res:
+                client._need_init_room = False  # noqa
+            else:
+                all_ok = False
+        return all_ok
+
+    def start(self):
+        """
+        启动所有成员
+        """
+        for client in self._clients:
+            if not client.is_running:
+                client.start()
+
+    def stop(self):
+        """
+        停止所有成员
+        """
+        for client in self._clients:
+            if client.is_running:
+                client.stop()
+
+    async def stop_and_close(self):
+        """
+        便利函数，停止所有成员并释放资源，调用后本客户端将不可用
+        """
+        if self.is_running:
+            self.stop()
+            await self.join()
+        await self.close()
+
+    async def join(self):
+        """
+        等待所有成员停止
+        """
+        for client in self._clients:
+            if client.is_running:
+                await client.join()
+
+    async def close(self):
+        """
+        释放所有成员的资源，调用后本客户端将不可用
+        """
+        for stream in list(self._event_streams):
+            self._remove_event_stream(stream)
+            stream.remove_source(self)
+        await asyncio.gather(*(client.close() for client in self._clients))
@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import heapq
+import logging
+from typing import *
+
+import aiohttp
+
+from . import ws_base
+from .. import recorder as recorder_
+
+__all__ = (
+    'ReplayClient',
+    'ReplayEngine',
+)
+
+logger = logging.getLogger('blivedm')
+
+_YIELD_INTERVAL = 256
+"""最快速度回放时，每回放多少帧让出一次事件循环"""
+
+
+class _Pacer:
+    """
+    按录制时的时间间隔控制回放速度
+
+    :param speed: 回放速度倍数，1表示实时，None表示不等待
+    """
+
+    def __init__(self, speed: Optional[float]):
+        if speed is not None and speed <= 0:
+            raise ValueError(f'speed must be positive or None, got {speed}')
+        self._speed = speed
+        self._first_frame_time_ns: Optional[int] = None
+        self._start_loop_time = 0.0
+        self._frame_count = 0
+
+    async def wait(self, frame: recorder_.RecordedFrame):
+        self._frame_count += 1
+        if self._speed is None:
+            if self._frame_count % _YIELD_INTERVAL == 0:
+                await asyncio.sleep(0)
+            return
+
+        loop = asyncio.get_running_loop()
+        if self._first_frame_time_ns is None:
+            self._first_frame_time_ns = frame.wall_time_ns
+            self._start_loop_time = loop.time()
+            return
+        target_time = (
+            self._start_loop_time + (frame.wall_time_ns - self._first_frame_time_ns) / 1e9 / self._speed
+        )
+        delay = target_time - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class ReplayClient(ws_base.WebSocketClientBase):
+    """
+    回放录制的WebSocket消息的客户端，不连接网络，消息经过和在线客户端一样的解析、消息处理器流程
+
+    :param room_id: 房间ID
+    :param frames: 要回放的帧，None表示从directory读这个房间的所有录制文件
+    :param directory: 录制文件的根目录
+    :param speed: 回放速度倍数，1表示实时，None表示尽可能快
+    :param session: 不会用来连接，只是为了和其他客户端一样的接口，None表示创建一个
+    """
+
+    def __init__(
+        self,
+        room_id: int,
+        frames: Optional[Iterable[recorder_.RecordedFrame]] = None,
+        *,
+        directory: Optional[str] = None,
+        speed: Optional[float] = 1.0,
+        session: Optional[aiohttp.ClientSession] = None,
+    ):
+        # 在创建session之前检查，否则抛异常时session不会被关闭
+        if frames is None and directory is None:
+            raise ValueError('frames or directory is required')
+        super().__init__(session)
+        if frames is None:
+            frames = recorder_.iter_room_frames(directory, room_id)
+        self._tmp_room_id = room_id
+        self._frames = frames
+        self._speed = speed
+
+        self._replayed_frames = 0
+        """已回放的帧数"""
+
+    @property
+    def tmp_room_id(self) -> int:
+        return self._tmp_room_id
+
+    @property
+    def replayed_frames(self) -> int:
+        return self._replayed_frames
+
+    async def init_room(self) -> bool:
+        self._room_id = self._tmp_room_id
+        return True
+
+    async def _network_coroutine(self):
+        """
+        回放所有帧，回放完后停止
+        """
+        await self.init_room()
+        pacer = _Pacer(self._speed)
+        for frame in self._frames:
+            await pacer.wait(frame)
+            await self.replay_frame(frame.data)
+
+    async def replay_frame(self, data: bytes):
+        """
+        回放一个WebSocket消息
+
+        :param data: WebSocket消息原始数据
+        """
+        self._replayed_frames += 1
+        await self._on_ws_message(aiohttp.WSMessage(aiohttp.WSMsgType.BINARY, data, None))
+
+    async def _on_auth_reply(self, body: dict):
+        # 回放时没有连接，不发心跳包，认证失败也继续回放
+        if body['code'] != ws_base.AuthReplyCode.OK:
+            logger.warning('room=%d recorded auth reply error, code=%d, body=%s', self.room_id, body['code'], body)
+
+
+class ReplayEngine:
+    """
+    把多个房间的录制按墙上时间合并后回放，每个房间一个ReplayClient
+
+    :param directory: 录制文件的根目录
+    :param room_ids: 要回放的房间ID
+    :param speed: 回放速度倍数，1表示实时，None表示尽可能快
+    :param session: 所有客户端共享的session，None表示创建一个，关闭时一起关闭
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        room_ids: Iterable[int],
+        *,
+        speed: Optional[float] = 1.0,
+        session: Optional[aiohttp.ClientSession] = None,
+    ):
+        self._directory = directory
+        self._speed = speed
+        if session is None:
+            self._session = aiohttp.ClientSession()
+            self._own_session = True
+        else:
+            self._session = session
+            self._own_session = False
+        self._clients: Dict[int, ReplayClient] = {
+            room_id: ReplayClient(room_id, (), speed=speed, session=self._session)
+            for room_id in room_ids
+        }
+        self._future: Optional[asyncio.Future] = None
+        self._replayed_frames = 0
+
+    @property
+    def clients(self) -> Dict[int, ReplayClient]:
+        """
+        room_id -> 客户端
+        """
+        return self._clients
+
+    @property
+    def is_running(self) -> bool:
+        return self._future is not None
+
+    @property
+    def replayed_frames(self) -> int:
+        return self._replayed_frames
+
+    def set_handler(self, handler):
+        """
+        给所有客户端设置消息处理器
+        """
+        for client in self._clients.values():
+            client.set_handler(handler)
+
+    def start(self):
+        if self.is_running:
+            logger.warning('ReplayEngine is running, cannot start() again')
+            return
+        self._future = asyncio.create_task(self._run_wrapper())
+
+    def stop(self):
+        if not self.is_running:
+            logger.warning('ReplayEngine is stopped, cannot stop() again')
+            return
+        self._future.cancel()
+
+    async def join(self):
+        if not self.is_running:
+            logger.warning('ReplayEngine is stopped, cannot join()')
+            return
+        await asyncio.shield(self._future)
+
+    async def close(self):
+        """
+        释放资源，调用后不可用
+        """
+        if self.is_running:
+            logger.warning('ReplayEngine is calling close(), but engine is running')
+        for client in self._clients.values():
+            await client.close()
+        if self._own_session:
+            await self._session.close()
+
+    async def _run_wrapper(self):
+        try:
+            await self.run()
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self._future = None
+
+    async def run(self):
+        """
+        回放所有房间，回放完后返回
+        """
+        for client in self._clients.values():
+            await client.init_room()
+
+        frames = heapq.merge(
+            *(recorder_.iter_room_frames(self._directory, room_id) for room_id in self._clients),
+            key=lambda frame: frame.wall_time_ns,
+        )
+        pacer = _Pacer(self._speed)
+        for frame in frames:
+            client = self._clients.get(frame.room_id, None)
+            if client is None:
+                continue
+            await pacer.wait(frame)
+            self._replayed_frames += 1
+            await client.replay_frame(frame.data)
@@ -1,16 +1,22 @@
 # -*- coding: utf-8 -*-
 import asyncio
+import collections
 import enum
-import json
 import logging
+import re
 import struct
+import time
 import zlib
 from typing import *
 
 import aiohttp
 import brotli
 
-from .. import handlers, utils
+from .. import (
+    decompressor as dec, dedup, event_stream as ev_stream, handlers, heartbeat, host_selector as host_selector_,
+    json_codec, metrics as metrics_, process_decoder as proc_dec, profiler as profiler_, rate_limiter,
+    recorder as recorder_, utils
+)
 
 logger = logging.getLogger('blivedm')
 
@@ -21,6 +27,10 @@ USER_AGENT = (
 HEADER_STRUCT = struct.Struct('>I2H2I')
 
 
+_CMD_PEEK_PATTERN = re.compile(rb'\s*\{\s*"cmd"\s*:\s*"([^"\\]*)"')
+"""在反序列化之前读取cmd，只处理cmd是第一个键并且没有转义字符的情况，其他情况要反序列化才能知道cmd"""
+
+
 class HeaderTuple(NamedTuple):
     pack_len: int
     raw_header_size: int
@@ -62,6 +72,17 @@ class Operation(enum.IntEnum):
     # MaxBusinessOp = 10000
 
 
+_HEARTBEAT_BODY = b'{}'
+HEARTBEAT_PACKET = HEADER_STRUCT.pack(*HeaderTuple(
+    pack_len=HEADER_STRUCT.size + len(_HEARTBEAT_BODY),
+    raw_header_size=HEADER_STRUCT.size,
+    ver=1,
+    operation=Operation.HEARTBEAT,
+    seq_id=1
+)) + _HEARTBEAT_BODY
+"""心跳包，内容是固定的，只创建一次"""
+
+
 # WS_AUTH
 class AuthReplyCode(enum.IntEnum):
     OK = 0
@@ -76,7 +97,45 @@ class AuthError(Exception):
     """认证失败"""
 
 
-DEFAULT_RECONNECT_POLICY = utils.make_constant_retry_policy(1)
+DEFAULT_RECONNECT_POLICY = utils.make_exponential_retry_policy(1, 30)
+
+
+def iter_packets(data: Union[bytes, memoryview]) -> Iterator[Tuple[int, int, memoryview]]:
+    """
+    把一段数据分成多个包，包体不复制
+
+    :param data: 要分包的数据，可以是WebSocket消息数据或者解压后的包体
+    :return: (operation, ver, body)的迭代器，body是data的memoryview切片
+    """
+    view = data if isinstance(data, memoryview) else memoryview(data)
+    unpack_from = HEADER_STRUCT.unpack_from
+    size = len(view)
+    offset = 0
+    while offset < size:
+        pack_len, raw_header_size, ver, operation, _seq_id = unpack_from(view, offset)
+        if raw_header_size < HEADER_STRUCT.size or pack_len < raw_header_size or offset + pack_len > size:
+            # 不检查的话pack_len为0时会死循环，超出数据长度时切片不会报错，包体会被截断
+            raise struct.error(f'invalid header, offset={offset}, pack_len={pack_len}, '
+                               f'raw_header_size={raw_header_size}, size={size}')
+        yield operation, ver, view[offset + raw_header_size: offset + pack_len]
+        offset += pack_len
+
+
+def peek_cmd(body: Union[bytes, memoryview]) -> Optional[str]:
+    """
+    不反序列化，直接从未压缩的业务消息包体读取cmd
+
+    :param body: 包体
+    :return: cmd，去掉了冒号后面的参数，读取失败返回None，这时要反序列化才能知道cmd
+    """
+    match = _CMD_PEEK_PATTERN.match(body)
+    if match is None:
+        return None
+    cmd = match.group(1)
+    pos = cmd.find(b':')  # 2019-5-29 B站弹幕升级新增了参数
+    if pos != -1:
+        cmd = cmd[:pos]
+    return cmd.decode('utf-8', 'replace')
 
 
 class WebSocketClientBase:
@@ -87,6 +146,9 @@ class WebSocketClientBase:
     :param heartbeat_interval: 发送心跳包的间隔时间（秒）
     """
 
+    _REQUIRED_CMDS: FrozenSet[str] = frozenset()
+    """客户端自己要处理的cmd，不管消息处理器要不要都不会丢弃"""
+
     def __init__(
         self,
         session: Optional[aiohttp.ClientSession] = None,
@@ -105,8 +167,44 @@ class WebSocketClientBase:
         self._need_init_room = True
         self._handler: Optional[handlers.HandlerInterface] = None
         """消息处理器"""
+        self._handler_supports_batch = False
+        """消息处理器是否实现了handle_batch"""
+        self._handler_batch_is_loop = False
+        """消息处理器的handle_batch是BaseHandler的，只是逐条调用handle"""
+        self._wanted_cmds: Optional[FrozenSet[str]] = self._REQUIRED_CMDS
+        """需要反序列化的cmd，None表示全部都要"""
+        self._message_types: Optional[proc_dec.MessageTypes] = None
+        """解码进程要构造的消息类型，None表示不构造"""
+        self._parsed_messages: Optional[Dict[int, Any]] = None
+        """正在处理的解码进程构造好的消息，id(command) -> 消息"""
+        self._skipped_cmd_messages: Counter[str] = collections.Counter()
+        """cmd -> 没有反序列化就丢弃的消息数"""
+        self._skipped_cmd_bytes: Counter[str] = collections.Counter()
+        """cmd -> 没有反序列化就丢弃的字节数"""
         self._get_reconnect_interval: Callable[[int, int], float] = DEFAULT_RECONNECT_POLICY
         """重连间隔时间增长策略"""
+        self._reconnect_limiter: Optional[rate_limiter.TokenBucket] = None
+        """重连限流器，None表示使用进程内共享的默认限流器"""
+        self._decompressor: Optional[dec.Decompressor] = None
+        """解压器，None表示使用当前事件循环共享的默认解压器"""
+        self._json_codec: Optional[json_codec.JsonCodec] = None
+        """JSON编解码器，None表示使用全局默认的编解码器"""
+        self._process_decoder: Optional[proc_dec.ProcessDecoder] = None
+        """解码进程池，None表示在事件循环线程解析消息"""
+        self._event_streams: List[ev_stream.EventStream] = []
+        """推送业务消息的事件流"""
+        self._metrics: Optional[metrics_.ClientMetrics] = None
+        """热路径上的统计，None表示不统计"""
+        self._profiler: Optional[profiler_.HandlerProfiler] = None
+        """消息处理器的CPU时间抽样统计"""
+        self._recorder: Optional[recorder_.FrameRecorder] = None
+        """WebSocket消息录制器"""
+        self._host_selector: Optional[host_selector_.HostSelector] = None
+        """按延迟选择服务器，None表示按顺序轮换"""
+        self._host_offset = 0
+        """选择服务器时的偏移，同一个房间的多个连接用不同的偏移连接不同的服务器"""
+        self._deduplicator: Optional[dedup.MessageDeduplicator] = None
+        """业务消息去重，None表示不去重"""
 
         # 在调用init_room后初始化的字段
         self._room_id: Optional[int] = None
@@ -114,10 +212,16 @@ class WebSocketClientBase:
         # 在运行时初始化的字段
         self._websocket: Optional[aiohttp.ClientWebSocketResponse] = None
         """WebSocket连接"""
+        self._ws_url: Optional[str] = None
+        """当前连接的URL"""
+        self._last_ws_url: Optional[str] = None
+        """上次连接的URL，重连时避开"""
+        self._auth_start_time: Optional[float] = None
+        """发送认证包时的time.perf_counter()，收到认证响应后为None"""
         self._network_future: Optional[asyncio.Future] = None
         """网络协程的future"""
-        self._heartbeat_timer_handle: Optional[asyncio.TimerHandle] = None
-        """发心跳包定时器的handle"""
+        self._heartbeat_entry: Optional[heartbeat.HeartbeatEntry] = None
+        """注册到心跳调度器的心跳"""
 
     @property
     def is_running(self) -> bool:
@@ -126,6 +230,13 @@ class WebSocketClientBase:
         """
         return self._network_future is not None
 
+    @property
+    def is_connected(self) -> bool:
+        """
+        WebSocket连接已建立
+        """
+        return self._websocket is not None and not self._websocket.closed
+
     @property
     def room_id(self) -> Optional[int]:
         """
@@ -133,6 +244,26 @@ class WebSocketClientBase:
         """
         return self._room_id
 
+    @property
+    def heartbeat_lateness(self) -> Optional[float]:
+        """
+        上次发送心跳包比预定时间晚了多少秒，还没发送过则为None
+        """
+        if self._heartbeat_entry is None:
+            return None
+        return self._heartbeat_entry.last_lateness
+
+    def get_parsed_message(self, command: dict) -> Optional[Any]:
+        """
+        返回解码进程已经构造好的消息，只在消息处理器处理这条消息时有效
+
+        :param command: 业务消息
+        :return: 构造好的消息，没有构造则为None
+        """
+        if self._parsed_messages is None:
+            return None
+        return self._parsed_messages.get(id(command), None)
+
     def set_handler(self, handler: Optional['handlers.HandlerInterface']):
         """
         设置消息处理器
@@ -143,6 +274,138 @@ class WebSocketClientBase:
         :param handler: 消息处理器
         """
         self._handler = handler
+        self._handler_supports_batch = (
+            handler is not None
+            and type(handler).handle_batch is not handlers.HandlerInterface.handle_batch
+        )
+        self._handler_batch_is_loop = (
+            handler is not None
+            and type(handler).handle_batch is handlers.BaseHandler.handle_batch
+        )
+        self._message_types = None if handler is None else handler.get_message_types()
+        self._update_wanted_cmds()
+
+    def _update_wanted_cmds(self):
+        # 消息处理器和所有事件流要的cmd的并集，有一个要全部的则全部都要
+        handler = self._handler
+        wanted_cmds = set(self._REQUIRED_CMDS)
+        if handler is not None:
+            handler_wanted_cmds = handler.get_wanted_cmds()
+            if handler_wanted_cmds is None:
+                self._wanted_cmds = None
+                return
+            wanted_cmds.update(handler_wanted_cmds)
+        for stream in self._event_streams:
+            if stream.wanted_cmds is None:
+                self._wanted_cmds = None
+                return
+            wanted_cmds.update(stream.wanted_cmds)
+        self._wanted_cmds = frozenset(wanted_cmds)
+
+    def events(
+        self,
+        maxsize: int = ev_stream.DEFAULT_MAX_SIZE,
+        policy: 'ev_stream.OverflowPolicy' = ev_stream.OverflowPolicy.BLOCK,
+        *,
+        cmd_priorities: Optional[Dict[str, int]] = None,
+        default_priority: int = 0,
+        wanted_cmds: Optional[Iterable[str]] = None,
+    ) -> 'ev_stream.EventStream':
+        """
+        创建一个业务消息的事件流，和消息处理器互不影响。事件流在关闭或者客户端close()时停止接收消息
+
+        :param maxsize: 缓冲区大小
+        :param policy: 缓冲区满时的策略
+        :param cmd_priorities: cmd -> 优先级，数字越大越重要，只在DROP_BY_PRIORITY时使用
+        :param default_priority: 不在cmd_priorities里的cmd的优先级
+        :param wanted_cmds: 要接收的cmd，None表示全部都要
+        """
+        stream = ev_stream.EventStream(
+            maxsize, policy, cmd_priorities=cmd_priorities, default_priority=default_priority,
+            wanted_cmds=wanted_cmds
+        )
+        stream.add_source(self)
+        self._add_event_stream(stream)
+        return stream
+
+    def _add_event_stream(self, stream: 'ev_stream.EventStream'):
+        self._event_streams.append(stream)
+        self._update_wanted_cmds()
+
+    def _remove_event_stream(self, stream: 'ev_stream.EventStream'):
+        try:
+            self._event_streams.remove(stream)
+        except ValueError:
+            return
+        self._update_wanted_cmds()
+
+    @property
+    def skipped_cmd_stats(self) -> Dict[str, Dict[str, int]]:
+        """
+        没有反序列化就丢弃的消息统计，cmd -> {'messages': 消息数, 'bytes': 字节数}
+        """
+        return {
+            cmd: {'messages': count, 'bytes': self._skipped_cmd_bytes[cmd]}
+            for cmd, count in self._skipped_cmd_messages.items()
+        }
+
+    @property
+    def metrics(self) -> Optional['metrics_.ClientMetrics']:
+        """
+        热路径上的统计，用metrics.snapshot()获取快照，没有调用set_metrics开启时为None
+        """
+        return self._metrics
+
+    def set_metrics(self, metrics: Optional['metrics_.ClientMetrics']):
+        """
+        设置统计对象，默认不统计。多个客户端可以共享一个统计对象得到总和，开销见ClientMetrics
+
+        :param metrics: 统计对象，None表示不统计
+        """
+        self._metrics = metrics
+
+    def set_profiler(self, profiler: Optional['profiler_.HandlerProfiler']):
+        """
+        设置消息处理器的CPU时间抽样统计，可以多个客户端共享一个
+
+        设置后BaseHandler的消息会逐条处理，以便按cmd统计；自定义了handle_batch的消息处理器只能按整批统计
+
+        :param profiler: 抽样统计，None表示不统计
+        """
+        self._profiler = profiler
+
+    def set_recorder(self, recorder: Optional['recorder_.FrameRecorder']):
+        """
+        设置WebSocket消息录制器，收到的二进制消息会原样写到文件，可以多个客户端共享一个
+
+        :param recorder: 录制器，None表示不录制
+        """
+        self._recorder = recorder
+
+    def set_host_selector(self, selector: Optional['host_selector_.HostSelector']):
+        """
+        设置按延迟选择服务器的选择器，可以多个客户端共享一个
+
+        :param selector: 选择器，None表示按顺序轮换服务器
+        """
+        self._host_selector = selector
+
+    def set_host_offset(self, offset: int):
+        """
+        设置选择服务器时的偏移，第一次连接选第offset个服务器（设置了选择器则是按分数排序后的），重连时从这里开始依次尝试。
+        同一个房间的多个连接用不同的偏移，可以连接到不同的服务器
+
+        :param offset: 偏移
+        """
+        self._host_offset = offset
+
+    def set_deduplicator(self, deduplicator: Optional['dedup.MessageDeduplicator']):
+        """
+        设置业务消息去重，重复的消息不会推送到事件流和消息处理器，可以多个客户端共享一个
+
+        :param deduplicator: 去重器，None表示不去重
+        """
+        self._deduplicator = deduplicator
 
     def set_reconnect_policy(self, get_reconnect_interval: Callable[[int, int], float]):
         """
@@ -152,6 +415,45 @@ class WebSocketClientBase:
         """
         self._get_reconnect_interval = get_reconnect_interval
 
+    def set_reconnect_limiter(self, limiter: Optional['rate_limiter.TokenBucket']):
+        """
+        设置重连限流器，每次重连前要从限流器获取令牌，可以多个客户端共享一个
+
+        :param limiter: 限流器，None表示使用进程内共享的默认限流器
+        """
+        self._reconnect_limiter = limiter
+
+    def _get_reconnect_limiter(self) -> 'rate_limiter.TokenBucket':
+        if self._reconnect_limiter is not None:
+            return self._reconnect_limiter
+        return rate_limiter.get_default_reconnect_limiter()
+
+    def set_decompressor(self, decompressor: Optional['dec.Decompressor']):
+        """
+        设置解压器
+
+        :param decompressor: 解压器，None表示使用当前事件循环共享的默认解压器
+        """
+        self._decompressor = decompressor
+
+    def set_json_codec(self, codec: Union['json_codec.JsonCodec', str, None]):
+        """
+        设置JSON编解码器
+
+        :param codec: 编解码器或者名字，例如'orjson'，None表示使用全局默认的编解码器
+        """
+        if isinstance(codec, str):
+            codec = json_codec.get_codec(codec)
+        self._json_codec = codec
+
+    def set_process_decoder(self, decoder: Optional['proc_dec.ProcessDecoder']):
+        """
+        设置解码进程池，设置后WebSocket消息的分包、解压、反序列化都在子进程执行，适合一个进程连接大量房间的情况
+
+        :param decoder: 解码进程池，None表示在事件循环线程解析消息
+        """
+        self._process_decoder = decoder
+
     def start(self):
         """
         启动本客户端
@@ -198,6 +500,10 @@ class WebSocketClientBase:
         if self.is_running:
             logger.warning('room=%s is calling close(), but client is running', self.room_id)
 
+        for stream in list(self._event_streams):
+            self._remove_event_stream(stream)
+            stream.remove_source(self)
+
         # 如果session是自己创建的则关闭session
         if self._own_session:
             await self._session.close()
@@ -210,8 +516,7 @@ class WebSocketClientBase:
         """
         raise NotImplementedError
 
-    @staticmethod
-    def _make_packet(data: Union[dict, str, bytes], operation: int) -> bytes:
+    def _make_packet(self, data: Union[dict, str, bytes], operation: int) -> bytes:
         """
         创建一个要发送给服务器的包
 
@@ -220,7 +525,7 @@ class WebSocketClientBase:
         :return: 整个包的数据
         """
         if isinstance(data, dict):
-            body = json.dumps(data).encode('utf-8')
+            body = self._get_json_codec().dumps(data)
         elif isinstance(data, str):
             body = data.encode('utf-8')
         else:
@@ -266,12 +571,19 @@ class WebSocketClientBase:
                 await self._on_before_ws_connect(retry_count)
 
                 # 连接
+                self._ws_url = await self._select_ws_url(retry_count)
+                connect_start_time = time.perf_counter()
                 async with self._session.ws_connect(
-                    self._get_ws_url(retry_count),
+                    self._ws_url,
                     headers={'User-Agent': utils.USER_AGENT},  # web端的token也会签名UA
                     receive_timeout=self._heartbeat_interval + 5,
                 ) as websocket:
                     self._websocket = websocket
+                    if self._metrics is not None:
+                        self._metrics.on_connected()
+                    if self._host_selector is not None:
+                        self._host_selector.record_connect(self._ws_url, time.perf_counter() - connect_start_time)
+                    self._auth_start_time = time.perf_counter()
                     await self._on_ws_connect()
 
                     # 处理消息
@@ -283,13 +595,20 @@ class WebSocketClientBase:
 
             except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
                 # 掉线重连
-                pass
+                if self._websocket is None and self._ws_url is not None and self._host_selector is not None:
+                    # 没连上，算这个服务器失败一次
+                    self._host_selector.record_failure(self._ws_url)
             except AuthError:
                 # 认证失败了，应该重新获取token再重连
                 logger.exception('room=%d auth failed, trying init_room() again', self.room_id)
                 self._need_init_room = True
             finally:
+                if self._websocket is not None and self._metrics is not None:
+                    self._metrics.on_disconnected()
                 self._websocket = None
+                self._last_ws_url = self._ws_url
+                self._ws_url = None
+                self._auth_start_time = None
                 await self._on_ws_close()
 
             # 准备重连
@@ -300,6 +619,8 @@ class WebSocketClientBase:
                 self.room_id, retry_count, total_retry_count
             )
             await asyncio.sleep(self._get_reconnect_interval(retry_count, total_retry_count))
+            # 大量房间同时断线时，限制总的重连速度，避免请求太多被限流
+            await self._get_reconnect_limiter().acquire()
 
     async def _on_before_ws_connect(self, retry_count):
         """
@@ -312,9 +633,40 @@ class WebSocketClientBase:
             raise InitError('init_room() failed')
         self._need_init_room = False
 
+    async def _select_ws_url(self, retry_count) -> str:
+        """
+        选择这次连接的URL，如果选择器开启了探测，第一次连接前先对候选服务器探测，用最先连上的
+
+        重连时不探测，选上次连接的服务器以外分数最低的，否则TCP能连上但是握手失败的服务器会一直被选中
+        """
+        if (
+            retry_count == 0
+            and self._host_selector is not None
+            and self._host_selector.probe_enabled
+            and self._host_offset == 0
+        ):
+            urls = self._get_ws_urls()
+            if len(urls) > 1:
+                url = await self._host_selector.probe(urls)
+                if url is not None:
+                    return url
+        return self._get_ws_url(retry_count)
+
     def _get_ws_url(self, retry_count) -> str:
         """
         返回WebSocket连接的URL，可以在这里做故障转移和负载均衡
+
+        默认从_get_ws_urls里选，设置了选择器则按延迟选择，重连时避开上次的服务器，否则按顺序轮换
+        """
+        urls = self._get_ws_urls()
+        if self._host_selector is not None:
+            exclude = self._last_ws_url if retry_count > 0 else None
+            return self._host_selector.select(urls, self._host_offset, exclude)
+        return urls[(retry_count + self._host_offset) % len(urls)]
+
+    def _get_ws_urls(self) -> List[str]:
+        """
+        返回所有候选的WebSocket连接URL
         """
         raise NotImplementedError
 
@@ -323,17 +675,17 @@ class WebSocketClientBase:
         WebSocket连接成功
         """
         await self._send_auth()
-        self._heartbeat_timer_handle = asyncio.get_running_loop().call_later(
-            self._heartbeat_interval, self._on_send_heartbeat
+        self._heartbeat_entry = heartbeat.get_heartbeat_scheduler(self._heartbeat_interval).register(
+            self._send_heartbeat
         )
 
     async def _on_ws_close(self):
         """
         WebSocket连接断开
         """
-        if self._heartbeat_timer_handle is not None:
-            self._heartbeat_timer_handle.cancel()
-            self._heartbeat_timer_handle = None
+        if self._heartbeat_entry is not None:
+            heartbeat.get_heartbeat_scheduler(self._heartbeat_interval).unregister(self._heartbeat_entry)
+            self._heartbeat_entry = None
 
     async def _send_auth(self):
         """
@@ -341,28 +693,15 @@ class WebSocketClientBase:
         """
         raise NotImplementedError
 
-    def _on_send_heartbeat(self):
-        """
-        定时发送心跳包的回调
-        """
-        if self._websocket is None or self._websocket.closed:
-            self._heartbeat_timer_handle = None
-            return
-
-        self._heartbeat_timer_handle = asyncio.get_running_loop().call_later(
-            self._heartbeat_interval, self._on_send_heartbeat
-        )
-        asyncio.create_task(self._send_heartbeat())
-
     async def _send_heartbeat(self):
         """
-        发送心跳包
+        发送心跳包，由心跳调度器定时调用
         """
         if self._websocket is None or self._websocket.closed:
             return
 
         try:
-            await self._websocket.send_bytes(self._make_packet({}, Operation.HEARTBEAT))
+            await self._websocket.send_bytes(HEARTBEAT_PACKET)
         except (ConnectionResetError, aiohttp.ClientConnectionError) as e:
             logger.warning('room=%d _send_heartbeat() failed: %r', self.room_id, e)
         except Exception:  # noqa
@@ -379,102 +718,297 @@ class WebSocketClientBase:
                            message.type, message.data)
             return
 
+        if self._metrics is not None:
+            self._metrics.on_frame(len(message.data))
+        if self._recorder is not None:
+            self._recorder.record(self.room_id, message.data)
         try:
-            await self._parse_ws_message(message.data)
+            if self._process_decoder is not None:
+                await self._parse_ws_message_in_process(message.data)
+            else:
+                await self._parse_ws_message(message.data)
         except AuthError:
             # 认证失败，让外层处理
             raise
         except Exception:  # noqa
             logger.exception('room=%d _parse_ws_message() error:', self.room_id)
 
+        if self._event_streams:
+            # BLOCK策略的事件流满了则等消费者，不读下一个WebSocket消息
+            for stream in list(self._event_streams):
+                if stream.policy == ev_stream.OverflowPolicy.BLOCK:
+                    await stream.wait_not_full()
+
     async def _parse_ws_message(self, data: bytes):
         """
         解析WebSocket消息
 
         :param data: WebSocket消息数据
         """
-        offset = 0
+        view = memoryview(data)
         try:
-            header = HeaderTuple(*HEADER_STRUCT.unpack_from(data, offset))
+            header = HeaderTuple(*HEADER_STRUCT.unpack_from(view, 0))
         except struct.error:
-            logger.exception('room=%d parsing header failed, offset=%d, data=%s', self.room_id, offset, data)
+            logger.exception('room=%d parsing header failed, offset=0, data=%s', self.room_id, data)
             return
 
         if header.operation in (Operation.SEND_MSG_REPLY, Operation.AUTH_REPLY):
-            # 业务消息，可能有多个包一起发，需要分包
-            while True:
-                body = data[offset + header.raw_header_size: offset + header.pack_len]
-                await self._parse_business_message(header, body)
-
-                offset += header.pack_len
-                if offset >= len(data):
-                    break
-
-                try:
-                    header = HeaderTuple(*HEADER_STRUCT.unpack_from(data, offset))
-                except struct.error:
-                    logger.exception('room=%d parsing header failed, offset=%d, data=%s', self.room_id, offset, data)
-                    break
+            # 业务消息，可能有多个包一起发，需要分包。压缩过的包解压后压栈继续分包，不用递归
+            commands = []
+            packet_iters = [iter_packets(view)]
+            try:
+                while packet_iters:
+                    try:
+                        packet = next(packet_iters[-1], None)
+                    except struct.error:
+                        logger.exception('room=%d parsing header failed, data=%s', self.room_id, data)
+                        packet_iters.pop()
+                        continue
+                    if packet is None:
+                        packet_iters.pop()
+                        continue
+
+                    decompressed = await self._parse_business_message(*packet, commands)
+                    if decompressed is not None:
+                        packet_iters.append(iter_packets(decompressed))
+            finally:
+                # 一个WebSocket消息里的业务消息一起处理，中途出错时也要处理已经解析出来的
+                if commands:
+                    if self._metrics is not None:
+                        self._metrics.decoded_messages += len(commands)
+                    self._handle_commands(commands)
 
         elif header.operation == Operation.HEARTBEAT_REPLY:
             # 服务器心跳包，前4字节是人气值，后面是客户端发的心跳包内容
             # pack_len不包括客户端发的心跳包内容，不知道是不是服务器BUG
-            body = data[offset + header.raw_header_size: offset + header.raw_header_size + 4]
-            popularity = int.from_bytes(body, 'big')
-            # 自己造个消息当成业务消息处理
-            body = {
-                'cmd': '_HEARTBEAT',
-                'data': {
-                    'popularity': popularity
-                }
-            }
-            self._handle_command(body)
+            if self._metrics is not None:
+                self._metrics.packets[(header.operation, header.ver)] += 1
+            popularity = int.from_bytes(view[header.raw_header_size: header.raw_header_size + 4], 'big')
+            self._on_heartbeat_reply(popularity)
 
         else:
             # 未知消息
-            body = data[offset + header.raw_header_size: offset + header.pack_len]
+            body = data[header.raw_header_size: header.pack_len]
             logger.warning('room=%d unknown message operation=%d, header=%s, body=%s', self.room_id,
                            header.operation, header, body)
 
-    async def _parse_business_message(self, header: HeaderTuple, body: bytes):
+    async def _parse_ws_message_in_process(self, data: bytes):
+        """
+        在解码进程解析WebSocket消息，然后在本进程处理结果
+
+        :param data: WebSocket消息数据
+        """
+        res = await self._process_decoder.decode(
+            data, self._wanted_cmds, self._get_json_codec().name, self._message_types
+        )
+
+        for warning in res.warnings:
+            logger.warning('room=%d %s', self.room_id, warning)
+        metrics = self._metrics
+        for cmd, count, size in res.skipped_cmds:
+            self._skipped_cmd_messages[cmd] += count
+            self._skipped_cmd_bytes[cmd] += size
+            if metrics is not None:
+                metrics.skipped_messages += count
+        if metrics is not None:
+            metrics.decoded_messages += len(res.commands)
+
+        try:
+            if res.auth_reply is not None:
+                await self._on_auth_reply(res.auth_reply)
+            if res.popularity is not None:
+                self._on_heartbeat_reply(res.popularity)
+        finally:
+            if res.commands:
+                if res.messages is not None:
+                    self._parsed_messages = {
+                        id(command): message for command, message in zip(res.commands, res.messages)
+                        if message is not None
+                    }
+                try:
+                    self._handle_commands(res.commands)
+                finally:
+                    self._parsed_messages = None
+
+        if res.error is not None:
+            logger.error('room=%d decoding in process failed, data=%s\n%s', self.room_id, data, res.error)
+
+    async def _parse_business_message(
+        self, operation: int, ver: int, body: memoryview, commands: List[dict]
+    ) -> Optional[bytes]:
         """
         解析业务消息
+
+        :param operation: 操作码，见Operation
+        :param ver: 包体协议版本，见ProtoVer
+        :param body: 包体数据，是WebSocket消息数据的memoryview
+        :param commands: 反序列化后的业务消息会添加到这个列表，由调用者一起处理
+        :return: 如果包体是压缩过的，返回解压后的数据，由调用者继续分包，否则返回None
         """
-        if header.operation == Operation.SEND_MSG_REPLY:
+        # 未压缩的业务消息太多了，不在这里计数，按WebSocket消息统计反序列化和丢弃的消息数。
+        # 其他包在各自的分支里计数，这样未压缩的业务消息不用多比较一次operation和ver
+        metrics = self._metrics
+        if operation == Operation.SEND_MSG_REPLY:
             # 业务消息
-            if header.ver == ProtoVer.BROTLI:
-                # 压缩过的先解压，为了避免阻塞网络线程，放在其他线程执行
-                body = await asyncio.get_running_loop().run_in_executor(None, brotli.decompress, body)
-                await self._parse_ws_message(body)
-            elif header.ver == ProtoVer.DEFLATE:
+            if ver in (ProtoVer.BROTLI, ProtoVer.DEFLATE):
+                # 压缩过的先解压，大包为了避免阻塞网络线程，解压器会放在其他线程执行
                 # web端已经不用zlib压缩了，但是开放平台会用
-                body = await asyncio.get_running_loop().run_in_executor(None, zlib.decompress, body)
-                await self._parse_ws_message(body)
-            elif header.ver == ProtoVer.NORMAL:
+                decompress = brotli.decompress if ver == ProtoVer.BROTLI else zlib.decompress
+                if metrics is None:
+                    return await self._get_decompressor().decompress(decompress, body)
+                metrics.packets[(operation, ver)] += 1
+                if metrics.timing_sampled:
+                    start_time = time.perf_counter_ns()
+                    decompressed = await self._get_decompressor().decompress(decompress, body)
+                    metrics.decompress_time.record(time.perf_counter_ns() - start_time)
+                else:
+                    decompressed = await self._get_decompressor().decompress(decompress, body)
+                metrics.compressed_bytes += len(body)
+                metrics.decompressed_bytes += len(decompressed)
+                return decompressed
+            elif ver == ProtoVer.NORMAL:
                 # 没压缩过的直接反序列化，因为有万恶的GIL，这里不能并行避免阻塞
                 if len(body) != 0:
+                    if self._wanted_cmds is not None and self._skip_unwanted_cmd(body):
+                        return None
+                    loads = self._get_json_codec().loads
                     try:
-                        body = json.loads(body.decode('utf-8'))
-                        self._handle_command(body)
+                        if metrics is not None and metrics.timing_sampled:
+                            start_time = time.perf_counter_ns()
+                            command = loads(body)
+                            metrics.json_decode_time.record(time.perf_counter_ns() - start_time)
+                        else:
+                            command = loads(body)
                     except Exception:
-                        logger.error('room=%d, body=%s', self.room_id, body)
+                        logger.error('room=%d, body=%s', self.room_id, bytes(body))
                         raise
+                    commands.append(command)
+                elif metrics is not None:
+                    metrics.packets[(operation, ver)] += 1
             else:
                 # 未知格式
-                logger.warning('room=%d unknown protocol version=%d, header=%s, body=%s', self.room_id,
-                               header.ver, header, body)
+                if metrics is not None:
+                    metrics.packets[(operation, ver)] += 1
+                logger.warning('room=%d unknown protocol version=%d, body=%s', self.room_id, ver, bytes(body))
 
-        elif header.operation == Operation.AUTH_REPLY:
+        elif operation == Operation.AUTH_REPLY:
             # 认证响应
-            body = json.loads(body.decode('utf-8'))
-            if body['code'] != AuthReplyCode.OK:
-                raise AuthError(f"auth reply error, code={body['code']}, body={body}")
-            await self._websocket.send_bytes(self._make_packet({}, Operation.HEARTBEAT))
+            if metrics is not None:
+                metrics.packets[(operation, ver)] += 1
+            await self._on_auth_reply(self._get_json_codec().loads(body))
 
         else:
             # 未知消息
-            logger.warning('room=%d unknown message operation=%d, header=%s, body=%s', self.room_id,
-                           header.operation, header, body)
+            if metrics is not None:
+                metrics.packets[(operation, ver)] += 1
+            logger.warning('room=%d unknown message operation=%d, ver=%d, body=%s', self.room_id,
+                           operation, ver, bytes(body))
+        return None
+
+    def _on_heartbeat_reply(self, popularity: int):
+        """
+        收到服务器心跳包
+
+        :param popularity: 人气值
+        """
+        # 自己造个消息当成业务消息处理
+        body = {
+            'cmd': '_HEARTBEAT',
+            'data': {
+                'popularity': popularity
+            }
+        }
+        if self._deduplicator is not None and not self._deduplicator.filter(self.room_id, [body]):
+            return
+        self._publish_events([body])
+        self._handle_command(body)
+
+    async def _on_auth_reply(self, body: dict):
+        """
+        收到认证响应
+
+        :param body: 反序列化后的包体
+        """
+        if body['code'] != AuthReplyCode.OK:
+            raise AuthError(f"auth reply error, code={body['code']}, body={body}")
+        if self._auth_start_time is not None:
+            if self._host_selector is not None:
+                self._host_selector.record_auth(self._ws_url, time.perf_counter() - self._auth_start_time)
+            self._auth_start_time = None
+        await self._websocket.send_bytes(HEARTBEAT_PACKET)
+
+    def _skip_unwanted_cmd(self, body: memoryview) -> bool:
+        """
+        不反序列化，直接从包体读取cmd，如果是不需要的cmd则计数并返回True
+        """
+        cmd = peek_cmd(body)
+        if cmd is None or cmd in self._wanted_cmds:
+            return False
+
+        self._skipped_cmd_messages[cmd] += 1
+        self._skipped_cmd_bytes[cmd] += len(body)
+        if self._metrics is not None:
+            self._metrics.skipped_messages += 1
+        return True
+
+    def _get_decompressor(self) -> 'dec.Decompressor':
+        if self._decompressor is not None:
+            return self._decompressor
+        return dec.get_default_decompressor()
+
+    def _get_json_codec(self) -> 'json_codec.JsonCodec':
+        if self._json_codec is not None:
+            return self._json_codec
+        return json_codec.get_default_codec()
+
+    def _handle_commands(self, commands: List[dict]):
+        """
+        处理一个WebSocket消息里的所有业务消息，如果消息处理器实现了handle_batch则一次调用，否则逐条处理
+
+        :param commands: 业务消息
+        """
+        if self._deduplicator is not None:
+            commands = self._deduplicator.filter(self.room_id, commands)
+            if not commands:
+                return
+        self._publish_events(commands)
+        if self._handler is None:
+            return
+        metrics = self._metrics
+        if metrics is None or not metrics.timing_sampled:
+            self._call_handler(commands)
+            return
+        start_time = time.perf_counter_ns()
+        self._call_handler(commands)
+        metrics.handler_time.record(time.perf_counter_ns() - start_time)
+
+    def _call_handler(self, commands: List[dict]):
+        profiler = self._profiler
+        if not self._handler_supports_batch or (profiler is not None and self._handler_batch_is_loop):
+            for command in commands:
+                self._handle_command(command)
+            return
+        try:
+            if profiler is not None and profiler.should_sample():
+                start_time = time.thread_time_ns()
+                try:
+                    self._handler.handle_batch(self, commands)
+                finally:
+                    profiler.record(
+                        self.room_id, profiler_.BATCH_CMD, f'{type(self._handler).__name__}.handle_batch',
+                        time.thread_time_ns() - start_time, len(commands)
+                    )
+            else:
+                self._handler.handle_batch(self, commands)
+        except Exception as e:
+            logger.exception('room=%d _handle_commands() failed, commands=%s', self.room_id, commands, exc_info=e)
+
+    def _publish_events(self, commands: List[dict]):
+        """
+        把业务消息放进所有事件流
+        """
+        for stream in self._event_streams:
+            stream.put_commands(self, commands)
 
     def _handle_command(self, command: dict):
         """
@@ -489,6 +1023,26 @@ class WebSocketClientBase:
             # 1. 为了保持处理消息的顺序，这里不使用call_soon、create_task等方法延迟处理
             # 2. 如果支持handle使用async函数，用户可能会在里面处理耗时很长的异步操作，导致网络协程阻塞
             # 这里做成同步的，强制用户使用create_task或消息队列处理异步操作，这样就不会阻塞网络协程
-            self._handler.handle(self, command)
+            profiler = self._profiler
+            if profiler is not None and profiler.should_sample():
+                self._handle_command_profiled(profiler, command)
+            else:
+                self._handler.handle(self, command)
         except Exception as e:
             logger.exception('room=%d _handle_command() failed, command=%s', self.room_id, command, exc_info=e)
+
+    def _handle_command_profiled(self, profiler: 'profiler_.HandlerProfiler', command: dict):
+        """
+        处理业务消息并记录CPU时间
+        """
+        cmd = command.get('cmd', '')
+        pos = cmd.find(':')  # 2019-5-29 B站弹幕升级新增了参数
+        if pos != -1:
+            cmd = cmd[:pos]
+        start_time = time.thread_time_ns()
+        try:
+            self._handler.handle(self, command)
+        finally:
+            profiler.record(
+                self.room_id, cmd, profiler.get_method_name(self._handler, cmd), time.thread_time_ns() - start_time
+            )
@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import concurrent.futures
+import functools
+import logging
+import time
+import weakref
+from typing import *
+
+__all__ = (
+    'Decompressor',
+    'get_default_decompressor',
+    'set_default_decompressor',
+)
+
+logger = logging.getLogger('blivedm')
+
+DecompressFunc = Callable[[Union[bytes, memoryview]], bytes]
+
+DEFAULT_INLINE_THRESHOLD = 16 * 1024
+"""自动校准前的内联解压阈值（压缩后字节数）"""
+MIN_INLINE_THRESHOLD = 256
+MAX_INLINE_THRESHOLD = 1024 * 1024
+_EWMA_ALPHA = 0.1
+
+
+def _decompress_batch(items: List[Tuple[DecompressFunc, Union[bytes, memoryview]]]):
+    """
+    在解压线程池里执行，一次解压一批
+
+    :return: (结果列表, 解压耗时纳秒)，结果是解压后的数据或者异常
+    """
+    start = time.perf_counter_ns()
+    results = []
+    for func, body in items:
+        try:
+            results.append(func(body))
+        except Exception as e:  # noqa
+            results.append(e)
+    return results, time.perf_counter_ns() - start
+
+
+class Decompressor:
+    """
+    解压器，小包在事件循环线程直接解压，大包放到专用的线程池解压，同一轮事件循环里收到的大包合并成一次提交
+
+    注意不是线程安全的，所有使用同一个解压器的客户端要运行在同一个事件循环。默认解压器每个事件循环一个
+
+    :param inline_threshold: 压缩后小于这个字节数的包直接解压，None表示根据实际耗时自动校准
+    :param max_workers: 解压线程池的线程数
+    :param max_batch_size: 一批最多合并多少个包
+    :param max_queued_batches: 最多同时有多少批在线程池排队或执行，超过后直接解压，防止队列无限增长
+    """
+
+    def __init__(
+        self,
+        inline_threshold: Optional[int] = None,
+        *,
+        max_workers: int = 2,
+        max_batch_size: int = 64,
+        max_queued_batches: Optional[int] = None,
+    ):
+        self._auto_threshold = inline_threshold is None
+        self._inline_threshold = DEFAULT_INLINE_THRESHOLD if inline_threshold is None else inline_threshold
+        self._max_workers = max_workers
+        self._max_batch_size = max_batch_size
+        self._max_queued_batches = max_workers * 2 if max_queued_batches is None else max_queued_batches
+
+        self._executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+        """解压线程池，第一次用到时创建"""
+        self._pending: List[Tuple[DecompressFunc, Union[bytes, memoryview], asyncio.Future]] = []
+        """等待提交到线程池的包"""
+        self._flush_handle: Optional[asyncio.Handle] = None
+        self._queued_batches = 0
+
+        # 用来自动校准阈值的估计值
+        self._inline_ns_per_byte: Optional[float] = None
+        """直接解压时每个压缩字节的耗时"""
+        self._offload_overhead_ns: Optional[float] = None
+        """每次提交到线程池除了解压以外的额外耗时"""
+
+        # 统计
+        self._inline_frames = 0
+        self._inline_bytes = 0
+        self._inline_ns = 0
+        self._offloaded_frames = 0
+        self._offloaded_bytes = 0
+        self._offload_ns = 0
+        self._offload_worker_ns = 0
+        self._batches = 0
+
+    @property
+    def inline_threshold(self) -> int:
+        """
+        当前的内联解压阈值（压缩后字节数）
+        """
+        return self._inline_threshold
+
+    @property
+    def stats(self) -> dict:
+        """
+        统计信息的快照。offload_seconds是从提交到拿到结果的时间，offload_worker_seconds是线程池里实际解压的时间
+        """
+        return {
+            'inline_threshold': self._inline_threshold,
+            'inline_frames': self._inline_frames,
+            'inline_bytes': self._inline_bytes,
+            'inline_seconds': self._inline_ns / 1e9,
+            'offloaded_frames': self._offloaded_frames,
+            'offloaded_bytes': self._offloaded_bytes,
+            'offload_seconds': self._offload_ns / 1e9,
+            'offload_worker_seconds': self._offload_worker_ns / 1e9,
+            'batches': self._batches,
+        }
+
+    async def decompress(self, func: DecompressFunc, body: Union[bytes, memoryview]) -> bytes:
+        """
+        解压一个包
+
+        :param func: 解压函数，例如brotli.decompress、zlib.decompress
+        :param body: 压缩过的包体
+        :return: 解压后的数据
+        """
+        if len(body) < self._inline_threshold or self._queued_batches >= self._max_queued_batches:
+            return self._decompress_inline(func, body)
+        return await self._decompress_offload(func, body)
+
+    def close(self):
+        """
+        关闭解压线程池
+        """
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        for _func, _body, future in self._pending:
+            if not future.done():
+                future.cancel()
+        self._pending = []
+
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def _decompress_inline(self, func: DecompressFunc, body: Union[bytes, memoryview]) -> bytes:
+        start = time.perf_counter_ns()
+        res = func(body)
+        elapsed = time.perf_counter_ns() - start
+
+        self._inline_frames += 1
+        self._inline_bytes += len(body)
+        self._inline_ns += elapsed
+        if self._auto_threshold and len(body) != 0:
+            self._inline_ns_per_byte = self._update_ewma(self._inline_ns_per_byte, elapsed / len(body))
+            self._update_threshold()
+        return res
+
+    def _decompress_offload(self, func: DecompressFunc, body: Union[bytes, memoryview]) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((func, body, future))
+        if len(self._pending) >= self._max_batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            # 延迟到这一轮事件循环最后再提交，这样其他房间在同一轮收到的包可以合并成一批
+            self._flush_handle = loop.call_soon(self._flush)
+        return future
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+
+        if self._executor is None:
+            self._executor = concurrent.futures.ThreadPoolExecutor(
+                self._max_workers, thread_name_prefix='blivedm-decompress'
+            )
+        self._queued_batches += 1
+        executor_future = asyncio.get_running_loop().run_in_executor(
+            self._executor, _decompress_batch, [(func, body) for func, body, _future in batch]
+        )
+        executor_future.add_done_callback(
+            functools.partial(self._on_batch_done, batch, time.perf_counter_ns())
+        )
+
+    def _on_batch_done(self, batch, start_ns: int, executor_future: asyncio.Future):
+        elapsed = time.perf_counter_ns() - start_ns
+        self._queued_batches -= 1
+
+        try:
+            results, worker_ns = executor_future.result()
+        except BaseException as e:  # noqa
+            # 线程池被关闭等情况
+            for _func, _body, future in batch:
+                if not future.done():
+                    if isinstance(e, asyncio.CancelledError):
+                        future.cancel()
+                    else:
+                        future.set_exception(e)
+            return
+
+        for (_func, _body, future), res in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(res, Exception):
+                future.set_exception(res)
+            else:
+                future.set_result(res)
+
+        self._batches += 1
+        self._offloaded_frames += len(batch)
+        self._offloaded_bytes += sum(len(body) for _func, body, _future in batch)
+        self._offload_ns += elapsed
+        self._offload_worker_ns += worker_ns
+        if self._auto_threshold:
+            self._offload_overhead_ns = self._update_ewma(self._offload_overhead_ns, max(elapsed - worker_ns, 0))
+            self._update_threshold()
+
+    @staticmethod
+    def _update_ewma(old: Optional[float], sample: float) -> float:
+        if old is None:
+            return sample
+        return old + _EWMA_ALPHA * (sample - old)
+
+    def _update_threshold(self):
+        """
+        直接解压比提交到线程池的额外耗时还慢时才值得提交到线程池
+        """
+        if self._inline_ns_per_byte is None or self._offload_overhead_ns is None or self._inline_ns_per_byte <= 0:
+            return
+        threshold = int(self._offload_overhead_ns / self._inline_ns_per_byte)
+        self._inline_threshold = min(max(threshold, MIN_INLINE_THRESHOLD), MAX_INLINE_THRESHOLD)
+
+
+_default_decompressors: 'weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Decompressor]' = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def get_default_decompressor() -> Decompressor:
+    """
+    获取当前事件循环共享的默认解压器，没有设置解压器的客户端会用这个
+    """
+    loop = asyncio.get_running_loop()
+    decompressor = _default_decompressors.get(loop, None)
+    if decompressor is None:
+        decompressor = _default_decompressors[loop] = Decompressor()
+    return decompressor
+
+
+def set_default_decompressor(decompressor: Optional[Decompressor]):
+    """
+    设置当前事件循环共享的默认解压器
+
+    :param decompressor: 解压器，None表示下次使用时重新创建一个默认配置的
+    """
+    loop = asyncio.get_running_loop()
+    if decompressor is None:
+        _default_decompressors.pop(loop, None)
+    else:
+        _default_decompressors[loop] = decompressor
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+import collections
+import logging
+import time
+from typing import *
+
+__all__ = (
+    'MessageDeduplicator',
+    'get_message_key',
+)
+
+logger = logging.getLogger('blivedm')
+
+_OPEN_LIVE_CMD_PREFIX = 'LIVE_OPEN_PLATFORM_'
+
+
+def _get_danmaku_key(command: dict) -> Hashable:
+    info = command['info']
+    # rnd是发送端的随机数，同一个人连续发的弹幕可能相同，所以加上时间戳、用户ID、内容
+    return info[0][4], info[0][5], info[2][0], info[1]
+
+
+def _get_gift_key(command: dict) -> Hashable:
+    return command['data']['tid']
+
+
+def _get_guard_buy_key(command: dict) -> Hashable:
+    # 没有唯一ID
+    data = command['data']
+    return data['uid'], data['gift_id'], data['num'], data['start_time']
+
+
+def _get_super_chat_key(command: dict) -> Hashable:
+    return command['data']['id']
+
+
+def _get_super_chat_delete_key(command: dict) -> Hashable:
+    return tuple(command['data']['ids'])
+
+
+_KEY_GETTERS: Dict[str, Callable[[dict], Hashable]] = {
+    'DANMU_MSG': _get_danmaku_key,
+    'SEND_GIFT': _get_gift_key,
+    'GUARD_BUY': _get_guard_buy_key,
+    'SUPER_CHAT_MESSAGE': _get_super_chat_key,
+    'SUPER_CHAT_MESSAGE_DELETE': _get_super_chat_delete_key,
+}
+"""cmd -> 从业务消息取唯一标识的函数，开放平台的消息统一用msg_id"""
+
+
+def get_message_key(command: dict) -> Optional[Hashable]:
+    """
+    取业务消息的唯一标识，用来去重
+
+    :param command: 业务消息
+    :return: (cmd, 标识)，不支持的cmd或者缺少字段则为None
+    """
+    cmd = command.get('cmd', '')
+    pos = cmd.find(':')  # 2019-5-29 B站弹幕升级新增了参数
+    if pos != -1:
+        cmd = cmd[:pos]
+    try:
+        key_getter = _KEY_GETTERS.get(cmd, None)
+        if key_getter is not None:
+            return cmd, key_getter(command)
+        if cmd.startswith(_OPEN_LIVE_CMD_PREFIX):
+            msg_id = command['data'].get('msg_id', '')
+            return (cmd, msg_id) if msg_id != '' else None
+    except (KeyError, IndexError, TypeError, AttributeError):
+        pass
+    return None
+
+
+class MessageDeduplicator:
+    """
+    业务消息去重，丢弃在时间窗口内已经处理过的消息，例如重连后服务器重发的、多个连接收到的同一条消息
+
+    已处理的消息只保存标识的64位哈希值，按时间分成几代，每过window / generations秒或者当前代满了就丢弃最老的一代，
+    所以内存有上限，窗口内的消息至少保存window * (generations - 1) / generations秒。
+    哈希碰撞的概率在几百万条消息时可以忽略
+
+    可以被多个客户端共享，用客户端的set_deduplicator设置
+
+    :param window: 去重的时间窗口（秒）
+    :param max_entries: 最多保存多少条消息的标识
+    :param generations: 分成几代
+    """
+
+    def __init__(self, window: float = 300.0, max_entries: int = 500_000, generations: int = 4):
+        if generations < 2:
+            raise ValueError(f'generations must be at least 2, got {generations}')
+        self._generation_duration = window / generations
+        self._generation_size = max(1, max_entries // generations)
+        self._generations: Deque[Set[int]] = collections.deque([set()], maxlen=generations)
+        """最新的一代在最后"""
+        self._generation_start_time = time.monotonic()
+
+        # 统计
+        self._hits = 0
+        self._misses = 0
+        self._unkeyed = 0
+        self._rotations = 0
+
+    @property
+    def stats(self) -> dict:
+        return {
+            'hits': self._hits,
+            'misses': self._misses,
+            'unkeyed': self._unkeyed,
+            'entries': sum(len(generation) for generation in self._generations),
+            'rotations': self._rotations,
+        }
+
+    def _rotate_if_needed(self):
+        now = time.monotonic()
+        elapsed = now - self._generation_start_time
+        if elapsed >= self._generation_duration:
+            # 很久没有消息时一次轮换多代，否则过期的消息还会留在较新的几代里
+            generations = self._generations.maxlen
+            num = int(elapsed / self._generation_duration)
+            if num >= generations:
+                num = generations
+                self._generation_start_time = now
+            else:
+                self._generation_start_time += num * self._generation_duration
+        elif len(self._generations[-1]) >= self._generation_size:
+            num = 1
+            self._generation_start_time = now
+        else:
+            return
+        for _ in range(num):
+            self._generations.append(set())
+        self._rotations += num
+
+    def _check_and_add(self, room_id: Optional[int], command: dict, keep_unkeyed: bool = True) -> bool:
+        """
+        :return: 是否重复
+        """
+        key = get_message_key(command)
+        if key is None:
+            self._unkeyed += 1
+            return not keep_unkeyed
+        key_hash = hash((room_id, key))
+        for generation in reversed(self._generations):
+            if key_hash in generation:
+                self._hits += 1
+                return True
+        self._generations[-1].add(key_hash)
+        self._misses += 1
+        return False
+
+    def is_duplicate(self, room_id: Optional[int], command: dict) -> bool:
+        """
+        检查业务消息是否已经处理过，没处理过则记录下来
+
+        :param room_id: 房间ID，不同房间的消息分开去重
+        :param command: 业务消息
+        """
+        self._rotate_if_needed()
+        return self._check_and_add(room_id, command)
+
+    def filter(self, room_id: Optional[int], commands: List[dict], keep_unkeyed: bool = True) -> List[dict]:
+        """
+        去掉一批业务消息里已经处理过的
+
+        :param room_id: 房间ID，不同房间的消息分开去重
+        :param commands: 业务消息
+        :param keep_unkeyed: 是否保留没有唯一标识的消息，否则全部丢弃
+        :return: 没处理过的业务消息，没有重复时返回原来的列表
+        """
+        self._rotate_if_needed()
+        res = [command for command in commands if not self._check_and_add(room_id, command, keep_unkeyed)]
+        return commands if len(res) == len(commands) else res
@@ -0,0 +1,304 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import collections
+import enum
+import itertools
+import logging
+from typing import *
+
+from .clients import ws_base
+
+__all__ = (
+    'OverflowPolicy',
+    'StreamEvent',
+    'EventStream',
+)
+
+logger = logging.getLogger('blivedm')
+
+DEFAULT_MAX_SIZE = 5000
+"""默认缓冲区大小"""
+
+
+class OverflowPolicy(enum.Enum):
+    """
+    缓冲区满时的策略
+    """
+
+    BLOCK = 'block'
+    """网络协程处理完当前WebSocket消息后等待消费者，不再读新的消息。缓冲区最多超出一个WebSocket消息的业务消息数"""
+    DROP_OLDEST = 'drop_oldest'
+    """丢弃最早的消息"""
+    DROP_NEWEST = 'drop_newest'
+    """丢弃新收到的消息"""
+    DROP_BY_PRIORITY = 'drop_by_priority'
+    """丢弃优先级最低的消息里最早的一条，新消息的优先级比缓冲区里的都低时丢弃新消息"""
+
+
+class StreamEvent(NamedTuple):
+    """
+    事件流里的一个事件
+    """
+
+    client: 'ws_base.WebSocketClientBase'
+    """收到消息的客户端"""
+    command: dict
+    """业务消息"""
+
+
+def _get_cmd(command: dict) -> str:
+    cmd = command.get('cmd', '')
+    pos = cmd.find(':')  # 2019-5-29 B站弹幕升级新增了参数
+    if pos != -1:
+        cmd = cmd[:pos]
+    return cmd
+
+
+class _RoomStats:
+    __slots__ = ('buffered', 'delivered', 'dropped')
+
+    def __init__(self):
+        self.buffered = 0
+        self.delivered = 0
+        self.dropped = 0
+
+
+class EventStream:
+    """
+    有界缓冲的业务消息异步迭代器，消费者可以按自己的速度拉取消息，不会阻塞网络协程处理消息
+
+    一般用客户端或者RoomPool的events()创建::
+
+        async with client.events() as stream:
+            async for event in stream:
+                print(event.client.room_id, event.command['cmd'])
+
+    :param maxsize: 缓冲区大小
+    :param policy: 缓冲区满时的策略
+    :param cmd_priorities: cmd -> 优先级，数字越大越重要，只在DROP_BY_PRIORITY时使用
+    :param default_priority: 不在cmd_priorities里的cmd的优先级
+    :param wanted_cmds: 要接收的cmd，None表示全部都要。客户端只反序列化消息处理器和事件流要的cmd
+    """
+
+    def __init__(
+        self,
+        maxsize: int = DEFAULT_MAX_SIZE,
+        policy: OverflowPolicy = OverflowPolicy.BLOCK,
+        *,
+        cmd_priorities: Optional[Dict[str, int]] = None,
+        default_priority: int = 0,
+        wanted_cmds: Optional[Iterable[str]] = None,
+    ):
+        if maxsize <= 0:
+            raise ValueError(f'maxsize must be positive, got {maxsize}')
+        self._maxsize = maxsize
+        self._policy = OverflowPolicy(policy)
+        self._cmd_priorities = dict(cmd_priorities) if cmd_priorities is not None else {}
+        self._default_priority = default_priority
+        self._wanted_cmds = frozenset(wanted_cmds) if wanted_cmds is not None else None
+
+        self._buffer: Deque[StreamEvent] = collections.deque()
+        """非DROP_BY_PRIORITY时的缓冲区"""
+        self._priority_buffers: Dict[int, Deque[Tuple[int, StreamEvent]]] = {}
+        """DROP_BY_PRIORITY时的缓冲区，优先级 -> [(序号, 事件), ...]，出队时取序号最小的，保持收到的顺序"""
+        self._seq = itertools.count()
+        self._size = 0
+
+        self._room_stats: Dict[Optional[int], _RoomStats] = {}
+        """room_id -> 统计"""
+        self._sources: List[Any] = []
+        """把消息推到这个事件流的客户端或者RoomPool，关闭时注销"""
+        self._closed = False
+        self._not_empty = asyncio.Event()
+        self._not_full = asyncio.Event()
+        self._not_full.set()
+
+    @property
+    def maxsize(self) -> int:
+        return self._maxsize
+
+    @property
+    def policy(self) -> OverflowPolicy:
+        return self._policy
+
+    @property
+    def wanted_cmds(self) -> Optional[FrozenSet[str]]:
+        """
+        要接收的cmd，None表示全部都要
+        """
+        return self._wanted_cmds
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def qsize(self) -> int:
+        """
+        缓冲区里的消息数
+        """
+        return self._size
+
+    def full(self) -> bool:
+        return self._size >= self._maxsize
+
+    @property
+    def stats(self) -> Dict[Optional[int], Dict[str, int]]:
+        """
+        每个房间的统计，room_id -> {'buffered': 缓冲区里的消息数, 'delivered': 已交给消费者的消息数, 'dropped': 丢弃的消息数}
+        """
+        return {
+            room_id: {'buffered': stats.buffered, 'delivered': stats.delivered, 'dropped': stats.dropped}
+            for room_id, stats in self._room_stats.items()
+        }
+
+    def add_source(self, source):
+        """
+        记录推送消息的来源，关闭时调用source._remove_event_stream(self)，一般不需要手动调用
+        """
+        self._sources.append(source)
+
+    def remove_source(self, source):
+        """
+        来源关闭时调用，所有来源都关闭后事件流也关闭，一般不需要手动调用
+        """
+        try:
+            self._sources.remove(source)
+        except ValueError:
+            return
+        if not self._sources:
+            self.close()
+
+    def put_commands(self, client: 'ws_base.WebSocketClientBase', commands: Iterable[dict]):
+        """
+        把一个WebSocket消息里的业务消息放进缓冲区，只能在事件循环线程调用
+
+        BLOCK策略时不会等待，调用者应该在之后调用wait_not_full
+        """
+        if self._closed:
+            return
+        stats = self._get_room_stats(client.room_id)
+        wanted_cmds = self._wanted_cmds
+        for command in commands:
+            # 客户端反序列化的cmd是所有事件流和消息处理器要的并集，这里只留自己要的
+            if wanted_cmds is not None and _get_cmd(command) not in wanted_cmds:
+                continue
+            event = StreamEvent(client, command)
+            if self._size < self._maxsize or self._policy == OverflowPolicy.BLOCK:
+                self._append(event, stats)
+            elif self._policy == OverflowPolicy.DROP_OLDEST:
+                self._drop(self._buffer.popleft())
+                self._append(event, stats)
+            elif self._policy == OverflowPolicy.DROP_NEWEST:
+                stats.dropped += 1
+            else:
+                self._put_by_priority(event, stats)
+
+        if self._size >= self._maxsize:
+            self._not_full.clear()
+
+    async def wait_not_full(self):
+        """
+        等待缓冲区有空位或者关闭
+        """
+        while self._size >= self._maxsize and not self._closed:
+            await self._not_full.wait()
+
+    def _get_room_stats(self, room_id: Optional[int]) -> _RoomStats:
+        stats = self._room_stats.get(room_id, None)
+        if stats is None:
+            stats = self._room_stats[room_id] = _RoomStats()
+        return stats
+
+    def _get_priority(self, event: StreamEvent) -> int:
+        return self._cmd_priorities.get(_get_cmd(event.command), self._default_priority)
+
+    def _append(self, event: StreamEvent, stats: _RoomStats):
+        if self._policy == OverflowPolicy.DROP_BY_PRIORITY:
+            priority = self._get_priority(event)
+            buffer = self._priority_buffers.get(priority, None)
+            if buffer is None:
+                buffer = self._priority_buffers[priority] = collections.deque()
+            buffer.append((next(self._seq), event))
+        else:
+            self._buffer.append(event)
+        self._size += 1
+        stats.buffered += 1
+        self._not_empty.set()
+
+    def _put_by_priority(self, event: StreamEvent, stats: _RoomStats):
+        lowest_priority = min(
+            priority for priority, buffer in self._priority_buffers.items() if buffer
+        )
+        if self._get_priority(event) < lowest_priority:
+            stats.dropped += 1
+            return
+        _, dropped_event = self._priority_buffers[lowest_priority].popleft()
+        self._drop(dropped_event)
+        self._append(event, stats)
+
+    def _drop(self, event: StreamEvent):
+        self._size -= 1
+        stats = self._get_room_stats(event.client.room_id)
+        stats.buffered -= 1
+        stats.dropped += 1
+
+    def get_nowait(self) -> StreamEvent:
+        """
+        :raise asyncio.QueueEmpty: 缓冲区为空
+        """
+        if self._size == 0:
+            raise asyncio.QueueEmpty
+        if self._policy == OverflowPolicy.DROP_BY_PRIORITY:
+            buffer = min(
+                (buffer for buffer in self._priority_buffers.values() if buffer),
+                key=lambda b: b[0][0]
+            )
+            _, event = buffer.popleft()
+        else:
+            event = self._buffer.popleft()
+
+        self._size -= 1
+        stats = self._get_room_stats(event.client.room_id)
+        stats.buffered -= 1
+        stats.delivered += 1
+        if self._size == 0:
+            self._not_empty.clear()
+        if self._size < self._maxsize:
+            self._not_full.set()
+        return event
+
+    async def get(self) -> StreamEvent:
+        """
+        :raise StopAsyncIteration: 已关闭并且缓冲区为空
+        """
+        while self._size == 0:
+            if self._closed:
+                raise StopAsyncIteration
+            await self._not_empty.wait()
+        return self.get_nowait()
+
+    def close(self):
+        """
+        停止接收消息，缓冲区里剩下的消息还可以取出来
+        """
+        if self._closed:
+            return
+        self._closed = True
+        sources, self._sources = self._sources, []
+        for source in sources:
+            source._remove_event_stream(self)  # noqa
+        # 唤醒等待的消费者和网络协程
+        self._not_empty.set()
+        self._not_full.set()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> StreamEvent:
+        return await self.get()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.close()
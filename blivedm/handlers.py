@@ -48,16 +48,50 @@ class HandlerInterface:
     def handle(self, client: ws_base.WebSocketClientBase, command: dict):
         raise NotImplementedError
 
+    def handle_batch(self, client: ws_base.WebSocketClientBase, commands: List[dict]):
+        """
+        可选实现，一次处理一个WebSocket消息里的所有业务消息，commands按收到的顺序排列
+
+        没有重写这个函数时客户端会对每条消息调用handle
+        """
+        raise NotImplementedError
+
+    def get_wanted_cmds(self) -> Optional[AbstractSet[str]]:
+        """
+        返回需要处理的cmd集合，客户端会在反序列化之前丢弃其他cmd的消息，None表示全部都要
+
+        客户端在set_handler时调用这个函数，如果返回值变了需要重新set_handler
+        """
+        return None
+
+    def get_message_types(self) -> Optional[Mapping[str, Tuple[Callable[[Any], Any], str]]]:
+        """
+        返回解码进程可以预先构造的消息类型，cmd -> (有from_command的消息类, 数据在command中的键)，None表示不构造
+
+        只在客户端设置了build_models的解码进程池时使用，构造好的消息用client.get_parsed_message(command)取。
+        客户端在set_handler时调用这个函数，如果返回值变了需要重新set_handler
+        """
+        return None
+
     def on_client_stopped(self, client: ws_base.WebSocketClientBase, exception: Optional[Exception]):
         """
         当客户端停止时调用。可以在这里close或者重新start
         """
 
 
-def _make_msg_callback(method_name, message_cls):
+def _make_msg_callback(method_name, message_cls, data_key='data'):
     def callback(self: 'BaseHandler', client: ws_base.WebSocketClientBase, command: dict):
         method = getattr(self, method_name)
-        return method(client, message_cls.from_command(command['data']))
+        # 不是WebSocketClientBase的客户端（例如测试用的替身）没有这个方法
+        get_parsed_message = getattr(client, 'get_parsed_message', None)
+        message = None if get_parsed_message is None else get_parsed_message(command)
+        if message is None:
+            message = message_cls.from_command(command[data_key])
+        return method(client, message)
+    # 用来判断子类有没有重写处理消息的方法、在解码进程构造消息
+    callback.method_name = method_name
+    callback.message_cls = message_cls
+    callback.data_key = data_key
     return callback
 
 
@@ -66,9 +100,6 @@ class BaseHandler(HandlerInterface):
     一个简单的消息处理器实现，带消息分发和消息类型转换。继承并重写_on_xxx方法即可实现自己的处理器
     """
 
-    def __danmu_msg_callback(self, client: ws_base.WebSocketClientBase, command: dict):
-        return self._on_danmaku(client, web_models.DanmakuMessage.from_command(command['info']))
-
     _CMD_CALLBACK_DICT: Dict[
         str,
         Optional[Callable[
@@ -80,7 +111,7 @@ class BaseHandler(HandlerInterface):
         '_HEARTBEAT': _make_msg_callback('_on_heartbeat', web_models.HeartbeatMessage),
         # 收到弹幕
         # go-common\app\service\live\live-dm\service\v1\send.go
-        'DANMU_MSG': __danmu_msg_callback,
+        'DANMU_MSG': _make_msg_callback('_on_danmaku', web_models.DanmakuMessage, 'info'),
         # 有人送礼
         'SEND_GIFT': _make_msg_callback('_on_gift', web_models.GiftMessage),
         # 有人上舰
@@ -117,6 +148,36 @@ class BaseHandler(HandlerInterface):
     }
     """cmd -> 处理回调"""
 
+    def get_wanted_cmds(self) -> Optional[AbstractSet[str]]:
+        """
+        默认只要_CMD_CALLBACK_DICT中子类重写了_on_xxx方法的cmd，如果子类重写了handle或者handle_batch则全部都要
+        """
+        cls = type(self)
+        if cls.handle is not BaseHandler.handle or cls.handle_batch is not BaseHandler.handle_batch:
+            return None
+
+        wanted_cmds = set()
+        for cmd, callback in self._CMD_CALLBACK_DICT.items():
+            if callback is None:
+                continue
+            method_name = getattr(callback, 'method_name', None)
+            if method_name is None or getattr(cls, method_name, None) is not getattr(BaseHandler, method_name, None):
+                # 不知道回调会调用什么方法，保守处理
+                wanted_cmds.add(cmd)
+        return wanted_cmds
+
+    def get_message_types(self) -> Optional[Mapping[str, Tuple[Callable[[Any], Any], str]]]:
+        """
+        _CMD_CALLBACK_DICT中需要处理的cmd的消息类
+        """
+        wanted_cmds = self.get_wanted_cmds()
+        message_types = {}
+        for cmd, callback in self._CMD_CALLBACK_DICT.items():
+            message_cls = getattr(callback, 'message_cls', None)
+            if message_cls is not None and (wanted_cmds is None or cmd in wanted_cmds):
+                message_types[cmd] = (message_cls, callback.data_key)
+        return message_types
+
     def handle(self, client: ws_base.WebSocketClientBase, command: dict):
         cmd = command.get('cmd', '')
         pos = cmd.find(':')  # 2019-5-29 B站弹幕升级新增了参数
@@ -134,6 +195,17 @@ class BaseHandler(HandlerInterface):
         if callback is not None:
             callback(self, client, command)
 
+    def handle_batch(self, client: ws_base.WebSocketClientBase, commands: List[dict]):
+        """
+        逐条分发到_on_xxx方法，一条消息处理失败不影响后面的消息
+        """
+        handle = self.handle
+        for command in commands:
+            try:
+                handle(client, command)
+            except Exception:  # noqa
+                logger.exception('room=%d handle_batch() failed, command=%s', client.room_id, command)
+
     def _on_heartbeat(self, client: ws_base.WebSocketClientBase, message: web_models.HeartbeatMessage):
         """
         收到心跳包
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import logging
+import weakref
+from typing import *
+
+__all__ = (
+    'HeartbeatEntry',
+    'HeartbeatScheduler',
+    'get_heartbeat_scheduler',
+)
+
+logger = logging.getLogger('blivedm')
+
+HeartbeatCallback = Callable[[], Awaitable[Any]]
+
+DEFAULT_TICK = 0.5
+"""时间轮每格的默认时间（秒）"""
+
+
+class HeartbeatEntry:
+    """
+    注册到心跳调度器的一个心跳
+    """
+
+    def __init__(self, callback: HeartbeatCallback, slot: int):
+        self.callback = callback
+        """发送心跳的协程函数"""
+        self.slot = slot
+        """在时间轮的第几格"""
+        self.last_lateness: Optional[float] = None
+        """上次发送心跳比预定时间晚了多少秒"""
+        self.registered = True
+
+
+class HeartbeatScheduler:
+    """
+    用时间轮实现的心跳调度器，同一个事件循环里所有心跳间隔相同的客户端共享一个
+
+    每次tick只有一个定时器和一个协程，客户端注册时放到心跳最少的格子，避免所有客户端同时发心跳
+
+    :param interval: 心跳间隔（秒）
+    :param tick: 时间轮每格的时间（秒），不会超过心跳间隔
+    """
+
+    def __init__(self, interval: float, tick: float = DEFAULT_TICK):
+        self._interval = interval
+        self._num_slots = max(1, round(interval / tick))
+        self._tick = interval / self._num_slots
+        self._slots: List[Dict[int, HeartbeatEntry]] = [{} for _ in range(self._num_slots)]
+        """每格的心跳，id(entry) -> entry，dict可以O(1)删除并且保持注册顺序"""
+        self._size = 0
+        self._current_slot = 0
+        """下次tick要处理的格子"""
+        self._next_tick_time: Optional[float] = None
+        """下次tick预定的事件循环时间"""
+        self._timer_handle: Optional[asyncio.TimerHandle] = None
+
+        # 统计
+        self._sent_count = 0
+        self._lateness_sum = 0.0
+        self._max_lateness = 0.0
+
+    @property
+    def interval(self) -> float:
+        """
+        心跳间隔（秒）
+        """
+        return self._interval
+
+    @property
+    def stats(self) -> dict:
+        """
+        统计信息的快照，lateness是心跳实际发送时间比预定时间晚了多少秒
+        """
+        return {
+            'interval': self._interval,
+            'tick': self._tick,
+            'registered': self._size,
+            'sent': self._sent_count,
+            'avg_lateness': self._lateness_sum / self._sent_count if self._sent_count else 0.0,
+            'max_lateness': self._max_lateness,
+        }
+
+    def register(self, callback: HeartbeatCallback) -> HeartbeatEntry:
+        """
+        注册一个心跳，第一次心跳在一个心跳间隔内
+
+        :param callback: 发送心跳的协程函数
+        :return: 用来注销的HeartbeatEntry
+        """
+        slot = min(range(self._num_slots), key=lambda i: len(self._slots[i]))
+        entry = HeartbeatEntry(callback, slot)
+        self._slots[slot][id(entry)] = entry
+        self._size += 1
+
+        if self._timer_handle is None:
+            loop = asyncio.get_running_loop()
+            self._next_tick_time = loop.time() + self._tick
+            self._timer_handle = loop.call_at(self._next_tick_time, self._on_tick)
+        return entry
+
+    def unregister(self, entry: HeartbeatEntry):
+        """
+        注销一个心跳，重复注销没有影响
+        """
+        if not entry.registered:
+            return
+        entry.registered = False
+        del self._slots[entry.slot][id(entry)]
+        self._size -= 1
+
+        if self._size == 0 and self._timer_handle is not None:
+            self._timer_handle.cancel()
+            self._timer_handle = None
+
+    def _on_tick(self):
+        loop = asyncio.get_running_loop()
+        lateness = max(loop.time() - self._next_tick_time, 0.0)
+
+        # 按预定时间累加，不会因为回调延迟而漂移
+        self._next_tick_time += self._tick
+        self._timer_handle = loop.call_at(self._next_tick_time, self._on_tick)
+
+        slot = self._slots[self._current_slot]
+        self._current_slot = (self._current_slot + 1) % self._num_slots
+        if not slot:
+            return
+
+        entries = list(slot.values())
+        for entry in entries:
+            entry.last_lateness = lateness
+        self._sent_count += len(entries)
+        self._lateness_sum += lateness * len(entries)
+        self._max_lateness = max(self._max_lateness, lateness)
+        asyncio.create_task(self._run_entries(entries))
+
+    @staticmethod
+    async def _run_entries(entries: List[HeartbeatEntry]):
+        results = await asyncio.gather(*(entry.callback() for entry in entries), return_exceptions=True)
+        for res in results:
+            if isinstance(res, Exception):
+                logger.error('heartbeat callback failed:', exc_info=res)
+
+
+_schedulers: 'weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[float, HeartbeatScheduler]]' = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def get_heartbeat_scheduler(interval: float) -> HeartbeatScheduler:
+    """
+    获取当前事件循环里指定心跳间隔的共享调度器
+
+    :param interval: 心跳间隔（秒）
+    """
+    loop = asyncio.get_running_loop()
+    schedulers = _schedulers.get(loop, None)
+    if schedulers is None:
+        schedulers = _schedulers[loop] = {}
+    scheduler = schedulers.get(interval, None)
+    if scheduler is None:
+        scheduler = schedulers[interval] = HeartbeatScheduler(interval)
+    return scheduler
@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import logging
+import math
+import time
+from typing import *
+
+import yarl
+
+__all__ = (
+    'HostSelector',
+)
+
+logger = logging.getLogger('blivedm')
+
+
+class _HostStats:
+    __slots__ = ('connect_time', 'auth_latency', 'probe_time', 'failure_score', 'failure_time', 'connects', 'failures')
+
+    def __init__(self):
+        self.connect_time: Optional[float] = None
+        """建立WebSocket连接耗时的EWMA（秒）"""
+        self.auth_latency: Optional[float] = None
+        """发送认证包到收到认证响应耗时的EWMA（秒）"""
+        self.probe_time: Optional[float] = None
+        """探测时TCP连接耗时的EWMA（秒），不包括TLS和WebSocket握手，所以和connect_time分开统计"""
+        self.failure_score = 0.0
+        """衰减后的失败次数，是failure_time时的值"""
+        self.failure_time = 0.0
+        """上次更新failure_score的time.monotonic()"""
+        self.connects = 0
+        self.failures = 0
+
+
+class HostSelector:
+    """
+    按延迟选择弹幕服务器。记录每个服务器的连接耗时、认证延迟的EWMA和随时间衰减的失败分数，
+    优先选择分数最低的服务器，重连时选上次失败的服务器以外分数最低的
+
+    可以被多个客户端共享，用客户端的set_host_selector设置，同一个机房连接同一个服务器的延迟差不多，共享后新的客户端直接用已有的统计
+
+    :param alpha: EWMA的平滑系数，越大越重视最近的值
+    :param failure_penalty: 每次失败相当于增加多少秒延迟
+    :param failure_half_life: 失败分数的半衰期（秒）
+    :param probe: 是否在第一次连接前对分数最低的几个服务器同时发起TCP连接（Happy Eyeballs），连接最先成功的服务器。
+        重连时不探测，选上次失败的服务器以外分数最低的，否则TCP能连上但是WebSocket握手或认证失败的服务器每次都会被选中
+    :param probe_candidates: 探测多少个服务器
+    :param probe_stagger: 每隔多少秒开始探测下一个服务器
+    :param probe_timeout: 探测的超时时间（秒）
+    """
+
+    def __init__(
+        self,
+        alpha: float = 0.3,
+        failure_penalty: float = 2.0,
+        failure_half_life: float = 300.0,
+        *,
+        probe: bool = False,
+        probe_candidates: int = 3,
+        probe_stagger: float = 0.25,
+        probe_timeout: float = 5.0,
+    ):
+        if not 0 < alpha <= 1:
+            raise ValueError(f'alpha must be in (0, 1], got {alpha}')
+        self._alpha = alpha
+        self._failure_penalty = failure_penalty
+        self._failure_decay_rate = math.log(2) / failure_half_life
+        self._probe = probe
+        self._probe_candidates = probe_candidates
+        self._probe_stagger = probe_stagger
+        self._probe_timeout = probe_timeout
+
+        self._stats: Dict[str, _HostStats] = {}
+        """URL -> 统计"""
+
+    @property
+    def probe_enabled(self) -> bool:
+        return self._probe
+
+    @property
+    def stats(self) -> Dict[str, dict]:
+        """
+        URL -> 统计信息的快照
+        """
+        return {
+            url: {
+                'connect_time': stats.connect_time,
+                'auth_latency': stats.auth_latency,
+                'probe_time': stats.probe_time,
+                'failure_score': self._get_failure_score(stats),
+                'connects': stats.connects,
+                'failures': stats.failures,
+                'score': self._get_score(stats),
+            }
+            for url, stats in self._stats.items()
+        }
+
+    def _get_stats(self, url: str) -> _HostStats:
+        stats = self._stats.get(url, None)
+        if stats is None:
+            stats = self._stats[url] = _HostStats()
+        return stats
+
+    def _update_ewma(self, old: Optional[float], value: float) -> float:
+        if old is None:
+            return value
+        return old + self._alpha * (value - old)
+
+    def record_connect(self, url: str, seconds: float):
+        """
+        记录一次成功建立连接的耗时
+        """
+        stats = self._get_stats(url)
+        stats.connect_time = self._update_ewma(stats.connect_time, seconds)
+        stats.connects += 1
+
+    def record_auth(self, url: str, seconds: float):
+        """
+        记录一次认证成功的延迟
+        """
+        stats = self._get_stats(url)
+        stats.auth_latency = self._update_ewma(stats.auth_latency, seconds)
+
+    def record_probe(self, url: str, seconds: float):
+        """
+        记录一次探测成功的TCP连接耗时
+        """
+        stats = self._get_stats(url)
+        stats.probe_time = self._update_ewma(stats.probe_time, seconds)
+
+    def record_failure(self, url: str):
+        """
+        记录一次连接失败
+        """
+        stats = self._get_stats(url)
+        now = time.monotonic()
+        stats.failure_score = self._get_failure_score(stats, now) + 1
+        stats.failure_time = now
+        stats.failures += 1
+
+    def _get_failure_score(self, stats: _HostStats, now: Optional[float] = None) -> float:
+        if stats.failure_score == 0:
+            return 0.0
+        if now is None:
+            now = time.monotonic()
+        return stats.failure_score * math.exp(-self._failure_decay_rate * (now - stats.failure_time))
+
+    def _get_score(self, stats: _HostStats) -> Optional[float]:
+        """
+        :return: 估算的延迟加上失败惩罚，越低越好，没有成功连接过则为None
+        """
+        if stats.connect_time is None:
+            if stats.failure_score == 0:
+                return None
+            latency = 0.0
+        else:
+            latency = stats.connect_time + (stats.auth_latency or 0.0)
+        return latency + self._failure_penalty * self._get_failure_score(stats)
+
+    def rank(self, urls: Sequence[str]) -> List[str]:
+        """
+        按分数从低到高排序，分数相同时保持原来的顺序
+
+        没有统计的服务器排在最前面，这样每个服务器至少会被尝试一次，之后才按实际延迟排序
+        """
+        scores = []
+        for url in urls:
+            stats = self._stats.get(url, None)
+            score = None if stats is None else self._get_score(stats)
+            scores.append(0.0 if score is None else score)
+        order = sorted(range(len(urls)), key=lambda i: (scores[i], i))
+        return [urls[i] for i in order]
+
+    def select(self, urls: Sequence[str], offset: int = 0, exclude: Optional[str] = None) -> str:
+        """
+        选择要连接的服务器，也就是分数最低的。重连时排除上次失败的服务器，它的失败分数增加后可能还是最低的
+
+        :param urls: 候选的服务器URL
+        :param offset: 在排序后的列表里往后偏移多少个，同一个房间的多个连接用不同的偏移连接不同的服务器
+        :param exclude: 不选这个服务器，除非只有它一个候选
+        """
+        ranked = self.rank(urls)
+        if exclude is not None and len(ranked) > 1:
+            try:
+                ranked.remove(exclude)
+            except ValueError:
+                pass
+        return ranked[offset % len(ranked)]
+
+    async def probe(self, urls: Sequence[str]) -> Optional[str]:
+        """
+        对分数最低的几个服务器错开时间发起TCP连接，返回最先连接成功的，同时更新它们的统计
+
+        :param urls: 候选的服务器URL
+        :return: 最先连接成功的URL，都失败了则为None
+        """
+        candidates = self.rank(urls)[:self._probe_candidates]
+        pending: Set[asyncio.Task] = set()
+        next_index = 0
+        try:
+            while True:
+                if next_index < len(candidates):
+                    pending.add(asyncio.create_task(self._probe_one(candidates[next_index])))
+                    next_index += 1
+                if not pending:
+                    return None
+                done, pending = await asyncio.wait(
+                    pending,
+                    timeout=self._probe_stagger if next_index < len(candidates) else None,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                for task in done:
+                    url = task.result()
+                    if url is not None:
+                        return url
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _probe_one(self, url: str) -> Optional[str]:
+        parsed_url = yarl.URL(url)
+        start_time = time.perf_counter()
+        try:
+            transport, _protocol = await asyncio.wait_for(
+                asyncio.get_running_loop().create_connection(asyncio.Protocol, parsed_url.host, parsed_url.port),
+                self._probe_timeout,
+            )
+        except (OSError, asyncio.TimeoutError):
+            self.record_failure(url)
+            return None
+        transport.close()
+        self.record_probe(url, time.perf_counter() - start_time)
+        return url
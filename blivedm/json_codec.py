@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+import json
+import logging
+from typing import *
+
+__all__ = (
+    'JsonCodec',
+    'StdlibJsonCodec',
+    'OrjsonCodec',
+    'MsgspecCodec',
+    'UjsonCodec',
+    'get_codec',
+    'get_available_codec_names',
+    'get_default_codec',
+    'set_default_codec',
+)
+
+logger = logging.getLogger('blivedm')
+
+JsonInput = Union[bytes, bytearray, memoryview, str]
+
+
+class JsonCodec:
+    """
+    JSON编解码器接口
+
+    全局默认的是标准库json，第三方库更快但是边界情况的行为不完全一样（例如orjson会把超过64位的整数解析成float），
+    要用时调用set_default_codec或者客户端的set_json_codec主动开启
+    """
+
+    name = ''
+    """编解码器名字"""
+
+    def loads(self, data: JsonInput) -> Any:
+        """
+        反序列化，bytes-like对象必须是UTF-8编码
+        """
+        raise NotImplementedError
+
+    def dumps(self, obj: Any) -> bytes:
+        """
+        序列化成UTF-8编码的bytes
+        """
+        raise NotImplementedError
+
+
+class StdlibJsonCodec(JsonCodec):
+    """
+    标准库json
+    """
+
+    name = 'json'
+
+    def loads(self, data: JsonInput) -> Any:
+        if not isinstance(data, str):
+            # 标准库不支持memoryview，直接解码成str，不复制出中间的bytes
+            data = str(data, 'utf-8')
+        return json.loads(data)
+
+    def dumps(self, obj: Any) -> bytes:
+        return json.dumps(obj).encode('utf-8')
+
+
+class OrjsonCodec(JsonCodec):
+    """
+    orjson，直接支持bytes、memoryview
+
+    注意超过64位的整数会被解析成float，B站的ID目前都在64位以内
+    """
+
+    name = 'orjson'
+
+    def __init__(self):
+        import orjson
+        self._loads = orjson.loads
+        self._dumps = orjson.dumps
+        self._decode_error = orjson.JSONDecodeError
+
+    def loads(self, data: JsonInput) -> Any:
+        try:
+            return self._loads(data)
+        except self._decode_error:
+            # orjson不支持NaN、Infinity等，这时用标准库重试
+            return _stdlib_codec.loads(data)
+
+    def dumps(self, obj: Any) -> bytes:
+        return self._dumps(obj)
+
+
+class MsgspecCodec(JsonCodec):
+    """
+    msgspec，直接支持bytes、memoryview
+    """
+
+    name = 'msgspec'
+
+    def __init__(self):
+        import msgspec
+        self._decode = msgspec.json.Decoder().decode
+        self._encode = msgspec.json.Encoder().encode
+        self._decode_error = msgspec.DecodeError
+
+    def loads(self, data: JsonInput) -> Any:
+        try:
+            return self._decode(data)
+        except self._decode_error:
+            # msgspec不支持NaN等，这时用标准库重试
+            return _stdlib_codec.loads(data)
+
+    def dumps(self, obj: Any) -> bytes:
+        return self._encode(obj)
+
+
+class UjsonCodec(JsonCodec):
+    """
+    ujson，不支持memoryview
+    """
+
+    name = 'ujson'
+
+    def __init__(self):
+        import ujson
+        self._loads = ujson.loads
+        self._dumps = ujson.dumps
+
+    def loads(self, data: JsonInput) -> Any:
+        if isinstance(data, memoryview):
+            data = str(data, 'utf-8')
+        return self._loads(data)
+
+    def dumps(self, obj: Any) -> bytes:
+        return self._dumps(obj, ensure_ascii=False).encode('utf-8')
+
+
+_CODEC_CLASSES: Dict[str, Type[JsonCodec]] = {
+    cls.name: cls
+    for cls in (OrjsonCodec, MsgspecCodec, UjsonCodec, StdlibJsonCodec)
+}
+"""编解码器名字 -> 类，按优先级排序"""
+
+_stdlib_codec = StdlibJsonCodec()
+_codec_cache: Dict[str, JsonCodec] = {StdlibJsonCodec.name: _stdlib_codec}
+_default_codec: Optional[JsonCodec] = None
+
+
+def get_codec(name: str) -> JsonCodec:
+    """
+    按名字获取编解码器
+
+    :param name: 'orjson'、'msgspec'、'ujson'、'json'
+    :raise ValueError: 未知的名字
+    :raise ImportError: 没有安装对应的库
+    """
+    codec = _codec_cache.get(name, None)
+    if codec is not None:
+        return codec
+    try:
+        cls = _CODEC_CLASSES[name]
+    except KeyError:
+        raise ValueError(f'unknown JSON codec {name!r}, available: {list(_CODEC_CLASSES)}') from None
+    codec = _codec_cache[name] = cls()
+    return codec
+
+
+def get_available_codec_names() -> List[str]:
+    """
+    返回已安装的编解码器名字，按优先级排序
+    """
+    names = []
+    for name in _CODEC_CLASSES:
+        try:
+            get_codec(name)
+        except ImportError:
+            continue
+        names.append(name)
+    return names
+
+
+def get_default_codec() -> JsonCodec:
+    """
+    获取全局默认的编解码器，没有设置过则用标准库json
+    """
+    if _default_codec is None:
+        return _stdlib_codec
+    return _default_codec
+
+
+def set_default_codec(codec: Union[JsonCodec, str, None]):
+    """
+    设置全局默认的编解码器，例如用已安装的最快的一个：set_default_codec(get_available_codec_names()[0])
+
+    :param codec: 编解码器或者名字，None表示用标准库json
+    """
+    global _default_codec
+    if isinstance(codec, str):
+        codec = get_codec(codec)
+    _default_codec = codec
+    if codec is not None:
+        logger.debug('using JSON codec %s', codec.name)
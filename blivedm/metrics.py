@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+import collections
+import time
+from typing import *
+
+from .clients import ws_base
+
+__all__ = (
+    'Histogram',
+    'ClientMetrics',
+)
+
+_SUB_BUCKET_BITS = 5
+_SUB_BUCKET_COUNT = 1 << _SUB_BUCKET_BITS
+"""每个2的幂区间分成多少个桶，相对误差不超过1/32"""
+
+DEFAULT_PERCENTILES = (50.0, 90.0, 99.0, 99.9)
+
+
+def _get_bucket_index(value: int) -> int:
+    if value < 2 * _SUB_BUCKET_COUNT:
+        return value
+    shift = value.bit_length() - _SUB_BUCKET_BITS - 1
+    return shift * _SUB_BUCKET_COUNT + (value >> shift)
+
+
+def _get_bucket_range(index: int) -> Tuple[int, int]:
+    """
+    :return: 桶的取值范围[low, high)
+    """
+    if index < 2 * _SUB_BUCKET_COUNT:
+        return index, index + 1
+    shift = index // _SUB_BUCKET_COUNT - 1
+    low = (index - shift * _SUB_BUCKET_COUNT) << shift
+    return low, low + (1 << shift)
+
+
+class Histogram:
+    """
+    HDR风格的对数线性直方图，记录非负整数（例如纳秒），O(1)记录，内存只和最大值的位数有关
+
+    每个2的幂区间分成32个等宽的桶，所以百分位数的相对误差不超过约3%
+    """
+
+    __slots__ = ('_counts', '_count', '_sum', '_min', '_max')
+
+    def __init__(self):
+        self._counts: List[int] = []
+        self._count = 0
+        self._sum = 0
+        self._min = 0
+        self._max = 0
+
+    @property
+    def count(self) -> int:
+        return self._count
+
+    def record(self, value: int):
+        """
+        记录一个值，负数当成0
+        """
+        # 热路径，手动内联_get_bucket_index
+        if value < 2 * _SUB_BUCKET_COUNT:
+            if value < 0:
+                value = 0
+            index = value
+        else:
+            shift = value.bit_length() - _SUB_BUCKET_BITS - 1
+            index = shift * _SUB_BUCKET_COUNT + (value >> shift)
+        try:
+            self._counts[index] += 1
+        except IndexError:
+            self._counts.extend([0] * (index + 1 - len(self._counts)))
+            self._counts[index] += 1
+
+        if value > self._max:
+            self._max = value
+        if value < self._min or self._count == 0:
+            self._min = value
+        self._count += 1
+        self._sum += value
+
+    def merge(self, other: 'Histogram'):
+        """
+        把另一个直方图的数据加到这个直方图
+        """
+        if other._count == 0:
+            return
+        if len(other._counts) > len(self._counts):
+            self._counts.extend([0] * (len(other._counts) - len(self._counts)))
+        for index, count in enumerate(other._counts):
+            self._counts[index] += count
+        if self._count == 0 or other._min < self._min:
+            self._min = other._min
+        self._max = max(self._max, other._max)
+        self._count += other._count
+        self._sum += other._sum
+
+    def reset(self):
+        self._counts.clear()
+        self._count = 0
+        self._sum = 0
+        self._min = 0
+        self._max = 0
+
+    def get_percentile(self, percentile: float) -> int:
+        """
+        :param percentile: 0~100
+        :return: 估算的百分位数，是所在桶的中点
+        """
+        if self._count == 0:
+            return 0
+        target = max(1, round(self._count * percentile / 100))
+        cumulative = 0
+        for index, count in enumerate(self._counts):
+            cumulative += count
+            if cumulative >= target:
+                low, high = _get_bucket_range(index)
+                return min(max((low + high - 1) // 2, self._min), self._max)
+        return self._max
+
+    def snapshot(self, scale: float = 1.0, percentiles: Iterable[float] = DEFAULT_PERCENTILES) -> Dict[str, float]:
+        """
+        :param scale: 输出的值乘以这个系数，例如纳秒转秒用1e-9
+        :param percentiles: 要输出的百分位数
+        :return: {'count', 'min', 'max', 'mean', 'p50', ...}
+        """
+        res = {
+            'count': self._count,
+            'min': self._min * scale,
+            'max': self._max * scale,
+            'mean': self._sum / self._count * scale if self._count else 0.0,
+        }
+        for percentile in percentiles:
+            res[f'p{percentile:g}'] = self.get_percentile(percentile) * scale
+        return res
+
+
+class ClientMetrics:
+    """
+    客户端热路径上的统计，时间用纳秒记录到直方图，快照里转成秒
+
+    可以被多个客户端共享，得到它们的总和。使用解码进程池时，分包、解压、反序列化在子进程，只统计WebSocket消息和消息处理器
+
+    计时的开销和反序列化一条消息差不多大，所以耗时是按WebSocket消息抽样的，计数是每次都统计的。
+    未压缩的业务消息数按WebSocket消息累加，不在每个包上计数
+
+    客户端默认不统计，要用set_metrics开启。开启后在单核虚拟机上测得完整解析流程每条消息慢约7%
+    （benchmarks.micro的pipeline.parse_ws_message_all_cmds_timing_1_in_16），
+    不开启时热路径上每条消息只多一次None判断，约40ns，不到完整解析流程的1%
+
+    :param timing_sample_interval: 每多少个WebSocket消息记录一次解压、反序列化、消息处理器的耗时，必须是2的幂
+    """
+
+    def __init__(self, timing_sample_interval: int = 16):
+        if timing_sample_interval <= 0 or timing_sample_interval & (timing_sample_interval - 1):
+            raise ValueError(f'timing_sample_interval must be a power of 2, got {timing_sample_interval}')
+        self._timing_sample_mask = timing_sample_interval - 1
+        self.timing_sampled = False
+        """当前WebSocket消息是否记录耗时"""
+
+        self.frames = 0
+        """收到的WebSocket消息数"""
+        self.frame_bytes = 0
+        """收到的WebSocket消息字节数"""
+        self.compressed_bytes = 0
+        """压缩的包体字节数"""
+        self.decompressed_bytes = 0
+        """解压后的字节数"""
+        self.decoded_messages = 0
+        """反序列化的业务消息数"""
+        self.skipped_messages = 0
+        """没有反序列化就丢弃的业务消息数"""
+        self.packets: Counter[Tuple[int, int]] = collections.Counter()
+        """(operation, ver) -> 包数，包括解压后的包，不包括反序列化和丢弃的未压缩业务消息"""
+        self.decompress_time = Histogram()
+        """每个压缩包的解压耗时，包括在线程池排队的时间，抽样记录"""
+        self.json_decode_time = Histogram()
+        """每条业务消息的反序列化耗时，抽样记录"""
+        self.handler_time = Histogram()
+        """每个WebSocket消息的所有业务消息的处理耗时，抽样记录"""
+        self.connect_count = 0
+        """连接成功的次数"""
+        self.reconnect_count = 0
+        """断线后重连成功的次数"""
+        self.reconnect_duration = Histogram()
+        """断线到重连成功的时间"""
+
+        self._created_time = time.monotonic()
+        self._disconnected_time_ns: Optional[int] = None
+        """上次断线的时间，正在连接时为None"""
+
+    def on_frame(self, size: int):
+        """
+        收到WebSocket消息时调用
+        """
+        self.frames += 1
+        self.frame_bytes += size
+        self.timing_sampled = not (self.frames & self._timing_sample_mask)
+
+    def on_connected(self):
+        """
+        WebSocket连接成功时调用
+        """
+        self.connect_count += 1
+        if self._disconnected_time_ns is not None:
+            self.reconnect_count += 1
+            self.reconnect_duration.record(time.perf_counter_ns() - self._disconnected_time_ns)
+            self._disconnected_time_ns = None
+
+    def on_disconnected(self):
+        """
+        WebSocket断线时调用，连接失败时不调用，这样重连时间包括所有失败的尝试
+        """
+        self._disconnected_time_ns = time.perf_counter_ns()
+
+    def reset(self):
+        """
+        清空统计
+        """
+        self.__init__(self._timing_sample_mask + 1)
+
+    def snapshot(self) -> dict:
+        """
+        统计信息的快照，时间单位是秒
+        """
+        packet_counts = self.packets.copy()
+        packet_counts[(ws_base.Operation.SEND_MSG_REPLY, ws_base.ProtoVer.NORMAL)] += (
+            self.decoded_messages + self.skipped_messages
+        )
+        packets = {}
+        for (operation, ver), count in packet_counts.items():
+            try:
+                operation_name = ws_base.Operation(operation).name
+            except ValueError:
+                operation_name = str(operation)
+            try:
+                ver_name = ws_base.ProtoVer(ver).name
+            except ValueError:
+                ver_name = str(ver)
+            packets[f'{operation_name}/{ver_name}'] = count
+
+        return {
+            'uptime': time.monotonic() - self._created_time,
+            'frames': self.frames,
+            'frame_bytes': self.frame_bytes,
+            'compressed_bytes': self.compressed_bytes,
+            'decompressed_bytes': self.decompressed_bytes,
+            'decoded_messages': self.decoded_messages,
+            'skipped_messages': self.skipped_messages,
+            'packets': packets,
+            'decompress_time': self.decompress_time.snapshot(1e-9),
+            'json_decode_time': self.json_decode_time.snapshot(1e-9),
+            'handler_time': self.handler_time.snapshot(1e-9),
+            'connect_count': self.connect_count,
+            'reconnect_count': self.reconnect_count,
+            'reconnect_duration': self.reconnect_duration.snapshot(1e-9),
+        }
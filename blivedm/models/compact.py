@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+用__slots__的消息模型，字段名、from_command和普通的模型相同，但是实例没有__dict__，大量缓存消息时省内存
+
+web、open_live里是可以修改的版本，frozen_web、frozen_open_live里是不可修改的版本，例如：
+
+    message = compact.web.DanmakuMessage.from_command(command['info'])
+
+嵌套的模型（例如开放平台GiftMessage.anchor_info）也会用同一个命名空间里的版本。
+不可修改的版本构造时每个字段都要调用object.__setattr__，from_command会慢一倍多，只在需要防止误改时使用。
+只有所有字段都是可哈希类型的不可修改版本才可以哈希，有dict、list字段的（例如frozen_web.DanmakuMessage）调用hash会抛TypeError
+"""
+import dataclasses
+import types
+from typing import *
+
+from . import open_live as open_live_models, web as web_models
+
+__all__ = (
+    'web',
+    'open_live',
+    'frozen_web',
+    'frozen_open_live',
+)
+
+
+def _getstate(self):
+    return [getattr(self, field.name) for field in dataclasses.fields(self)]
+
+
+def _setstate(self, state):
+    # 不可修改的版本不能用setattr
+    for field, value in zip(dataclasses.fields(self), state):
+        object.__setattr__(self, field.name, value)
+
+
+def _add_slots(cls: type) -> type:
+    """
+    Python 3.10的dataclass(slots=True)的做法：用同样的属性重新创建一个带__slots__的类，兼容3.8
+    """
+    cls_dict = dict(cls.__dict__)
+    field_names = tuple(field.name for field in dataclasses.fields(cls))
+    cls_dict['__slots__'] = field_names
+    for field_name in field_names:
+        # 默认值已经在生成的__init__里了，类属性会和__slots__冲突
+        cls_dict.pop(field_name, None)
+    cls_dict.pop('__dict__', None)
+    cls_dict.pop('__weakref__', None)
+    cls_dict['__getstate__'] = _getstate
+    cls_dict['__setstate__'] = _setstate
+    new_cls = type(cls)(cls.__name__, cls.__bases__, cls_dict)
+    new_cls.__qualname__ = cls.__qualname__
+    return new_cls
+
+
+def _rebind_globals(func: types.FunctionType, globals_: dict) -> types.FunctionType:
+    """
+    复制函数并替换全局变量，这样from_command里引用的嵌套模型会用紧凑的版本
+    """
+    new_func = types.FunctionType(func.__code__, globals_, func.__name__, func.__defaults__, func.__closure__)
+    new_func.__kwdefaults__ = func.__kwdefaults__
+    new_func.__doc__ = func.__doc__
+    new_func.__qualname__ = func.__qualname__
+    return new_func
+
+
+def _is_hashable_type(type_: Any, compact_classes: Dict[type, type]) -> bool:
+    """
+    按类型注解判断字段的值是不是可哈希的，不认识的类型当成可哈希
+    """
+    if type_ in compact_classes:
+        return compact_classes[type_].__hash__ is not None
+    origin = getattr(type_, '__origin__', None)
+    if origin is Union:
+        return all(_is_hashable_type(arg, compact_classes) for arg in type_.__args__)
+    if origin is not None:
+        type_ = origin
+    if isinstance(type_, type):
+        return type_.__hash__ is not None
+    return True
+
+
+def _make_compact_class(
+    cls: type, namespace_name: str, frozen: bool, globals_: dict, compact_classes: Dict[type, type]
+) -> type:
+    annotations = {}
+    cls_dict: Dict[str, Any] = {
+        '__module__': __name__,
+        '__qualname__': f'{namespace_name}.{cls.__name__}',
+        '__doc__': cls.__doc__,
+        '__annotations__': annotations,
+    }
+    fields = dataclasses.fields(cls)
+    field_names = {field.name for field in fields}
+    if frozen and not all(_is_hashable_type(field.type, compact_classes) for field in fields):
+        # 否则dataclass会生成__hash__，但是字段里的dict、list没法哈希
+        cls_dict['__hash__'] = None
+    for field in fields:
+        annotations[field.name] = field.type
+        default_factory = compact_classes.get(field.default_factory, field.default_factory)
+        cls_dict[field.name] = dataclasses.field(
+            default=field.default, default_factory=default_factory, init=field.init, repr=field.repr,
+            hash=field.hash, compare=field.compare, metadata=field.metadata,
+        )
+
+    for name, value in cls.__dict__.items():
+        if name.startswith('__') or name in field_names:
+            continue
+        if isinstance(value, classmethod):
+            value = classmethod(_rebind_globals(value.__func__, globals_))
+        elif isinstance(value, types.FunctionType):
+            value = _rebind_globals(value, globals_)
+        cls_dict[name] = value
+
+    new_cls = dataclasses.dataclass(frozen=frozen)(type(cls.__name__, (), cls_dict))
+    return _add_slots(new_cls)
+
+
+def _make_compact_models(module: types.ModuleType, namespace_name: str, frozen: bool) -> types.SimpleNamespace:
+    globals_ = dict(module.__dict__)
+    compact_classes: Dict[type, type] = {}
+    # 按定义的顺序，嵌套的模型在前面
+    for name, value in module.__dict__.items():
+        if (
+            isinstance(value, type)
+            and dataclasses.is_dataclass(value)
+            and value.__module__ == module.__name__
+        ):
+            compact_cls = _make_compact_class(value, namespace_name, frozen, globals_, compact_classes)
+            compact_classes[value] = compact_cls
+            globals_[name] = compact_cls
+    return types.SimpleNamespace(**{cls.__name__: compact_cls for cls, compact_cls in compact_classes.items()})
+
+
+web = _make_compact_models(web_models, 'web', False)
+"""web端消息模型的__slots__版本"""
+open_live = _make_compact_models(open_live_models, 'open_live', False)
+"""开放平台消息模型的__slots__版本"""
+frozen_web = _make_compact_models(web_models, 'frozen_web', True)
+"""web端消息模型的__slots__、不可修改版本"""
+frozen_open_live = _make_compact_models(open_live_models, 'frozen_open_live', True)
+"""开放平台消息模型的__slots__、不可修改版本"""
@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import enum
+import logging
+from typing import *
+
+import aiohttp
+
+from . import event_stream as ev_stream, handlers
+from .clients import web, ws_base
+
+__all__ = (
+    'RoomState',
+    'RoomPool',
+)
+
+logger = logging.getLogger('blivedm')
+
+ClientFactory = Callable[[int, aiohttp.ClientSession], ws_base.WebSocketClientBase]
+
+
+class RoomState(enum.Enum):
+    PENDING = 'pending'
+    """等待初始化"""
+    STARTING = 'starting'
+    """正在初始化"""
+    RUNNING = 'running'
+    """客户端正在运行，可能已连接或者正在重连"""
+    STOPPED = 'stopped'
+    """被移除或者关闭"""
+    FAILED = 'failed'
+    """客户端因为异常停止了"""
+
+
+class _Room:
+    __slots__ = ('room_id', 'client', 'state', 'task', 'stopping')
+
+    def __init__(self, room_id: int, client: ws_base.WebSocketClientBase):
+        self.room_id = room_id
+        self.client = client
+        self.state = RoomState.PENDING
+        self.task: Optional[asyncio.Task] = None
+        self.stopping = False
+
+
+def _default_client_factory(room_id: int, session: aiohttp.ClientSession) -> ws_base.WebSocketClientBase:
+    return web.BLiveClient(room_id, session=session)
+
+
+class RoomPool:
+    """
+    管理多个房间的客户端，所有客户端共享一个session和消息处理器，可以在运行时添加、移除房间
+
+    需要在事件循环中创建和使用
+
+    :param handler: 所有房间共享的消息处理器
+    :param session: 所有房间共享的session，None表示创建一个适合大量WebSocket连接的session，关闭时一起关闭
+    :param max_concurrent_starts: 最多同时初始化多少个房间，避免启动时同时请求太多接口被限流
+    :param client_factory: 创建客户端的函数，输入(room_id, session)，默认创建BLiveClient
+    """
+
+    def __init__(
+        self,
+        handler: Optional[handlers.HandlerInterface] = None,
+        *,
+        session: Optional[aiohttp.ClientSession] = None,
+        max_concurrent_starts: int = 20,
+        client_factory: Optional[ClientFactory] = None,
+    ):
+        self._handler = handler
+        if session is None:
+            self._session = self._create_session()
+            self._own_session = True
+        else:
+            self._session = session
+            self._own_session = False
+        self._start_semaphore = asyncio.Semaphore(max_concurrent_starts)
+        self._client_factory = client_factory if client_factory is not None else _default_client_factory
+
+        self._rooms: Dict[int, _Room] = {}
+        """构造时传进来的room_id -> 房间"""
+        self._event_streams: List[ev_stream.EventStream] = []
+        """所有房间共享的事件流"""
+        self._closed = False
+
+    @staticmethod
+    def _create_session() -> aiohttp.ClientSession:
+        connector = aiohttp.TCPConnector(
+            # WebSocket连接也会占用连接池，不能限制总数
+            limit=0,
+            limit_per_host=0,
+            ttl_dns_cache=300,
+            enable_cleanup_closed=True,
+        )
+        return aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=10))
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        return self._session
+
+    @property
+    def room_ids(self) -> List[int]:
+        """
+        所有房间构造时传进来的room_id
+        """
+        return list(self._rooms)
+
+    def get_client(self, room_id: int) -> Optional[ws_base.WebSocketClientBase]:
+        """
+        :param room_id: 添加房间时传进来的room_id
+        """
+        room = self._rooms.get(room_id, None)
+        return room.client if room is not None else None
+
+    def get_room_state(self, room_id: int) -> Optional[RoomState]:
+        """
+        :param room_id: 添加房间时传进来的room_id
+        """
+        room = self._rooms.get(room_id, None)
+        return room.state if room is not None else None
+
+    @property
+    def status(self) -> Dict[str, int]:
+        """
+        所有房间的状态统计，connected和reconnecting是running的细分
+        """
+        res = {state.value: 0 for state in RoomState}
+        res['connected'] = 0
+        res['reconnecting'] = 0
+        for room in self._rooms.values():
+            res[room.state.value] += 1
+            if room.state == RoomState.RUNNING:
+                if room.client.is_connected:
+                    res['connected'] += 1
+                else:
+                    res['reconnecting'] += 1
+        res['total'] = len(self._rooms)
+        return res
+
+    def set_handler(self, handler: Optional[handlers.HandlerInterface]):
+        """
+        设置所有房间共享的消息处理器
+        """
+        self._handler = handler
+        for room in self._rooms.values():
+            room.client.set_handler(handler)
+
+    def events(
+        self,
+        maxsize: int = ev_stream.DEFAULT_MAX_SIZE,
+        policy: ev_stream.OverflowPolicy = ev_stream.OverflowPolicy.BLOCK,
+        *,
+        cmd_priorities: Optional[Dict[str, int]] = None,
+        default_priority: int = 0,
+        wanted_cmds: Optional[Iterable[str]] = None,
+    ) -> ev_stream.EventStream:
+        """
+        创建一个所有房间共享的业务消息事件流，之后添加的房间也会推到这个事件流。事件流在关闭或者RoomPool close()时停止接收消息
+
+        BLOCK策略时缓冲区满了所有房间都会等待消费者
+
+        :param maxsize: 缓冲区大小
+        :param policy: 缓冲区满时的策略
+        :param cmd_priorities: cmd -> 优先级，数字越大越重要，只在DROP_BY_PRIORITY时使用
+        :param default_priority: 不在cmd_priorities里的cmd的优先级
+        :param wanted_cmds: 要接收的cmd，None表示全部都要
+        """
+        stream = ev_stream.EventStream(
+            maxsize, policy, cmd_priorities=cmd_priorities, default_priority=default_priority,
+            wanted_cmds=wanted_cmds
+        )
+        stream.add_source(self)
+        self._event_streams.append(stream)
+        for room in self._rooms.values():
+            room.client._add_event_stream(stream)  # noqa
+        return stream
+
+    def _remove_event_stream(self, stream: ev_stream.EventStream):
+        try:
+            self._event_streams.remove(stream)
+        except ValueError:
+            return
+        for room in self._rooms.values():
+            room.client._remove_event_stream(stream)  # noqa
+
+    def add_room(self, room_id: int) -> ws_base.WebSocketClientBase:
+        """
+        添加并启动一个房间，已经添加过则直接返回原来的客户端
+
+        :param room_id: 传给client_factory的room_id
+        :return: 房间的客户端
+        """
+        if self._closed:
+            raise RuntimeError('RoomPool is closed')
+        room = self._rooms.get(room_id, None)
+        if room is not None:
+            return room.client
+
+        client = self._client_factory(room_id, self._session)
+        client.set_handler(self._handler)
+        for stream in self._event_streams:
+            client._add_event_stream(stream)  # noqa
+        room = self._rooms[room_id] = _Room(room_id, client)
+        room.task = asyncio.create_task(self._run_room(room))
+        return client
+
+    def add_rooms(self, room_ids: Iterable[int]):
+        """
+        添加并启动多个房间
+        """
+        for room_id in room_ids:
+            self.add_room(room_id)
+
+    async def remove_room(self, room_id: int):
+        """
+        停止并移除一个房间
+        """
+        room = self._rooms.pop(room_id, None)
+        if room is None:
+            return
+        await self._stop_room(room)
+
+    async def join(self):
+        """
+        等待所有房间停止
+        """
+        tasks = [room.task for room in self._rooms.values() if room.task is not None]
+        if tasks:
+            await asyncio.gather(*(asyncio.shield(task) for task in tasks))
+
+    async def close(self):
+        """
+        停止所有房间并释放资源，调用后不能再添加房间
+        """
+        self._closed = True
+        rooms, self._rooms = list(self._rooms.values()), {}
+        await asyncio.gather(*(self._stop_room(room) for room in rooms))
+        for stream in list(self._event_streams):
+            stream.remove_source(self)
+        if self._own_session:
+            await self._session.close()
+
+    async def _run_room(self, room: _Room):
+        client = room.client
+        try:
+            async with self._start_semaphore:
+                if room.stopping:
+                    return
+                room.state = RoomState.STARTING
+                # 在这里初始化房间，限制同时初始化的数量。失败了不要紧，客户端连接前会再初始化
+                try:
+                    if await client.init_room():
+                        client._need_init_room = False  # noqa
+                except Exception:  # noqa
+                    logger.exception('room=%d init_room() failed:', room.room_id)
+                if room.stopping:
+                    return
+
+            client.start()
+            room.state = RoomState.RUNNING
+            await client.join()
+        finally:
+            room.state = RoomState.STOPPED if room.stopping else RoomState.FAILED
+
+    async def _stop_room(self, room: _Room):
+        room.stopping = True
+        if room.task is not None and not room.task.done():
+            if room.state != RoomState.RUNNING:
+                # 还在等待初始化
+                room.task.cancel()
+            try:
+                await room.client.stop_and_close()
+            finally:
+                await asyncio.gather(room.task, return_exceptions=True)
+        else:
+            await room.client.close()
+        room.state = RoomState.STOPPED
@@ -0,0 +1,312 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import collections
+import concurrent.futures
+import itertools
+import logging
+import multiprocessing.context
+import os
+import struct
+import traceback
+import zlib
+from typing import *
+
+import brotli
+
+from . import json_codec
+from .clients import ws_base
+
+__all__ = (
+    'ProcessDecoder',
+    'DecodeResult',
+    'MessageTypes',
+    'decode_frame',
+)
+
+logger = logging.getLogger('blivedm')
+
+MessageTypes = Mapping[str, Tuple[Callable[[Any], Any], str]]
+"""cmd -> (有from_command的消息类, 数据在command中的键)"""
+
+_MAX_CONTEXTS = 64
+"""主进程和每个解码进程最多缓存多少个解码参数"""
+
+
+class DecodeResult(NamedTuple):
+    """
+    在解码进程解析一个WebSocket消息的结果
+    """
+
+    commands: List[dict]
+    """反序列化后的业务消息，按收到的顺序"""
+    messages: Optional[List[Any]]
+    """和commands一一对应的构造好的消息，没有构造的是None。没有要构造的消息类型时为None"""
+    auth_reply: Optional[dict]
+    """认证响应"""
+    popularity: Optional[int]
+    """服务器心跳包里的人气值"""
+    skipped_cmds: List[Tuple[str, int, int]]
+    """没有反序列化就丢弃的消息统计，[(cmd, 消息数, 字节数), ...]"""
+    warnings: List[str]
+    """要在主进程打的警告日志"""
+    error: Optional[str]
+    """解析到一半出错时的traceback，出错前解析出来的消息还在commands里"""
+
+
+class _DecodeContext(NamedTuple):
+    """
+    同一个客户端每次解码都一样的参数，每个解码进程只传一次
+    """
+
+    wanted_cmds: Optional[AbstractSet[str]]
+    codec_name: str
+    message_types: Optional[MessageTypes]
+
+
+_worker_contexts: 'collections.OrderedDict[int, _DecodeContext]' = collections.OrderedDict()
+"""解码进程里缓存的解码参数，context_id -> 参数"""
+
+
+def _decode_in_worker(data: bytes, context_id: int, context: Optional[_DecodeContext]) -> Optional[DecodeResult]:
+    """
+    解码进程的入口
+
+    :param context: 解码参数，None表示用缓存的
+    :return: 解码结果，缓存里没有这个context_id时返回None，主进程会带上解码参数重试
+    """
+    if context is None:
+        context = _worker_contexts.get(context_id, None)
+        if context is None:
+            return None
+        _worker_contexts.move_to_end(context_id)
+    else:
+        _worker_contexts[context_id] = context
+        while len(_worker_contexts) > _MAX_CONTEXTS:
+            _worker_contexts.popitem(last=False)
+    return decode_frame(data, context.wanted_cmds, context.codec_name, context.message_types)
+
+
+def decode_frame(
+    data: bytes,
+    wanted_cmds: Optional[AbstractSet[str]],
+    codec_name: str,
+    message_types: Optional[MessageTypes] = None,
+) -> DecodeResult:
+    """
+    在解码进程解析一个WebSocket消息，包括分包、解压、反序列化，可选构造消息的dataclass
+
+    :param data: WebSocket消息数据
+    :param wanted_cmds: 需要反序列化的cmd，None表示全部都要
+    :param codec_name: JSON编解码器名字，解码进程没有安装时用默认的
+    :param message_types: 要构造的消息类型，构造好的消息放在DecodeResult.messages，None表示不构造
+    """
+    try:
+        codec = json_codec.get_codec(codec_name)
+    except (ValueError, ImportError):
+        codec = json_codec.get_default_codec()
+
+    commands = []
+    messages = [] if message_types else None
+    auth_reply = None
+    popularity = None
+    skipped_cmds: Dict[str, List[int]] = {}
+    warnings = []
+    error = None
+
+    view = memoryview(data)
+    try:
+        header = ws_base.HeaderTuple(*ws_base.HEADER_STRUCT.unpack_from(view, 0))
+    except struct.error:
+        return DecodeResult(commands, messages, auth_reply, popularity, [], warnings, traceback.format_exc())
+
+    if header.operation in (ws_base.Operation.SEND_MSG_REPLY, ws_base.Operation.AUTH_REPLY):
+        packet_iters = [ws_base.iter_packets(view)]
+        try:
+            while packet_iters:
+                try:
+                    packet = next(packet_iters[-1], None)
+                except struct.error as e:
+                    warnings.append(f'parsing header failed: {e}')
+                    packet_iters.pop()
+                    continue
+                if packet is None:
+                    packet_iters.pop()
+                    continue
+
+                operation, ver, body = packet
+                if operation == ws_base.Operation.SEND_MSG_REPLY:
+                    if ver == ws_base.ProtoVer.BROTLI:
+                        packet_iters.append(ws_base.iter_packets(brotli.decompress(body)))
+                    elif ver == ws_base.ProtoVer.DEFLATE:
+                        packet_iters.append(ws_base.iter_packets(zlib.decompress(body)))
+                    elif ver == ws_base.ProtoVer.NORMAL:
+                        if len(body) == 0:
+                            continue
+                        if wanted_cmds is not None:
+                            cmd = ws_base.peek_cmd(body)
+                            if cmd is not None and cmd not in wanted_cmds:
+                                stat = skipped_cmds.setdefault(cmd, [0, 0])
+                                stat[0] += 1
+                                stat[1] += len(body)
+                                continue
+                        command = codec.loads(body)
+                        if messages is not None:
+                            messages.append(_build_message(command, message_types))
+                        commands.append(command)
+                    else:
+                        warnings.append(f'unknown protocol version={ver}, body={bytes(body)}')
+                elif operation == ws_base.Operation.AUTH_REPLY:
+                    auth_reply = codec.loads(body)
+                else:
+                    warnings.append(f'unknown message operation={operation}, ver={ver}, body={bytes(body)}')
+        except Exception:  # noqa
+            error = traceback.format_exc()
+
+    elif header.operation == ws_base.Operation.HEARTBEAT_REPLY:
+        popularity = int.from_bytes(view[header.raw_header_size: header.raw_header_size + 4], 'big')
+
+    else:
+        warnings.append(f'unknown message operation={header.operation}, header={header}, '
+                        f'body={data[header.raw_header_size: header.pack_len]}')
+
+    return DecodeResult(
+        commands,
+        messages,
+        auth_reply,
+        popularity,
+        [(cmd, count, size) for cmd, (count, size) in skipped_cmds.items()],
+        warnings,
+        error,
+    )
+
+
+def _build_message(command: dict, message_types: MessageTypes) -> Optional[Any]:
+    """
+    构造消息
+
+    :return: 构造好的消息，不需要构造或者构造失败时为None
+    """
+    cmd = command.get('cmd', '')
+    pos = cmd.find(':')  # 2019-5-29 B站弹幕升级新增了参数
+    if pos != -1:
+        cmd = cmd[:pos]
+    message_type = message_types.get(cmd, None)
+    if message_type is None:
+        return None
+    message_cls, data_key = message_type
+    try:
+        return message_cls.from_command(command[data_key])
+    except Exception:  # noqa
+        # 构造失败就留给主进程的消息处理器，让错误日志在主进程打
+        return None
+
+
+class _ContextEntry:
+    __slots__ = ('context_id', 'context', 'sends_left')
+
+    def __init__(self, context_id: int, context: _DecodeContext, sends_left: int):
+        self.context_id = context_id
+        self.context = context
+        self.sends_left = sends_left
+        """还要随消息一起发送解码参数的次数"""
+
+
+class ProcessDecoder:
+    """
+    解码进程池，把WebSocket消息交给子进程分包、解压、反序列化，事件循环线程只负责网络IO
+
+    可以被多个客户端共享。每个客户端等上一个WebSocket消息处理完才会处理下一个，所以同一个房间的消息顺序不变
+
+    需要反序列化的cmd等每次都一样的参数按值缓存，每个解码进程基本只传一次，之后只传一个ID
+
+    :param max_workers: 进程数，None表示CPU核数
+    :param build_models: 是否在子进程构造消息处理器的get_message_types返回的消息类型，会增加进程间传输的数据量
+    :param mp_context: multiprocessing的上下文，None表示默认的
+    """
+
+    def __init__(
+        self,
+        max_workers: Optional[int] = None,
+        *,
+        build_models: bool = False,
+        mp_context: Optional[multiprocessing.context.BaseContext] = None,
+    ):
+        self._build_models = build_models
+        if max_workers is None:
+            max_workers = os.cpu_count() or 1
+        self._max_workers = max_workers
+        self._executor = concurrent.futures.ProcessPoolExecutor(max_workers, mp_context=mp_context)
+        self._contexts: 'collections.OrderedDict[tuple, _ContextEntry]' = collections.OrderedDict()
+        """按值比较的解码参数 -> 缓存项，不同客户端的参数相同时共用一个"""
+        self._next_context_id = itertools.count(1)
+
+    @property
+    def build_models(self) -> bool:
+        """
+        是否在子进程构造消息的dataclass
+        """
+        return self._build_models
+
+    async def decode(
+        self,
+        data: bytes,
+        wanted_cmds: Optional[AbstractSet[str]] = None,
+        codec_name: str = json_codec.StdlibJsonCodec.name,
+        message_types: Optional[MessageTypes] = None,
+    ) -> DecodeResult:
+        """
+        在子进程解析一个WebSocket消息
+
+        解码参数按值缓存，使用同一个消息处理器的客户端共用一个缓存项。新的解码参数在前max_workers次提交时随消息一起发送，
+        之后只发送ID，解码进程没有缓存时再带上解码参数重试
+
+        :param data: WebSocket消息数据
+        :param wanted_cmds: 需要反序列化的cmd，None表示全部都要
+        :param codec_name: JSON编解码器名字
+        :param message_types: 要构造的消息类型，只有build_models为True时才会构造
+        """
+        if not self._build_models:
+            message_types = None
+        entry = self._get_context_entry(wanted_cmds, codec_name, message_types)
+        if entry.sends_left > 0:
+            # 还不确定所有解码进程都有这个解码参数，直接带上，不用多一次往返
+            entry.sends_left -= 1
+            context = entry.context
+        else:
+            context = None
+
+        loop = asyncio.get_running_loop()
+        res = await loop.run_in_executor(self._executor, _decode_in_worker, data, entry.context_id, context)
+        if res is None:
+            # 这个解码进程还没有这个解码参数，或者已经被挤出缓存了
+            res = await loop.run_in_executor(self._executor, _decode_in_worker, data, entry.context_id, entry.context)
+        return res
+
+    def _get_context_entry(
+        self,
+        wanted_cmds: Optional[AbstractSet[str]],
+        codec_name: str,
+        message_types: Optional[MessageTypes],
+    ) -> '_ContextEntry':
+        key = (
+            None if wanted_cmds is None else frozenset(wanted_cmds),
+            codec_name,
+            None if message_types is None else frozenset(message_types.items()),
+        )
+        entry = self._contexts.get(key, None)
+        if entry is not None:
+            self._contexts.move_to_end(key)
+            return entry
+
+        entry = self._contexts[key] = _ContextEntry(
+            next(self._next_context_id), _DecodeContext(key[0], codec_name, message_types), self._max_workers
+        )
+        while len(self._contexts) > _MAX_CONTEXTS:
+            self._contexts.popitem(last=False)
+        return entry
+
+    def close(self):
+        """
+        关闭进程池，不等待正在解析的消息
+        """
+        self._executor.shutdown(wait=False)
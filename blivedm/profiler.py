@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import logging
+import random
+import time
+from typing import *
+
+from . import handlers
+
+__all__ = (
+    'HandlerProfiler',
+)
+
+logger = logging.getLogger('blivedm')
+
+ProfileKey = Tuple[Optional[int], str, str]
+"""(room_id, cmd, 处理方法)"""
+ReportCallback = Callable[[List[dict]], Any]
+
+_KEY_FIELDS = ('room_id', 'cmd', 'method')
+
+BATCH_CMD = '*'
+"""自定义handle_batch的消息处理器不能按cmd统计，用这个cmd记录整批"""
+
+
+class _Stats:
+    __slots__ = ('samples', 'messages', 'cpu_ns', 'max_cpu_ns')
+
+    def __init__(self):
+        self.samples = 0
+        self.messages = 0
+        self.cpu_ns = 0
+        self.max_cpu_ns = 0
+
+
+class HandlerProfiler:
+    """
+    抽样统计消息处理器的CPU时间，按(room_id, cmd, 处理方法)归类，用来找出耗CPU的房间和回调
+
+    可以被多个客户端共享，用客户端的set_profiler设置。CPU时间是当前线程的，不包括等待IO和其他线程的时间
+
+    :param sample_rate: 抽样比例，0~1
+    :param report_interval: 定期报告的间隔（秒），每次报告后清空统计，None表示不定期报告
+    :param top_n: 报告前多少项
+    :param report_callback: 报告的回调，输入get_top()的结果，None表示打日志
+    """
+
+    def __init__(
+        self,
+        sample_rate: float = 0.01,
+        report_interval: Optional[float] = 60.0,
+        top_n: int = 20,
+        report_callback: Optional[ReportCallback] = None,
+    ):
+        if not 0 < sample_rate <= 1:
+            raise ValueError(f'sample_rate must be in (0, 1], got {sample_rate}')
+        self._sample_rate = sample_rate
+        self._report_interval = report_interval
+        self._top_n = top_n
+        self._report_callback = report_callback
+
+        self._random = random.Random()
+        self._stats: Dict[ProfileKey, _Stats] = {}
+        self._start_time = time.monotonic()
+        self._report_timer_handle: Optional[asyncio.TimerHandle] = None
+        self._method_name_cache: Dict[Tuple[type, str], str] = {}
+        """(消息处理器类型, cmd) -> 处理方法名"""
+
+    @property
+    def sample_rate(self) -> float:
+        return self._sample_rate
+
+    def should_sample(self) -> bool:
+        """
+        这条消息是否抽样
+        """
+        return self._random.random() < self._sample_rate
+
+    def get_method_name(self, handler: 'handlers.HandlerInterface', cmd: str) -> str:
+        """
+        获取处理这个cmd的方法名，BaseHandler的子类是_CMD_CALLBACK_DICT里对应的_on_xxx方法
+        """
+        handler_cls = type(handler)
+        key = (handler_cls, cmd)
+        name = self._method_name_cache.get(key, None)
+        if name is not None:
+            return name
+
+        method_name = 'handle'
+        if (
+            isinstance(handler, handlers.BaseHandler)
+            and handler_cls.handle is handlers.BaseHandler.handle
+        ):
+            pos = cmd.find(':')  # 2019-5-29 B站弹幕升级新增了参数
+            callback = handler._CMD_CALLBACK_DICT.get(cmd if pos == -1 else cmd[:pos], None)  # noqa
+            if callback is None:
+                method_name = 'handle(unhandled)'
+            else:
+                method_name = getattr(callback, 'method_name', None) or callback.__name__
+        name = self._method_name_cache[key] = f'{handler_cls.__name__}.{method_name}'
+        return name
+
+    def record(self, room_id: Optional[int], cmd: str, method: str, cpu_ns: int, messages: int = 1):
+        """
+        记录一次抽样
+
+        :param room_id: 房间ID
+        :param cmd: 业务消息的cmd
+        :param method: 处理方法名
+        :param cpu_ns: 处理用的CPU时间（纳秒）
+        :param messages: 这次抽样包括多少条业务消息，整批记录时大于1
+        """
+        key = (room_id, cmd, method)
+        stats = self._stats.get(key, None)
+        if stats is None:
+            stats = self._stats[key] = _Stats()
+        stats.samples += 1
+        stats.messages += messages
+        stats.cpu_ns += cpu_ns
+        if cpu_ns > stats.max_cpu_ns:
+            stats.max_cpu_ns = cpu_ns
+
+        if self._report_interval is not None and self._report_timer_handle is None:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                return
+            self._report_timer_handle = loop.call_later(self._report_interval, self._on_report_timer)
+
+    def get_top(self, n: Optional[int] = None, group_by: Sequence[str] = _KEY_FIELDS) -> List[dict]:
+        """
+        按估算的总CPU时间排序的前n项
+
+        :param n: 返回前多少项，None表示全部
+        :param group_by: 按哪些字段归类，'room_id'、'cmd'、'method'的子集，例如只按'room_id'找最耗CPU的房间
+        :return: [{'room_id', 'cmd', 'method'中group_by的字段, 'samples', 'est_messages', 'est_cpu_seconds',
+            'mean_cpu_seconds', 'max_cpu_seconds', 'cpu_share'}, ...]，
+            est_xxx是除以抽样比例估算的值，cpu_share是占统计期间墙上时间的比例
+        """
+        indexes = [_KEY_FIELDS.index(field) for field in group_by]
+        groups: Dict[tuple, _Stats] = {}
+        for key, stats in self._stats.items():
+            group_key = tuple(key[i] for i in indexes)
+            group = groups.get(group_key, None)
+            if group is None:
+                group = groups[group_key] = _Stats()
+            group.samples += stats.samples
+            group.messages += stats.messages
+            group.cpu_ns += stats.cpu_ns
+            group.max_cpu_ns = max(group.max_cpu_ns, stats.max_cpu_ns)
+
+        elapsed = max(time.monotonic() - self._start_time, 1e-9)
+        items = sorted(groups.items(), key=lambda item: item[1].cpu_ns, reverse=True)
+        if n is not None:
+            items = items[:n]
+        res = []
+        for group_key, stats in items:
+            est_cpu_seconds = stats.cpu_ns / self._sample_rate * 1e-9
+            item = dict(zip(group_by, group_key))
+            item.update({
+                'samples': stats.samples,
+                'est_messages': stats.messages / self._sample_rate,
+                'est_cpu_seconds': est_cpu_seconds,
+                'mean_cpu_seconds': stats.cpu_ns / stats.messages * 1e-9,
+                'max_cpu_seconds': stats.max_cpu_ns * 1e-9,
+                'cpu_share': est_cpu_seconds / elapsed,
+            })
+            res.append(item)
+        return res
+
+    def reset(self):
+        """
+        清空统计
+        """
+        self._stats.clear()
+        self._start_time = time.monotonic()
+
+    def close(self):
+        """
+        停止定期报告
+        """
+        if self._report_timer_handle is not None:
+            self._report_timer_handle.cancel()
+            self._report_timer_handle = None
+
+    def _on_report_timer(self):
+        self._report_timer_handle = None
+        report = self.get_top(self._top_n)
+        self.reset()
+        if self._report_callback is not None:
+            try:
+                self._report_callback(report)
+            except Exception:  # noqa
+                logger.exception('HandlerProfiler report_callback() failed:')
+            return
+
+        lines = [f'handler profile, top {len(report)}:']
+        for item in report:
+            lines.append(
+                f'  room={item["room_id"]} cmd={item["cmd"]} method={item["method"]}'
+                f' est_cpu={item["est_cpu_seconds"]:.3f}s share={item["cpu_share"]:.2%}'
+                f' mean={item["mean_cpu_seconds"] * 1e6:.1f}us max={item["max_cpu_seconds"] * 1e6:.1f}us'
+                f' samples={item["samples"]}'
+            )
+        logger.info('\n'.join(lines))
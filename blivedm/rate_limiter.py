@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import math
+import time
+from typing import *
+
+__all__ = (
+    'TokenBucket',
+    'get_default_reconnect_limiter',
+    'set_default_reconnect_limiter',
+)
+
+DEFAULT_RECONNECT_RATE = 20.0
+"""默认每秒最多重连多少次"""
+DEFAULT_RECONNECT_BURST = 100
+"""默认最多可以连续重连多少次不等待"""
+
+
+class TokenBucket:
+    """
+    令牌桶限流器，不绑定事件循环
+
+    令牌不够时直接预支，等待时间按排队位置计算，先来的先得到令牌
+
+    :param rate: 每秒生成多少个令牌，float('inf')表示不限流
+    :param burst: 最多存多少个令牌，也就是最多可以连续获取多少次不等待
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        if rate <= 0:
+            raise ValueError(f'rate must be positive, got {rate}')
+        if burst < 1:
+            raise ValueError(f'burst must be at least 1, got {burst}')
+        self._rate = rate
+        self._burst = burst
+        self._tokens = float(burst)
+        """剩余的令牌数，负数表示已经预支给排队的协程"""
+        self._update_time = time.monotonic()
+
+        # 统计
+        self._acquired = 0
+        self._delayed = 0
+        self._total_wait_time = 0.0
+
+    @property
+    def rate(self) -> float:
+        return self._rate
+
+    @property
+    def burst(self) -> int:
+        return self._burst
+
+    @property
+    def stats(self) -> dict:
+        return {
+            'acquired': self._acquired,
+            'delayed': self._delayed,
+            'total_wait_time': self._total_wait_time,
+            'tokens': self._get_tokens(),
+        }
+
+    def _get_tokens(self) -> float:
+        if math.isinf(self._rate):
+            return float(self._burst)
+        now = time.monotonic()
+        self._tokens = min(self._tokens + (now - self._update_time) * self._rate, self._burst)
+        self._update_time = now
+        return self._tokens
+
+    def try_acquire(self) -> bool:
+        """
+        不等待，有令牌则获取并返回True
+        """
+        if self._get_tokens() < 1:
+            return False
+        self._tokens -= 1
+        self._acquired += 1
+        return True
+
+    async def acquire(self):
+        """
+        获取一个令牌，不够则等待
+        """
+        if math.isinf(self._rate):
+            self._acquired += 1
+            return
+        self._tokens = self._get_tokens() - 1
+        self._acquired += 1
+        if self._tokens >= 0:
+            return
+
+        wait_time = -self._tokens / self._rate
+        self._delayed += 1
+        self._total_wait_time += wait_time
+        try:
+            await asyncio.sleep(wait_time)
+        except asyncio.CancelledError:
+            # 退还预支的令牌
+            self._tokens += 1
+            self._acquired -= 1
+            raise
+
+
+_default_reconnect_limiter: Optional[TokenBucket] = None
+
+
+def get_default_reconnect_limiter() -> TokenBucket:
+    """
+    获取进程内共享的重连限流器，没有设置限流器的客户端重连前都要从这里获取令牌
+    """
+    global _default_reconnect_limiter
+    if _default_reconnect_limiter is None:
+        _default_reconnect_limiter = TokenBucket(DEFAULT_RECONNECT_RATE, DEFAULT_RECONNECT_BURST)
+    return _default_reconnect_limiter
+
+
+def set_default_reconnect_limiter(limiter: Optional[TokenBucket]):
+    """
+    设置进程内共享的重连限流器，要关闭限流可以设置TokenBucket(float('inf'))
+
+    :param limiter: 限流器，None表示下次使用时重新创建一个默认配置的
+    """
+    global _default_reconnect_limiter
+    _default_reconnect_limiter = limiter
@@ -0,0 +1,407 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import collections
+import concurrent.futures
+import logging
+import os
+import struct
+import time
+from typing import *
+
+__all__ = (
+    'FrameRecorder',
+    'RecordedFrame',
+    'iter_frames',
+    'iter_room_frames',
+    'get_segment_paths',
+)
+
+logger = logging.getLogger('blivedm')
+
+FILE_MAGIC = b'BLVDMREC'
+"""录制文件开头的魔数"""
+FILE_VERSION = 1
+FILE_HEADER_STRUCT = struct.Struct('>8sHqq')
+"""文件头：(魔数, 版本, 创建时的墙上时间纳秒, 创建时的单调时钟纳秒)，用来把单调时钟换算成墙上时间"""
+FRAME_HEADER_STRUCT = struct.Struct('>qQI')
+"""每帧的头：(收到时的单调时钟纳秒, room_id, 数据长度)，后面是WebSocket消息原始数据"""
+
+SEGMENT_SUFFIX = '.blrec'
+
+
+class RecordedFrame(NamedTuple):
+    """
+    录制的一个WebSocket消息
+    """
+
+    room_id: int
+    """房间ID"""
+    timestamp_ns: int
+    """收到时的单调时钟（纳秒），只能和同一次运行录制的帧比较"""
+    wall_time_ns: int
+    """由文件头换算的收到时的墙上时间（纳秒），可以跨文件比较"""
+    data: bytes
+    """WebSocket消息原始数据，压缩的包没有解压"""
+
+
+class _SegmentWriter:
+    """
+    一个房间当前写入的分段文件，只在写入线程使用
+    """
+
+    def __init__(self, directory: str, room_id: int):
+        self._directory = directory
+        self._room_id = room_id
+        self._file: Optional[BinaryIO] = None
+        self._size = 0
+        self._open_time = 0.0
+        self._last_write_time = 0.0
+        self._segment_index = 0
+
+    @property
+    def last_write_time(self) -> float:
+        return self._last_write_time
+
+    def write(self, data: bytes, max_bytes: int, max_seconds: float) -> bool:
+        """
+        :return: 是否新建了分段
+        """
+        rotated = False
+        now = time.monotonic()
+        if (
+            self._file is not None
+            and (self._size + len(data) > max_bytes or now - self._open_time > max_seconds)
+        ):
+            self.close()
+        if self._file is None:
+            self._open()
+            rotated = True
+        self._last_write_time = now
+        self._file.write(data)
+        self._size += len(data)
+        return rotated
+
+    def _open(self):
+        room_directory = os.path.join(self._directory, str(self._room_id))
+        os.makedirs(room_directory, exist_ok=True)
+        wall_time_ns = time.time_ns()
+        while True:
+            # 文件名按时间排序就是录制顺序
+            path = os.path.join(
+                room_directory, f'{self._room_id}-{wall_time_ns // 1_000_000}-{self._segment_index:04d}{SEGMENT_SUFFIX}'
+            )
+            self._segment_index += 1
+            try:
+                self._file = open(path, 'xb')
+                break
+            except FileExistsError:
+                continue
+        self._file.write(FILE_HEADER_STRUCT.pack(FILE_MAGIC, FILE_VERSION, wall_time_ns, time.monotonic_ns()))
+        self._size = FILE_HEADER_STRUCT.size
+        self._open_time = time.monotonic()
+
+    def flush(self):
+        if self._file is not None:
+            self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class FrameRecorder:
+    """
+    把收到的WebSocket消息原样追加写到文件，每个房间一个目录，按大小和时间分段
+
+    事件循环线程只负责把数据复制到内存缓冲区，攒够一批后交给专用的写入线程，不会因为磁盘IO阻塞网络协程。
+    写入太慢导致积压超过max_pending_bytes时丢弃新的帧并计数。
+
+    每个房间写入时打开一个文件，超过segment_idle_seconds没有写入的文件会关闭，同时打开的文件超过max_open_files时
+    关闭最久没写入的，房间很多时不会用完文件描述符。关闭后再写入会新建分段。
+    写某个房间的文件出错时只丢弃这个房间这一批的数据并计数，不影响其他房间。
+
+    可以被多个客户端共享，用客户端的set_recorder设置。注意不是线程安全的，所有使用同一个录制器的客户端要运行在同一个事件循环
+
+    :param directory: 录制文件的根目录
+    :param segment_max_bytes: 每个分段文件的最大字节数
+    :param segment_max_seconds: 每个分段文件最多写多少秒
+    :param flush_interval: 缓冲区最多攒多少秒就交给写入线程
+    :param flush_bytes: 缓冲区攒够多少字节立即交给写入线程
+    :param max_pending_bytes: 还没写到文件的数据最多多少字节
+    :param segment_idle_seconds: 分段文件超过多少秒没有写入就关闭
+    :param max_open_files: 最多同时打开多少个分段文件
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        *,
+        segment_max_bytes: int = 64 * 1024 * 1024,
+        segment_max_seconds: float = 3600.0,
+        flush_interval: float = 1.0,
+        flush_bytes: int = 256 * 1024,
+        max_pending_bytes: int = 64 * 1024 * 1024,
+        segment_idle_seconds: float = 60.0,
+        max_open_files: int = 256,
+    ):
+        if max_open_files < 1:
+            raise ValueError(f'max_open_files must be >= 1, got {max_open_files}')
+        self._directory = directory
+        self._segment_max_bytes = segment_max_bytes
+        self._segment_max_seconds = segment_max_seconds
+        self._flush_interval = flush_interval
+        self._flush_bytes = flush_bytes
+        self._max_pending_bytes = max_pending_bytes
+        self._segment_idle_seconds = segment_idle_seconds
+        self._max_open_files = max_open_files
+
+        self._executor = concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix='blivedm-recorder')
+        """写入线程，只有一个线程，所以写入顺序和提交顺序一样"""
+        self._writers: 'collections.OrderedDict[int, _SegmentWriter]' = collections.OrderedDict()
+        """room_id -> 打开的分段文件，按最后写入时间排序，最久没写入的在前面，只在写入线程访问"""
+
+        self._buffers: Dict[int, bytearray] = {}
+        """room_id -> 还没交给写入线程的数据"""
+        self._buffered_bytes = 0
+        self._pending_bytes = 0
+        """已经交给写入线程但还没写完的字节数，加上_buffered_bytes是积压的字节数"""
+        self._flush_timer_handle: Optional[asyncio.TimerHandle] = None
+        self._write_futures: Set[asyncio.Future] = set()
+        self._closed = False
+
+        # 统计
+        self._recorded_frames = 0
+        self._recorded_bytes = 0
+        self._dropped_frames = 0
+        self._written_bytes = 0
+        self._write_failed_bytes = 0
+        self._segments = 0
+
+    @property
+    def directory(self) -> str:
+        return self._directory
+
+    @property
+    def stats(self) -> dict:
+        """
+        统计信息的快照
+        """
+        return {
+            'recorded_frames': self._recorded_frames,
+            'recorded_bytes': self._recorded_bytes,
+            'dropped_frames': self._dropped_frames,
+            'written_bytes': self._written_bytes,
+            'write_failed_bytes': self._write_failed_bytes,
+            'pending_bytes': self._buffered_bytes + self._pending_bytes,
+            'segments': self._segments,
+        }
+
+    def record(self, room_id: int, data: bytes, timestamp_ns: Optional[int] = None):
+        """
+        录制一个WebSocket消息，只能在事件循环线程调用
+
+        :param room_id: 房间ID
+        :param data: WebSocket消息原始数据
+        :param timestamp_ns: 收到时的单调时钟（纳秒），None表示现在
+        """
+        if self._closed:
+            return
+        if timestamp_ns is None:
+            timestamp_ns = time.monotonic_ns()
+        size = FRAME_HEADER_STRUCT.size + len(data)
+        if self._buffered_bytes + self._pending_bytes + size > self._max_pending_bytes:
+            self._dropped_frames += 1
+            return
+
+        buffer = self._buffers.get(room_id, None)
+        if buffer is None:
+            buffer = self._buffers[room_id] = bytearray()
+        buffer += FRAME_HEADER_STRUCT.pack(timestamp_ns, room_id, len(data))
+        buffer += data
+        self._buffered_bytes += size
+        self._recorded_frames += 1
+        self._recorded_bytes += len(data)
+
+        if self._buffered_bytes >= self._flush_bytes:
+            self._submit_buffers()
+        elif self._flush_timer_handle is None:
+            self._flush_timer_handle = asyncio.get_running_loop().call_later(
+                self._flush_interval, self._submit_buffers
+            )
+
+    async def flush(self):
+        """
+        把缓冲区的数据写到文件，等待写完
+        """
+        self._submit_buffers()
+        await self._submit_to_executor(self._flush_files)
+        if self._write_futures:
+            await asyncio.gather(*self._write_futures, return_exceptions=True)
+
+    async def close(self):
+        """
+        写完剩下的数据并关闭所有文件，调用后不再录制
+        """
+        if self._closed:
+            return
+        self._submit_buffers()
+        self._closed = True
+        await self._submit_to_executor(self._close_files)
+        self._executor.shutdown(wait=False)
+
+    def _submit_buffers(self):
+        if self._flush_timer_handle is not None:
+            self._flush_timer_handle.cancel()
+            self._flush_timer_handle = None
+        if not self._buffers:
+            return
+
+        batch = [(room_id, bytes(buffer)) for room_id, buffer in self._buffers.items()]
+        self._buffers.clear()
+        size = self._buffered_bytes
+        self._buffered_bytes = 0
+        self._pending_bytes += size
+
+        future = asyncio.get_running_loop().run_in_executor(self._executor, self._write_batch, batch)
+        self._write_futures.add(future)
+        future.add_done_callback(lambda f: self._on_batch_written(f, size))
+
+    def _on_batch_written(self, future: asyncio.Future, size: int):
+        self._write_futures.discard(future)
+        self._pending_bytes -= size
+        try:
+            segments, failed_bytes = future.result()
+        except Exception:  # noqa
+            logger.exception('FrameRecorder write failed:')
+            self._write_failed_bytes += size
+            return
+        self._written_bytes += size - failed_bytes
+        self._write_failed_bytes += failed_bytes
+        self._segments += segments
+
+    async def _submit_to_executor(self, func: Callable[[], Any]):
+        await asyncio.get_running_loop().run_in_executor(self._executor, func)
+
+    def _write_batch(self, batch: List[Tuple[int, bytes]]) -> Tuple[int, int]:
+        """
+        在写入线程执行
+
+        :return: (新建的分段数, 写入失败丢弃的字节数)
+        """
+        segments = 0
+        failed_bytes = 0
+        for room_id, data in batch:
+            writer = self._writers.pop(room_id, None)
+            if writer is None:
+                writer = _SegmentWriter(self._directory, room_id)
+            try:
+                if writer.write(data, self._segment_max_bytes, self._segment_max_seconds):
+                    segments += 1
+            except OSError:
+                logger.exception('room=%d FrameRecorder write failed, dropped %d bytes:', room_id, len(data))
+                failed_bytes += len(data)
+                # 文件末尾可能有写了一半的帧，关掉这个分段，下次写入时新建
+                self._close_writer(writer)
+                continue
+            # 移到最后，保持按最后写入时间排序
+            self._writers[room_id] = writer
+
+        self._close_idle_writers()
+        return segments, failed_bytes
+
+    def _close_idle_writers(self):
+        """
+        关闭太久没有写入的文件，以及超出max_open_files的最久没写入的文件
+        """
+        deadline = time.monotonic() - self._segment_idle_seconds
+        while self._writers:
+            room_id, writer = next(iter(self._writers.items()))
+            if len(self._writers) <= self._max_open_files and writer.last_write_time > deadline:
+                break
+            del self._writers[room_id]
+            self._close_writer(writer)
+
+    @staticmethod
+    def _close_writer(writer: _SegmentWriter):
+        try:
+            writer.close()
+        except OSError:
+            logger.exception('FrameRecorder close failed:')
+
+    def _flush_files(self):
+        for writer in self._writers.values():
+            writer.flush()
+        self._close_idle_writers()
+
+    def _close_files(self):
+        for writer in self._writers.values():
+            self._close_writer(writer)
+        self._writers.clear()
+
+
+def iter_frames(path: str) -> Iterator[RecordedFrame]:
+    """
+    读一个分段文件里的所有帧。文件末尾不完整的帧（例如进程崩溃时没写完）会被忽略
+
+    :param path: 分段文件路径
+    """
+    with open(path, 'rb') as f:
+        header = f.read(FILE_HEADER_STRUCT.size)
+        if len(header) < FILE_HEADER_STRUCT.size:
+            logger.warning('recording file %s has no header', path)
+            return
+        magic, version, wall_time_ns, monotonic_ns = FILE_HEADER_STRUCT.unpack(header)
+        if magic != FILE_MAGIC:
+            raise ValueError(f'{path} is not a blivedm recording file')
+        if version != FILE_VERSION:
+            raise ValueError(f'{path} has unsupported version {version}')
+        wall_offset_ns = wall_time_ns - monotonic_ns
+
+        while True:
+            frame_header = f.read(FRAME_HEADER_STRUCT.size)
+            if not frame_header:
+                break
+            if len(frame_header) < FRAME_HEADER_STRUCT.size:
+                logger.warning('recording file %s is truncated', path)
+                break
+            timestamp_ns, room_id, size = FRAME_HEADER_STRUCT.unpack(frame_header)
+            data = f.read(size)
+            if len(data) < size:
+                logger.warning('recording file %s is truncated', path)
+                break
+            yield RecordedFrame(room_id, timestamp_ns, timestamp_ns + wall_offset_ns, data)
+
+
+def get_segment_paths(directory: str, room_id: int) -> List[str]:
+    """
+    一个房间所有分段文件的路径，按录制顺序排序
+
+    :param directory: 录制文件的根目录
+    :param room_id: 房间ID
+    """
+    room_directory = os.path.join(directory, str(room_id))
+    try:
+        names = os.listdir(room_directory)
+    except FileNotFoundError:
+        return []
+
+    def sort_key(name: str):
+        # 文件名是{room_id}-{毫秒时间戳}-{序号}.blrec
+        _room_id, timestamp, index = name[:-len(SEGMENT_SUFFIX)].split('-')
+        return int(timestamp), int(index)
+
+    names = [name for name in names if name.endswith(SEGMENT_SUFFIX)]
+    names.sort(key=sort_key)
+    return [os.path.join(room_directory, name) for name in names]
+
+
+def iter_room_frames(directory: str, room_id: int) -> Iterator[RecordedFrame]:
+    """
+    按录制顺序读一个房间的所有帧
+
+    :param directory: 录制文件的根目录
+    :param room_id: 房间ID
+    """
+    for path in get_segment_paths(directory, room_id):
+        yield from iter_frames(path)
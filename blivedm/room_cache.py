@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import concurrent.futures
+import json
+import logging
+import sqlite3
+import time
+from typing import *
+
+__all__ = (
+    'RoomInitCache',
+)
+
+logger = logging.getLogger('blivedm')
+
+ROOM_INIT_TABLE = 'room_init'
+"""构造时的房间ID -> 真实房间ID、主播用户ID"""
+DANMAKU_SERVER_CONF_TABLE = 'danmaku_server_conf'
+"""真实房间ID -> 弹幕服务器列表、token"""
+_TABLES = (ROOM_INIT_TABLE, DANMAKU_SERVER_CONF_TABLE)
+
+
+class _Entry(NamedTuple):
+    data: dict
+    update_time: float
+    """写入时的time.time()"""
+
+
+class RoomInitCache:
+    """
+    持久化的房间初始化结果缓存，用sqlite保存，重启后客户端可以直接用缓存的值连接，不用等接口请求
+
+    构造时同步读取整个文件到内存，之后读取都在内存，写入会攒一批后在专用的线程写到文件。
+    可以被多个客户端共享，用客户端的set_room_init_cache设置。注意不是线程安全的，所有使用同一个缓存的客户端要运行在同一个事件循环
+
+    :param path: sqlite文件路径
+    :param room_init_ttl: 房间ID、主播用户ID缓存多少秒内可以使用
+    :param room_init_refresh_age: 使用的房间ID缓存超过多少秒则在后台刷新
+    :param danmaku_server_conf_ttl: 弹幕服务器列表、token缓存多少秒内可以使用
+    :param danmaku_server_conf_refresh_age: 使用的弹幕服务器缓存超过多少秒则在后台刷新
+    :param flush_interval: 写入最多攒多少秒就写到文件
+    :param max_concurrent_refreshes: 最多同时有多少个客户端在后台刷新，避免重启后同时请求太多接口被限流
+    """
+
+    def __init__(
+        self,
+        path: str,
+        *,
+        room_init_ttl: float = 30 * 24 * 3600.0,
+        room_init_refresh_age: float = 24 * 3600.0,
+        danmaku_server_conf_ttl: float = 6 * 3600.0,
+        danmaku_server_conf_refresh_age: float = 1800.0,
+        flush_interval: float = 1.0,
+        max_concurrent_refreshes: int = 10,
+    ):
+        self._path = path
+        self._ttls = {
+            ROOM_INIT_TABLE: room_init_ttl,
+            DANMAKU_SERVER_CONF_TABLE: danmaku_server_conf_ttl,
+        }
+        self._refresh_ages = {
+            ROOM_INIT_TABLE: room_init_refresh_age,
+            DANMAKU_SERVER_CONF_TABLE: danmaku_server_conf_refresh_age,
+        }
+        self._flush_interval = flush_interval
+        self._max_concurrent_refreshes = max_concurrent_refreshes
+        self._refresh_semaphore: Optional[asyncio.Semaphore] = None
+
+        self._executor = concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix='blivedm-room-cache')
+        """写入线程，sqlite连接只在这个线程使用"""
+        self._conn: Optional[sqlite3.Connection] = None
+        self._entries: Dict[str, Dict[int, _Entry]] = {table: {} for table in _TABLES}
+        """表名 -> 键 -> 缓存项"""
+        self._pending: Dict[str, Dict[int, Optional[_Entry]]] = {table: {} for table in _TABLES}
+        """表名 -> 键 -> 还没写到文件的缓存项，None表示删除"""
+        self._flush_timer_handle: Optional[asyncio.TimerHandle] = None
+        self._write_futures: Set[asyncio.Future] = set()
+        self._closed = False
+
+        # 统计
+        self._hits = 0
+        self._misses = 0
+
+        self._executor.submit(self._open).result()
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    @property
+    def stats(self) -> dict:
+        return {
+            'room_init_entries': len(self._entries[ROOM_INIT_TABLE]),
+            'danmaku_server_conf_entries': len(self._entries[DANMAKU_SERVER_CONF_TABLE]),
+            'hits': self._hits,
+            'misses': self._misses,
+        }
+
+    @property
+    def refresh_semaphore(self) -> asyncio.Semaphore:
+        """
+        客户端在后台刷新缓存时要先获取这个信号量
+        """
+        if self._refresh_semaphore is None:
+            self._refresh_semaphore = asyncio.Semaphore(self._max_concurrent_refreshes)
+        return self._refresh_semaphore
+
+    def _open(self):
+        """
+        在写入线程执行
+        """
+        self._conn = sqlite3.connect(self._path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        now = time.time()
+        for table in _TABLES:
+            self._conn.execute(
+                f'CREATE TABLE IF NOT EXISTS {table} (key INTEGER PRIMARY KEY, data TEXT NOT NULL, '
+                f'update_time REAL NOT NULL)'
+            )
+            # 顺便删除过期太久的
+            self._conn.execute(f'DELETE FROM {table} WHERE update_time < ?', (now - self._ttls[table],))
+            entries = self._entries[table]
+            for key, data, update_time in self._conn.execute(f'SELECT key, data, update_time FROM {table}'):
+                try:
+                    entries[key] = _Entry(json.loads(data), update_time)
+                except ValueError:
+                    logger.warning('RoomInitCache invalid entry, table=%s, key=%d', table, key)
+        self._conn.commit()
+
+    def _get(self, table: str, key: int) -> Tuple[Optional[dict], bool]:
+        """
+        :return: (数据, 是否需要刷新)，没有缓存或者过期了则数据为None
+        """
+        entry = self._entries[table].get(key, None)
+        if entry is None:
+            self._misses += 1
+            return None, True
+        age = time.time() - entry.update_time
+        if age > self._ttls[table]:
+            self._misses += 1
+            return None, True
+        self._hits += 1
+        return entry.data, age > self._refresh_ages[table]
+
+    def _set(self, table: str, key: int, data: Optional[dict]):
+        if self._closed:
+            return
+        if data is None:
+            self._entries[table].pop(key, None)
+            self._pending[table][key] = None
+        else:
+            entry = self._entries[table][key] = _Entry(data, time.time())
+            self._pending[table][key] = entry
+        if self._flush_timer_handle is None:
+            self._flush_timer_handle = asyncio.get_running_loop().call_later(
+                self._flush_interval, self._submit_pending
+            )
+
+    def get_room_init(self, tmp_room_id: int) -> Tuple[Optional[dict], bool]:
+        """
+        :param tmp_room_id: 构造客户端时的房间ID，可以是短ID
+        :return: ({'room_id', 'room_owner_uid'}, 是否需要刷新)，没有缓存或者过期了则为(None, True)
+        """
+        return self._get(ROOM_INIT_TABLE, tmp_room_id)
+
+    def set_room_init(self, tmp_room_id: int, room_id: int, room_owner_uid: int):
+        self._set(ROOM_INIT_TABLE, tmp_room_id, {'room_id': room_id, 'room_owner_uid': room_owner_uid})
+
+    def get_danmaku_server_conf(self, room_id: int) -> Tuple[Optional[dict], bool]:
+        """
+        :param room_id: 真实房间ID
+        :return: ({'host_server_list', 'host_server_token'}, 是否需要刷新)，没有缓存或者过期了则为(None, True)
+        """
+        return self._get(DANMAKU_SERVER_CONF_TABLE, room_id)
+
+    def set_danmaku_server_conf(self, room_id: int, host_server_list: List[dict], host_server_token: Optional[str]):
+        self._set(DANMAKU_SERVER_CONF_TABLE, room_id, {
+            'host_server_list': host_server_list,
+            'host_server_token': host_server_token,
+        })
+
+    def invalidate_danmaku_server_conf(self, room_id: int):
+        """
+        删除弹幕服务器缓存，例如token认证失败时
+        """
+        self._set(DANMAKU_SERVER_CONF_TABLE, room_id, None)
+
+    async def flush(self):
+        """
+        把还没写的数据写到文件，等待写完
+        """
+        self._submit_pending()
+        if self._write_futures:
+            await asyncio.gather(*self._write_futures, return_exceptions=True)
+
+    async def close(self):
+        """
+        写完剩下的数据并关闭文件，调用后不再写入
+        """
+        if self._closed:
+            return
+        await self.flush()
+        self._closed = True
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._close_conn)
+        self._executor.shutdown(wait=False)
+
+    def _submit_pending(self):
+        if self._flush_timer_handle is not None:
+            self._flush_timer_handle.cancel()
+            self._flush_timer_handle = None
+        batch = {table: pending for table, pending in self._pending.items() if pending}
+        if not batch:
+            return
+        self._pending = {table: {} for table in _TABLES}
+
+        future = asyncio.get_running_loop().run_in_executor(self._executor, self._write_batch, batch)
+        self._write_futures.add(future)
+        future.add_done_callback(self._on_batch_written)
+
+    def _on_batch_written(self, future: asyncio.Future):
+        self._write_futures.discard(future)
+        if future.exception() is not None:
+            logger.error('RoomInitCache write failed:', exc_info=future.exception())
+
+    def _write_batch(self, batch: Dict[str, Dict[int, Optional[_Entry]]]):
+        """
+        在写入线程执行
+        """
+        with self._conn:
+            for table, pending in batch.items():
+                self._conn.executemany(
+                    f'DELETE FROM {table} WHERE key = ?',
+                    [(key,) for key, entry in pending.items() if entry is None]
+                )
+                self._conn.executemany(
+                    f'INSERT OR REPLACE INTO {table} (key, data, update_time) VALUES (?, ?, ?)',
+                    [
+                        (key, json.dumps(entry.data, ensure_ascii=False), entry.update_time)
+                        for key, entry in pending.items() if entry is not None
+                    ]
+                )
+
+    def _close_conn(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
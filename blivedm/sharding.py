@@ -0,0 +1,580 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import collections
+import logging
+import multiprocessing
+import multiprocessing.context
+import multiprocessing.process
+import signal
+import threading
+import time
+from typing import *
+
+from . import handlers, pool as pool_, utils
+from .clients import ws_base
+
+__all__ = (
+    'ShardedSupervisor',
+)
+
+logger = logging.getLogger('blivedm')
+
+HandlerFactory = Callable[[], handlers.HandlerInterface]
+EventCallback = Callable[[int, dict], Any]
+
+DEFAULT_RESTART_POLICY = utils.make_exponential_retry_policy(1, 60)
+_RESTART_RESET_TIME = 60.0
+"""工作进程运行超过这么多秒后才退出，连续重启次数从头算"""
+
+# 父进程 -> 工作进程的命令
+_CMD_ADD_ROOMS = 'add'
+_CMD_REMOVE_ROOMS = 'remove'
+_CMD_STOP = 'stop'
+
+# 工作进程 -> 父进程的消息
+_MSG_EVENTS = 'events'
+_MSG_STATS = 'stats'
+
+_EVENT_FLUSH_INTERVAL = 0.05
+"""工作进程最多攒多少秒的事件再发给父进程"""
+_EVENT_FLUSH_SIZE = 256
+"""工作进程攒够多少条事件立即发给父进程"""
+
+
+class _ForwardingHandler(handlers.HandlerInterface):
+    """
+    工作进程里包装用户的消息处理器，统计每个房间的消息数，并且把消息转发给父进程
+    """
+
+    def __init__(self, runner: '_WorkerRunner', handler: handlers.HandlerInterface):
+        self._runner = runner
+        self._handler = handler
+        self._handler_supports_batch = (
+            type(handler).handle_batch is not handlers.HandlerInterface.handle_batch
+        )
+
+    def handle(self, client: ws_base.WebSocketClientBase, command: dict):
+        self._runner.on_commands(client, (command,))
+        self._handler.handle(client, command)
+
+    def handle_batch(self, client: ws_base.WebSocketClientBase, commands: List[dict]):
+        self._runner.on_commands(client, commands)
+        if self._handler_supports_batch:
+            self._handler.handle_batch(client, commands)
+            return
+        for command in commands:
+            try:
+                self._handler.handle(client, command)
+            except Exception:  # noqa
+                logger.exception('room=%d handle() failed, command=%s', client.room_id, command)
+
+    def get_wanted_cmds(self) -> Optional[AbstractSet[str]]:
+        if self._runner.forward_events:
+            # 父进程要收到所有消息
+            return None
+        return self._handler.get_wanted_cmds()
+
+    def get_message_types(self) -> Optional[Mapping[str, Tuple[Callable[[Any], Any], str]]]:
+        return self._handler.get_message_types()
+
+    def on_client_stopped(self, client: ws_base.WebSocketClientBase, exception: Optional[Exception]):
+        self._handler.on_client_stopped(client, exception)
+
+
+class _WorkerRunner:
+    """
+    工作进程里的事件循环，用一个RoomPool运行分配到的房间
+    """
+
+    def __init__(
+        self,
+        worker_id: int,
+        handler_factory: HandlerFactory,
+        client_factory: Optional[pool_.ClientFactory],
+        command_queue: multiprocessing.Queue,
+        event_queue: multiprocessing.Queue,
+        forward_events: bool,
+        report_interval: float,
+    ):
+        self._worker_id = worker_id
+        self._handler_factory = handler_factory
+        self._client_factory = client_factory
+        self._command_queue = command_queue
+        self._event_queue = event_queue
+        self.forward_events = forward_events
+        self._report_interval = report_interval
+
+        self._pool: Optional[pool_.RoomPool] = None
+        self._client_to_room_key: Dict[ws_base.WebSocketClientBase, int] = {}
+        """客户端 -> 父进程分配的room_id"""
+        self._message_counts: DefaultDict[int, int] = collections.defaultdict(int)
+        """上次报告以来每个房间的消息数"""
+        self._pending_events: List[Tuple[int, dict]] = []
+        self._flush_timer_handle: Optional[asyncio.TimerHandle] = None
+        self._stop_event: Optional[asyncio.Event] = None
+
+    async def run(self):
+        self._stop_event = asyncio.Event()
+        handler = _ForwardingHandler(self, self._handler_factory())
+        self._pool = pool_.RoomPool(handler, client_factory=self._client_factory)
+        command_task = asyncio.create_task(self._read_commands())
+        report_task = asyncio.create_task(self._report_stats())
+        try:
+            await self._stop_event.wait()
+        finally:
+            command_task.cancel()
+            report_task.cancel()
+            await self._pool.close()
+            self._flush_events()
+
+    async def _read_commands(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            # 阻塞读队列，放到线程里
+            cmd, *args = await loop.run_in_executor(None, self._command_queue.get)
+            if cmd == _CMD_ADD_ROOMS:
+                for room_key in args[0]:
+                    client = self._pool.add_room(room_key)
+                    self._client_to_room_key[client] = room_key
+            elif cmd == _CMD_REMOVE_ROOMS:
+                for room_key in args[0]:
+                    client = self._pool.get_client(room_key)
+                    if client is not None:
+                        self._client_to_room_key.pop(client, None)
+                    self._message_counts.pop(room_key, None)
+                    await self._pool.remove_room(room_key)
+            elif cmd == _CMD_STOP:
+                self._stop_event.set()
+                return
+
+    async def _report_stats(self):
+        last_report_time = time.monotonic()
+        while True:
+            await asyncio.sleep(self._report_interval)
+            now = time.monotonic()
+            elapsed = max(now - last_report_time, 1e-6)
+            last_report_time = now
+
+            # 每个房间每秒消息数，没有消息的房间也要报告，父进程才知道房间在这个进程
+            rates = {room_key: 0.0 for room_key in self._pool.room_ids}
+            for room_key, count in self._message_counts.items():
+                rates[room_key] = count / elapsed
+            self._message_counts.clear()
+            self._event_queue.put((_MSG_STATS, self._worker_id, rates, self._pool.status))
+
+    def on_commands(self, client: ws_base.WebSocketClientBase, commands: Sequence[dict]):
+        room_key = self._client_to_room_key.get(client, None)
+        if room_key is None:
+            return
+        self._message_counts[room_key] += len(commands)
+        if not self.forward_events:
+            return
+
+        self._pending_events.extend((room_key, command) for command in commands)
+        if len(self._pending_events) >= _EVENT_FLUSH_SIZE:
+            self._flush_events()
+        elif self._flush_timer_handle is None:
+            self._flush_timer_handle = asyncio.get_running_loop().call_later(
+                _EVENT_FLUSH_INTERVAL, self._flush_events
+            )
+
+    def _flush_events(self):
+        if self._flush_timer_handle is not None:
+            self._flush_timer_handle.cancel()
+            self._flush_timer_handle = None
+        if not self._pending_events:
+            return
+        # 一批一次pickle，减少进程间通信的开销
+        events, self._pending_events = self._pending_events, []
+        self._event_queue.put((_MSG_EVENTS, self._worker_id, events))
+
+
+def _worker_main(
+    worker_id: int,
+    handler_factory: HandlerFactory,
+    client_factory: Optional[pool_.ClientFactory],
+    command_queue: multiprocessing.Queue,
+    event_queue: multiprocessing.Queue,
+    forward_events: bool,
+    report_interval: float,
+):
+    # Ctrl+C由父进程处理，父进程会通知工作进程停止
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    runner = _WorkerRunner(
+        worker_id, handler_factory, client_factory, command_queue, event_queue, forward_events, report_interval
+    )
+    asyncio.run(runner.run())
+
+
+class _Worker:
+    """
+    父进程里记录的工作进程状态
+    """
+
+    def __init__(self, worker_id: int):
+        self.worker_id = worker_id
+        self.process: Optional[multiprocessing.process.BaseProcess] = None
+        self.command_queue: Optional[multiprocessing.Queue] = None
+        self.room_keys: Set[int] = set()
+        """分配到这个进程的room_id"""
+        self.room_rates: Dict[int, float] = {}
+        """最近报告的每个房间每秒消息数"""
+        self.pool_status: Dict[str, int] = {}
+        """最近报告的RoomPool.status"""
+        self.restart_count = 0
+        """总重启次数"""
+        self.retry_count = 0
+        """连续重启次数，运行超过_RESTART_RESET_TIME秒后清零"""
+        self.start_time = 0.0
+        """上次启动的time.monotonic()"""
+        self.restart_timer_handle: Optional[asyncio.TimerHandle] = None
+        """等待重启的定时器"""
+        self.gave_up = False
+        """连续重启次数达到上限，不再重启"""
+
+    @property
+    def is_available(self) -> bool:
+        """
+        进程在运行，可以分配房间
+        """
+        return self.process is not None and self.process.is_alive() and self.restart_timer_handle is None
+
+    @property
+    def load(self) -> float:
+        return sum(self.room_rates.get(room_key, 0.0) for room_key in self.room_keys)
+
+
+class ShardedSupervisor:
+    """
+    把房间分到多个工作进程，每个工作进程有自己的事件循环和RoomPool
+
+    工作进程退出时把它的房间重新分配到其他进程，按restart_policy等待一段时间后重启，连续重启max_restarts次后不再重启；
+    某个进程的消息量远高于平均时，会把它最热的房间移到最闲的进程
+
+    :param handler_factory: 在工作进程里创建消息处理器的函数，每个工作进程调用一次，必须可以pickle（模块级的函数或类）
+    :param num_workers: 工作进程数，None表示CPU核数
+    :param client_factory: 在工作进程里创建客户端的函数，输入(room_id, session)，默认创建BLiveClient，必须可以pickle
+    :param event_callback: 在父进程接收所有消息的回调，输入(room_id, command)，None表示不把消息发给父进程
+    :param mp_context: multiprocessing的上下文，None表示默认的
+    :param report_interval: 工作进程报告统计信息、父进程检查负载的间隔（秒）
+    :param hot_ratio: 一个进程的消息量超过平均的多少倍时重新分配房间
+    :param max_moves_per_rebalance: 每次重新分配最多移动多少个房间，移动房间会导致短暂断线
+    :param restart_policy: 重启工作进程的间隔，输入(连续重启次数, 总重启次数)，None表示指数增长，最长60秒
+    :param max_restarts: 最多连续重启多少次，None表示不限制
+    """
+
+    def __init__(
+        self,
+        handler_factory: HandlerFactory,
+        *,
+        num_workers: Optional[int] = None,
+        client_factory: Optional[pool_.ClientFactory] = None,
+        event_callback: Optional[EventCallback] = None,
+        mp_context: Optional[multiprocessing.context.BaseContext] = None,
+        report_interval: float = 5.0,
+        hot_ratio: float = 2.0,
+        max_moves_per_rebalance: int = 10,
+        restart_policy: Optional[Callable[[int, int], float]] = None,
+        max_restarts: Optional[int] = 10,
+    ):
+        self._handler_factory = handler_factory
+        self._client_factory = client_factory
+        self._event_callback = event_callback
+        self._mp_context = mp_context if mp_context is not None else multiprocessing.get_context()
+        self._report_interval = report_interval
+        self._hot_ratio = hot_ratio
+        self._max_moves_per_rebalance = max_moves_per_rebalance
+        self._restart_policy = restart_policy if restart_policy is not None else DEFAULT_RESTART_POLICY
+        self._max_restarts = max_restarts
+
+        if num_workers is None:
+            num_workers = multiprocessing.cpu_count()
+        self._workers = [_Worker(i) for i in range(max(1, num_workers))]
+        self._room_key_to_worker: Dict[int, _Worker] = {}
+        """room_id -> 分配到的工作进程"""
+
+        self._event_queue: Optional[multiprocessing.Queue] = None
+        self._event_thread: Optional[threading.Thread] = None
+        self._monitor_task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stopping = False
+
+    @property
+    def is_running(self) -> bool:
+        return self._monitor_task is not None
+
+    @property
+    def room_ids(self) -> List[int]:
+        return list(self._room_key_to_worker)
+
+    @property
+    def status(self) -> dict:
+        """
+        每个工作进程的状态和所有房间状态的汇总，房间状态来自工作进程最近一次报告
+        """
+        total: DefaultDict[str, int] = collections.defaultdict(int)
+        workers = []
+        for worker in self._workers:
+            for key, value in worker.pool_status.items():
+                total[key] += value
+            workers.append({
+                'worker_id': worker.worker_id,
+                'alive': worker.process is not None and worker.process.is_alive(),
+                'rooms': len(worker.room_keys),
+                'load': worker.load,
+                'restart_count': worker.restart_count,
+                'gave_up': worker.gave_up,
+            })
+        return {'rooms': dict(total), 'workers': workers}
+
+    def start(self):
+        """
+        启动工作进程
+        """
+        if self.is_running:
+            logger.warning('ShardedSupervisor is running, cannot start() again')
+            return
+        self._loop = asyncio.get_running_loop()
+        self._stopping = False
+        self._event_queue = self._mp_context.Queue()
+        for worker in self._workers:
+            worker.retry_count = 0
+            worker.gave_up = False
+            self._start_worker(worker)
+
+        self._event_thread = threading.Thread(
+            target=self._read_worker_messages, args=(self._event_queue,),
+            name='blivedm-supervisor', daemon=True
+        )
+        self._event_thread.start()
+        self._monitor_task = asyncio.create_task(self._monitor())
+
+    async def join(self):
+        """
+        等待停止
+        """
+        if not self.is_running:
+            logger.warning('ShardedSupervisor is stopped, cannot join()')
+            return
+        await asyncio.shield(self._monitor_task)
+
+    async def stop(self, timeout: float = 10.0):
+        """
+        停止所有工作进程
+
+        :param timeout: 等待工作进程退出的时间（秒），超时则强制结束
+        """
+        if not self.is_running:
+            logger.warning('ShardedSupervisor is stopped, cannot stop() again')
+            return
+        self._stopping = True
+        self._monitor_task.cancel()
+        await asyncio.gather(self._monitor_task, return_exceptions=True)
+        self._monitor_task = None
+
+        for worker in self._workers:
+            if worker.restart_timer_handle is not None:
+                worker.restart_timer_handle.cancel()
+                worker.restart_timer_handle = None
+            if worker.command_queue is not None:
+                worker.command_queue.put((_CMD_STOP,))
+        await asyncio.gather(*(
+            self._stop_worker(worker, timeout) for worker in self._workers if worker.process is not None
+        ))
+
+        # 让读线程退出
+        self._event_queue.put(None)
+        await self._loop.run_in_executor(None, self._event_thread.join)
+        self._event_queue.close()
+        self._event_queue = None
+        self._event_thread = None
+
+    def add_room(self, room_id: int):
+        """
+        添加一个房间，分配到房间数最少的工作进程
+
+        :param room_id: 传给client_factory的room_id
+        """
+        if room_id in self._room_key_to_worker:
+            return
+        # 没启动或者都在等待重启时先分到一个进程，进程启动时会发过去
+        workers = [worker for worker in self._workers if worker.is_available]
+        if not workers:
+            workers = [worker for worker in self._workers if not worker.gave_up] or self._workers
+        worker = min(workers, key=lambda w: len(w.room_keys))
+        self._assign_rooms(worker, [room_id])
+
+    def add_rooms(self, room_ids: Iterable[int]):
+        for room_id in room_ids:
+            self.add_room(room_id)
+
+    def remove_room(self, room_id: int):
+        """
+        移除一个房间
+        """
+        worker = self._room_key_to_worker.pop(room_id, None)
+        if worker is None:
+            return
+        worker.room_keys.discard(room_id)
+        worker.room_rates.pop(room_id, None)
+        if self.is_running and worker.command_queue is not None:
+            worker.command_queue.put((_CMD_REMOVE_ROOMS, [room_id]))
+
+    def _assign_rooms(self, worker: _Worker, room_keys: List[int]):
+        for room_key in room_keys:
+            self._room_key_to_worker[room_key] = worker
+            worker.room_keys.add(room_key)
+        if self.is_running and worker.command_queue is not None:
+            worker.command_queue.put((_CMD_ADD_ROOMS, room_keys))
+
+    def _start_worker(self, worker: _Worker):
+        worker.command_queue = self._mp_context.Queue()
+        worker.process = self._mp_context.Process(
+            target=_worker_main,
+            args=(
+                worker.worker_id, self._handler_factory, self._client_factory, worker.command_queue,
+                self._event_queue, self._event_callback is not None, self._report_interval
+            ),
+            name=f'blivedm-worker-{worker.worker_id}',
+            daemon=True,
+        )
+        worker.process.start()
+        worker.start_time = time.monotonic()
+        worker.room_rates.clear()
+        worker.pool_status = {}
+        if worker.room_keys:
+            worker.command_queue.put((_CMD_ADD_ROOMS, list(worker.room_keys)))
+
+    async def _stop_worker(self, worker: _Worker, timeout: float):
+        process = worker.process
+        await self._loop.run_in_executor(None, process.join, timeout)
+        if process.is_alive():
+            logger.warning('worker %d did not exit in %.1fs, terminating', worker.worker_id, timeout)
+            process.terminate()
+            await self._loop.run_in_executor(None, process.join)
+        if worker.command_queue is not None:
+            worker.command_queue.close()
+            worker.command_queue = None
+        worker.process = None
+
+    async def _monitor(self):
+        while True:
+            await asyncio.sleep(self._report_interval)
+            try:
+                self._restart_dead_workers()
+                self._rebalance_hot_worker()
+            except Exception:  # noqa
+                logger.exception('ShardedSupervisor monitor failed:')
+
+    def _restart_dead_workers(self):
+        for worker in self._workers:
+            if worker.gave_up or worker.restart_timer_handle is not None or worker.process.is_alive():
+                continue
+            exitcode = worker.process.exitcode
+            worker.command_queue.close()
+            worker.command_queue = None
+            worker.room_rates.clear()
+            worker.pool_status = {}
+
+            if time.monotonic() - worker.start_time >= _RESTART_RESET_TIME:
+                worker.retry_count = 0
+            worker.retry_count += 1
+            if self._max_restarts is not None and worker.retry_count > self._max_restarts:
+                logger.error('worker %d exited with code %s, restarted %d times in a row, giving up',
+                             worker.worker_id, exitcode, self._max_restarts)
+                worker.gave_up = True
+            else:
+                interval = self._restart_policy(worker.retry_count, worker.restart_count + 1)
+                logger.warning('worker %d exited with code %s, restarting in %.1fs', worker.worker_id, exitcode,
+                               interval)
+                worker.restart_timer_handle = self._loop.call_later(interval, self._restart_worker, worker)
+
+            # 等待重启时把它的房间分配到其他进程，没有其他进程的话留着，重启时发过去
+            if any(other_worker.is_available for other_worker in self._workers):
+                self._reassign_rooms(worker)
+
+    def _restart_worker(self, worker: _Worker):
+        worker.restart_timer_handle = None
+        worker.restart_count += 1
+        self._start_worker(worker)
+
+        # 放弃重启的进程留下的房间
+        for other_worker in self._workers:
+            if other_worker.gave_up and other_worker.room_keys:
+                self._reassign_rooms(other_worker)
+
+    def _reassign_rooms(self, worker: _Worker):
+        orphan_room_keys, worker.room_keys = list(worker.room_keys), set()
+        for room_key in orphan_room_keys:
+            del self._room_key_to_worker[room_key]
+        self.add_rooms(orphan_room_keys)
+
+    def _rebalance_hot_worker(self):
+        workers = [worker for worker in self._workers if worker.is_available]
+        if len(workers) < 2:
+            return
+        loads = {worker: worker.load for worker in workers}
+        mean_load = sum(loads.values()) / len(loads)
+        hot_worker = max(workers, key=loads.__getitem__)
+        if mean_load <= 0 or loads[hot_worker] <= mean_load * self._hot_ratio:
+            return
+        cold_worker = min(workers, key=loads.__getitem__)
+
+        # 从最热的房间开始，移动后不会让冷进程比热进程还热的才移动
+        hot_load = loads[hot_worker]
+        cold_load = loads[cold_worker]
+        moved = []
+        for room_key in sorted(hot_worker.room_keys, key=lambda k: hot_worker.room_rates.get(k, 0.0), reverse=True):
+            if len(moved) >= self._max_moves_per_rebalance:
+                break
+            rate = hot_worker.room_rates.get(room_key, 0.0)
+            if rate <= 0 or cold_load + rate >= hot_load - rate:
+                continue
+            moved.append(room_key)
+            hot_load -= rate
+            cold_load += rate
+        if not moved:
+            return
+
+        logger.info('moving %d rooms from worker %d (load=%.1f) to worker %d (load=%.1f)', len(moved),
+                    hot_worker.worker_id, loads[hot_worker], cold_worker.worker_id, loads[cold_worker])
+        hot_worker.command_queue.put((_CMD_REMOVE_ROOMS, moved))
+        for room_key in moved:
+            hot_worker.room_keys.discard(room_key)
+            cold_worker.room_rates[room_key] = hot_worker.room_rates.pop(room_key, 0.0)
+        self._assign_rooms(cold_worker, moved)
+
+    def _read_worker_messages(self, event_queue: multiprocessing.Queue):
+        """
+        在单独的线程里读工作进程发来的消息，转到事件循环线程处理
+        """
+        while True:
+            try:
+                msg = event_queue.get()
+            except (EOFError, OSError):
+                break
+            if msg is None:
+                break
+            try:
+                self._loop.call_soon_threadsafe(self._on_worker_message, msg)
+            except RuntimeError:
+                # 事件循环已关闭
+                break
+
+    def _on_worker_message(self, msg: tuple):
+        msg_type, worker_id, *args = msg
+        worker = self._workers[worker_id]
+        if msg_type == _MSG_EVENTS:
+            events: List[Tuple[int, dict]] = args[0]
+            for room_key, command in events:
+                try:
+                    self._event_callback(room_key, command)
+                except Exception:  # noqa
+                    logger.exception('room=%d event_callback() failed, command=%s', room_key, command)
+        elif msg_type == _MSG_STATS:
+            rates, pool_status = args
+            # 只保留仍然分配到这个进程的房间，刚移走的房间可能还在报告里
+            worker.room_rates = {
+                room_key: rate for room_key, rate in rates.items() if room_key in worker.room_keys
+            }
+            worker.pool_status = pool_status
@@ -1,4 +1,7 @@
 # -*- coding: utf-8 -*-
+import math
+import random
+
 USER_AGENT = (
       'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/123.0.0.0 Safari/537.36'
 )
@@ -17,3 +20,42 @@ def make_linear_retry_policy(start_interval: float, interval_step: float, max_in
             max_interval
         )
     return get_interval
+
+
+def make_exponential_retry_policy(start_interval: float, max_interval: float, factor: float = 2.0):
+    """
+    指数增长、带随机抖动的重连间隔，第n次重试的间隔在[上限 / 2, 上限]之间随机，上限是start_interval * factor ** (n - 1)
+
+    不保存状态，可以被多个客户端共享
+    """
+    # 超过这个次数后间隔就是max_interval，先比较次数，否则重试次数很大时幂运算会溢出
+    if max_interval > start_interval > 0 and factor > 1:
+        max_exponent = math.log(max_interval / start_interval, factor)
+    else:
+        max_exponent = 0.0
+
+    def get_interval(retry_count: int, _total_retry_count: int):
+        exponent = retry_count - 1
+        if exponent >= max_exponent:
+            interval = max_interval
+        else:
+            interval = min(start_interval * factor ** exponent, max_interval)
+        return random.uniform(interval / 2, interval)
+    return get_interval
+
+
+def make_decorrelated_jitter_retry_policy(start_interval: float, max_interval: float):
+    """
+    去相关抖动的重连间隔，每次的间隔在[start_interval, 上次间隔 * 3]之间随机。同时断线的客户端重连时间会很快错开
+
+    保存了上次的间隔，每个客户端要单独创建一个
+    """
+    last_interval = start_interval
+
+    def get_interval(retry_count: int, _total_retry_count: int):
+        nonlocal last_interval
+        if retry_count <= 1:
+            last_interval = start_interval
+        last_interval = min(random.uniform(start_interval, last_interval * 3), max_interval)
+        return last_interval
+    return get_interval
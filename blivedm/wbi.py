@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import hashlib
+import logging
+import time
+import urllib.parse
+from typing import *
+
+import aiohttp
+
+from . import utils
+
+__all__ = (
+    'WbiSigner',
+    'get_wbi_signer',
+)
+
+logger = logging.getLogger('blivedm')
+
+MIXIN_KEY_ENC_TAB = (
+    46, 47, 18, 2, 53, 8, 23, 32, 15, 50, 10, 31, 58, 3, 45, 35,
+    27, 43, 5, 49, 33, 9, 42, 19, 29, 28, 14, 39, 12, 38, 41, 13,
+    37, 48, 7, 16, 24, 55, 40, 61, 26, 17, 0, 1, 60, 51, 30, 4,
+    22, 25, 54, 21, 56, 59, 6, 63, 57, 62, 11, 36, 20, 34, 44, 52,
+)
+"""官方的WBI混淆表"""
+
+WBI_KEY_TTL = 24 * 3600.0
+"""img_key、sub_key每天更换一次"""
+WBI_KEY_FAILURE_TTL = 30.0
+"""获取密钥失败后多少秒内不再重试"""
+
+_FILTERED_CHARS = str.maketrans('', '', "!'()*")
+"""签名前要从参数值里去掉的字符"""
+
+
+def get_mixin_key(img_key: str, sub_key: str) -> str:
+    """
+    用img_key、sub_key计算签名用的混淆密钥
+    """
+    raw_key = img_key + sub_key
+    return ''.join(raw_key[i] for i in MIXIN_KEY_ENC_TAB)[:32]
+
+
+def _get_key_from_url(url: str) -> str:
+    # https://i0.hdslb.com/bfs/wbi/7cd084941338484aae1ad9425b84077c.png -> 7cd084941338484aae1ad9425b84077c
+    return url.rsplit('/', 1)[-1].split('.', 1)[0]
+
+
+class WbiSigner:
+    """
+    WBI签名，img_key、sub_key在进程内共享，过期后重新获取
+
+    同时只有一个协程在获取密钥，其他协程等待它的结果。混淆密钥只在密钥更换时计算一次
+
+    :param ttl: 密钥多少秒后重新获取
+    """
+
+    def __init__(self, ttl: float = WBI_KEY_TTL):
+        self._ttl = ttl
+        self._img_key = ''
+        self._sub_key = ''
+        self._mixin_key: Optional[str] = None
+        """签名用的混淆密钥，还没获取过密钥则为None"""
+        self._expire_time = 0.0
+        """time.monotonic()超过这个时间后要重新获取密钥"""
+        self._refresh_future: Optional[asyncio.Future] = None
+        """正在获取密钥的future，只属于创建它的事件循环"""
+
+    @property
+    def mixin_key(self) -> Optional[str]:
+        return self._mixin_key
+
+    @property
+    def is_expired(self) -> bool:
+        return self._mixin_key is None or time.monotonic() >= self._expire_time
+
+    def invalidate(self):
+        """
+        下一次签名前重新获取密钥，例如接口返回签名错误时
+        """
+        self._expire_time = 0.0
+
+    def update_keys(self, img_key: str, sub_key: str, ttl: Optional[float] = None):
+        """
+        设置密钥，例如从其他请求的nav响应里得到了密钥
+
+        :param img_key: img_key
+        :param sub_key: sub_key
+        :param ttl: 多少秒后过期，None表示默认值
+        """
+        if img_key != self._img_key or sub_key != self._sub_key or self._mixin_key is None:
+            self._img_key = img_key
+            self._sub_key = sub_key
+            self._mixin_key = get_mixin_key(img_key, sub_key)
+        self._expire_time = time.monotonic() + (self._ttl if ttl is None else ttl)
+
+    def update_keys_from_nav(self, nav_data: Optional[dict]) -> bool:
+        """
+        从nav接口响应的data设置密钥，未登录时nav也会返回密钥
+
+        :param nav_data: nav接口响应的data，可以是None或者没有wbi_img
+        :return: 是否成功
+        """
+        if not isinstance(nav_data, dict):
+            return False
+        try:
+            wbi_img = nav_data['wbi_img']
+            img_key = _get_key_from_url(wbi_img['img_url'])
+            sub_key = _get_key_from_url(wbi_img['sub_url'])
+        except (KeyError, TypeError, AttributeError):
+            return False
+        if img_key == '' or sub_key == '':
+            return False
+        self.update_keys(img_key, sub_key)
+        return True
+
+    async def ensure_keys(self, session: aiohttp.ClientSession, nav_url: str) -> Optional[str]:
+        """
+        确保密钥已经获取过并且没有过期
+
+        :param session: 请求nav用的session
+        :param nav_url: nav接口的URL
+        :return: 混淆密钥，从来没有获取成功则为None
+        """
+        if not self.is_expired:
+            return self._mixin_key
+
+        future = self._refresh_future
+        if future is None or future.get_loop() is not asyncio.get_running_loop():
+            future = self._refresh_future = asyncio.create_task(self._refresh(session, nav_url))
+            future.add_done_callback(self._on_refresh_done)
+        if self._mixin_key is not None:
+            # 过期了但是旧密钥一般还能用，在后台刷新
+            return self._mixin_key
+        await asyncio.shield(future)
+        return self._mixin_key
+
+    def _on_refresh_done(self, future: asyncio.Future):
+        if self._refresh_future is future:
+            self._refresh_future = None
+        if not future.cancelled() and future.exception() is not None:
+            logger.error('WbiSigner refresh failed:', exc_info=future.exception())
+
+    async def _refresh(self, session: aiohttp.ClientSession, nav_url: str):
+        if not await self._fetch_keys(session, nav_url):
+            # 失败了也不要每个房间都马上重试
+            self._expire_time = time.monotonic() + WBI_KEY_FAILURE_TTL
+
+    async def _fetch_keys(self, session: aiohttp.ClientSession, nav_url: str) -> bool:
+        try:
+            async with session.get(
+                nav_url,
+                headers={'User-Agent': utils.USER_AGENT, 'Referer': 'https://www.bilibili.com/'},
+            ) as res:
+                if res.status != 200:
+                    logger.warning('WbiSigner _fetch_keys() failed, status=%d, reason=%s', res.status, res.reason)
+                    return False
+                data = await res.json()
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+            logger.exception('WbiSigner _fetch_keys() failed:')
+            return False
+        except (aiohttp.ContentTypeError, ValueError):
+            logger.exception('WbiSigner _fetch_keys() failed to decode response:')
+            return False
+
+        if not isinstance(data, dict):
+            logger.warning('WbiSigner _fetch_keys() failed, unexpected response=%r', data)
+            return False
+        # 未登录时code是-101，但是也有密钥
+        if not self.update_keys_from_nav(data.get('data', None)):
+            logger.warning('WbiSigner _fetch_keys() failed, code=%s, message=%s', data.get('code', None),
+                           data.get('message', None))
+            return False
+        return True
+
+    @staticmethod
+    def sign(params: Dict[str, Any], mixin_key: str) -> Dict[str, Any]:
+        """
+        给请求参数签名
+
+        :param params: 请求参数，不会被修改
+        :param mixin_key: 混淆密钥
+        :return: 加上了wts、w_rid的新参数
+        """
+        signed = {key: str(value).translate(_FILTERED_CHARS) for key, value in params.items()}
+        signed['wts'] = str(int(time.time()))
+        query = urllib.parse.urlencode(sorted(signed.items()))
+        signed['w_rid'] = hashlib.md5((query + mixin_key).encode('utf-8')).hexdigest()
+        return signed
+
+    async def sign_params(
+        self, session: aiohttp.ClientSession, nav_url: str, params: Dict[str, Any]
+    ) -> Optional[Dict[str, Any]]:
+        """
+        获取密钥并给请求参数签名
+
+        :param session: 请求nav用的session
+        :param nav_url: nav接口的URL
+        :param params: 请求参数，不会被修改
+        :return: 加上了wts、w_rid的新参数，获取密钥失败则为None
+        """
+        mixin_key = await self.ensure_keys(session, nav_url)
+        if mixin_key is None:
+            return None
+        return self.sign(params, mixin_key)
+
+
+_default_signer: Optional[WbiSigner] = None
+
+
+def get_wbi_signer() -> WbiSigner:
+    """
+    获取进程内共享的WBI签名器
+    """
+    global _default_signer
+    if _default_signer is None:
+        _default_signer = WbiSigner()
+    return _default_signer
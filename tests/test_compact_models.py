@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+import dataclasses
+import pickle
+import unittest
+
+import blivedm
+from benchmarks import micro
+from blivedm.models import compact
+
+NAMESPACES = ('web', 'open_live', 'frozen_web', 'frozen_open_live')
+
+
+def _iter_variants():
+    """
+    :return: (命名空间名, 紧凑的消息类, 原来的消息类, 数据)的迭代器
+    """
+    for cmd, command in micro.get_model_commands().items():
+        callback = blivedm.BaseHandler._CMD_CALLBACK_DICT[cmd]  # noqa
+        message_cls = callback.message_cls
+        namespace_name = message_cls.__module__.rsplit('.', 1)[-1]
+        for prefix in ('', 'frozen_'):
+            compact_cls = getattr(getattr(compact, prefix + namespace_name), message_cls.__name__)
+            yield prefix + namespace_name, compact_cls, message_cls, command[callback.data_key]
+
+
+class CompactModelsTest(unittest.TestCase):
+    def test_slots(self):
+        for namespace_name in NAMESPACES:
+            for cls in vars(getattr(compact, namespace_name)).values():
+                with self.subTest(cls=cls.__qualname__):
+                    self.assertFalse(hasattr(cls(), '__dict__'))
+
+    def test_from_command_parity_and_pickle(self):
+        for namespace_name, compact_cls, message_cls, data in _iter_variants():
+            with self.subTest(cls=compact_cls.__qualname__):
+                message = compact_cls.from_command(data)
+                self.assertEqual(dataclasses.asdict(message), dataclasses.asdict(message_cls.from_command(data)))
+                self.assertEqual(pickle.loads(pickle.dumps(message)), message)
+
+    def test_frozen(self):
+        message = compact.frozen_web.GiftMessage()
+        with self.assertRaises(dataclasses.FrozenInstanceError):
+            message.num = 1  # noqa
+        message = compact.web.GiftMessage()
+        message.num = 1
+        self.assertEqual(message.num, 1)
+
+    def test_hash(self):
+        for namespace_name, compact_cls, message_cls, data in _iter_variants():
+            message = compact_cls.from_command(data)
+            with self.subTest(cls=compact_cls.__qualname__):
+                if compact_cls.__hash__ is None:
+                    with self.assertRaises(TypeError):
+                        hash(message)
+                else:
+                    self.assertEqual(hash(message), hash(compact_cls.from_command(data)))
+        self.assertIsNone(compact.frozen_web.DanmakuMessage.__hash__)
+        self.assertIsNotNone(compact.frozen_web.GiftMessage.__hash__)
+
+    def test_nested_models_rebound(self):
+        data = micro.get_model_commands()['LIVE_OPEN_PLATFORM_SEND_GIFT']['data']
+        for namespace_name in ('open_live', 'frozen_open_live'):
+            namespace = getattr(compact, namespace_name)
+            message = namespace.GiftMessage.from_command(data)
+            self.assertIs(type(message.anchor_info), namespace.AnchorInfo)
+            self.assertIs(type(message.combo_info), namespace.ComboInfo)
+            self.assertIs(type(namespace.GiftMessage().anchor_info), namespace.AnchorInfo)
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import unittest
+import unittest.mock
+import zlib
+
+import brotli
+
+import blivedm
+import blivedm.decompressor as dec
+from benchmarks import frames
+
+
+class _RecordingHandler(blivedm.HandlerInterface):
+    def __init__(self):
+        self.commands = []
+
+    def handle(self, client, command):
+        self.commands.append(command)
+
+
+class DefaultDecompressorTest(unittest.TestCase):
+    def test_per_loop(self):
+        async def get_decompressors():
+            return dec.get_default_decompressor(), dec.get_default_decompressor()
+
+        a1, a2 = asyncio.run(get_decompressors())
+        b1, _b2 = asyncio.run(get_decompressors())
+        self.assertIs(a1, a2)
+        self.assertIsNot(a1, b1)
+        a1.close()
+        b1.close()
+
+    def test_set_default(self):
+        async def set_and_get():
+            decompressor = dec.Decompressor()
+            dec.set_default_decompressor(decompressor)
+            self.assertIs(dec.get_default_decompressor(), decompressor)
+            dec.set_default_decompressor(None)
+            self.assertIsNot(dec.get_default_decompressor(), decompressor)
+            dec.get_default_decompressor().close()
+
+        asyncio.run(set_and_get())
+
+
+class DecompressorTest(unittest.IsolatedAsyncioTestCase):
+    async def test_inline_and_offload(self):
+        payload = frames.make_normal_payload(frames.make_commands(20))
+        body = brotli.compress(payload)
+
+        decompressor = dec.Decompressor(len(body) + 1)
+        self.addCleanup(decompressor.close)
+        self.assertEqual(await decompressor.decompress(brotli.decompress, body), payload)
+        self.assertEqual(decompressor.stats['inline_frames'], 1)
+
+        # 同一轮事件循环里的大包合并成一批
+        decompressor = dec.Decompressor(0)
+        self.addCleanup(decompressor.close)
+        results = await asyncio.gather(*(decompressor.decompress(brotli.decompress, body) for _ in range(3)))
+        self.assertEqual(results, [payload] * 3)
+        self.assertEqual(decompressor.stats['offloaded_frames'], 3)
+        self.assertEqual(decompressor.stats['batches'], 1)
+
+    async def test_offload_error(self):
+        decompressor = dec.Decompressor(0)
+        self.addCleanup(decompressor.close)
+        with self.assertRaises(brotli.error):
+            await decompressor.decompress(brotli.decompress, b'not brotli')
+
+    async def test_queue_full_falls_back_to_inline(self):
+        body = zlib.compress(b'x' * 1000)
+        decompressor = dec.Decompressor(0, max_batch_size=1, max_queued_batches=1)
+        self.addCleanup(decompressor.close)
+        results = await asyncio.gather(*(decompressor.decompress(zlib.decompress, body) for _ in range(3)))
+        self.assertEqual(results, [b'x' * 1000] * 3)
+        self.assertEqual(decompressor.stats['offloaded_frames'], 1)
+        self.assertEqual(decompressor.stats['inline_frames'], 2)
+
+    async def _record_samples(self, decompressor, inline_ns, inline_size, offload_ns, worker_ns):
+        with unittest.mock.patch('time.perf_counter_ns', side_effect=[0, inline_ns]):
+            decompressor._decompress_inline(bytes, b'x' * inline_size)  # noqa
+
+        executor_future = asyncio.get_running_loop().create_future()
+        executor_future.set_result(([b''], worker_ns))
+        decompressor._queued_batches += 1  # noqa
+        with unittest.mock.patch('time.perf_counter_ns', side_effect=[offload_ns]):
+            decompressor._on_batch_done(  # noqa
+                [(bytes, b'', asyncio.get_running_loop().create_future())], 0, executor_future
+            )
+
+    async def test_adaptive_threshold(self):
+        decompressor = dec.Decompressor()
+        self.addCleanup(decompressor.close)
+        self.assertEqual(decompressor.inline_threshold, dec.DEFAULT_INLINE_THRESHOLD)
+
+        # 直接解压每字节10ns，提交到线程池额外耗时80us，阈值是8000字节
+        await self._record_samples(decompressor, 1000, 100, 100_000, 20_000)
+        self.assertEqual(decompressor.inline_threshold, 8000)
+
+        # 按EWMA更新
+        await self._record_samples(decompressor, 1000, 100, 1_020_000, 20_000)
+        self.assertEqual(decompressor.inline_threshold, (80_000 + 0.1 * (1_000_000 - 80_000)) // 10)
+
+    async def test_adaptive_threshold_clamped(self):
+        decompressor = dec.Decompressor()
+        self.addCleanup(decompressor.close)
+        await self._record_samples(decompressor, 1_000_000, 1, 1000, 0)
+        self.assertEqual(decompressor.inline_threshold, dec.MIN_INLINE_THRESHOLD)
+
+        decompressor = dec.Decompressor()
+        self.addCleanup(decompressor.close)
+        await self._record_samples(decompressor, 1, 1000, 10 ** 12, 0)
+        self.assertEqual(decompressor.inline_threshold, dec.MAX_INLINE_THRESHOLD)
+
+    async def test_fixed_threshold(self):
+        decompressor = dec.Decompressor(1000)
+        self.addCleanup(decompressor.close)
+        await self._record_samples(decompressor, 1000, 100, 100_000, 20_000)
+        self.assertEqual(decompressor.inline_threshold, 1000)
+
+
+class CompressedFrameTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.client = blivedm.BLiveClient(1)
+        self.client._room_id = 1  # noqa
+        self.handler = _RecordingHandler()
+        self.client.set_handler(self.handler)
+
+    async def asyncTearDown(self):
+        await self.client.close()
+
+    async def test_round_trip(self):
+        commands = frames.make_commands(50)
+        for name, make_frame in (('brotli', frames.make_brotli_frame), ('deflate', frames.make_deflate_frame)):
+            for threshold in (1 << 30, 0):
+                with self.subTest(name=name, threshold=threshold):
+                    decompressor = dec.Decompressor(threshold)
+                    self.addCleanup(decompressor.close)
+                    self.client.set_decompressor(decompressor)
+                    self.handler.commands = []
+                    await self.client._parse_ws_message(make_frame(commands))  # noqa
+                    self.assertEqual(self.handler.commands, commands)
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+import unittest
+import unittest.mock
+
+import blivedm.dedup as dedup
+
+
+def _make_gift(tid):
+    return {'cmd': 'SEND_GIFT', 'data': {'tid': tid}}
+
+
+class GetMessageKeyTest(unittest.TestCase):
+    def test_key_getters(self):
+        danmaku = {'cmd': 'DANMU_MSG:4:0:2:2:2:0', 'info': [[0, 1, 25, 0xFFFFFF, 1700000000000, 12345], 'hello',
+                                                             [10086, 'name']]}
+        cases = [
+            (danmaku, ('DANMU_MSG', (1700000000000, 12345, 10086, 'hello'))),
+            (_make_gift('123'), ('SEND_GIFT', '123')),
+            ({'cmd': 'GUARD_BUY', 'data': {'uid': 1, 'gift_id': 10003, 'num': 1, 'start_time': 1700000000}},
+             ('GUARD_BUY', (1, 10003, 1, 1700000000))),
+            ({'cmd': 'SUPER_CHAT_MESSAGE', 'data': {'id': 42}}, ('SUPER_CHAT_MESSAGE', 42)),
+            ({'cmd': 'SUPER_CHAT_MESSAGE_DELETE', 'data': {'ids': [1, 2]}}, ('SUPER_CHAT_MESSAGE_DELETE', (1, 2))),
+            ({'cmd': 'LIVE_OPEN_PLATFORM_DM', 'data': {'msg_id': 'abc'}}, ('LIVE_OPEN_PLATFORM_DM', 'abc')),
+        ]
+        for command, expected in cases:
+            with self.subTest(cmd=command['cmd']):
+                self.assertEqual(dedup.get_message_key(command), expected)
+
+    def test_unkeyed(self):
+        cases = [
+            {'cmd': 'ONLINE_RANK_COUNT', 'data': {'count': 1}},
+            {'cmd': 'LIVE_OPEN_PLATFORM_DM', 'data': {'msg_id': ''}},
+            {'cmd': 'SEND_GIFT', 'data': {}},
+            {'cmd': 'DANMU_MSG', 'info': []},
+            {'data': {}},
+        ]
+        for command in cases:
+            with self.subTest(command=command):
+                self.assertIsNone(dedup.get_message_key(command))
+
+
+class MessageDeduplicatorTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        patcher = unittest.mock.patch('time.monotonic', lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_filter_returns_same_list(self):
+        deduplicator = dedup.MessageDeduplicator()
+        commands = [_make_gift('1'), _make_gift('2'), {'cmd': 'ONLINE_RANK_COUNT'}]
+        self.assertIs(deduplicator.filter(1, commands), commands)
+
+        commands = [_make_gift('2'), _make_gift('3')]
+        res = deduplicator.filter(1, commands)
+        self.assertIsNot(res, commands)
+        self.assertEqual(res, [_make_gift('3')])
+
+    def test_rooms_separated(self):
+        deduplicator = dedup.MessageDeduplicator()
+        self.assertFalse(deduplicator.is_duplicate(1, _make_gift('1')))
+        self.assertFalse(deduplicator.is_duplicate(2, _make_gift('1')))
+        self.assertTrue(deduplicator.is_duplicate(1, _make_gift('1')))
+
+    def test_keep_unkeyed(self):
+        deduplicator = dedup.MessageDeduplicator()
+        unkeyed = {'cmd': 'ONLINE_RANK_COUNT'}
+        self.assertEqual(deduplicator.filter(1, [unkeyed, _make_gift('1')], keep_unkeyed=False), [_make_gift('1')])
+        self.assertEqual(deduplicator.stats['unkeyed'], 1)
+
+    def test_window_expiry(self):
+        deduplicator = dedup.MessageDeduplicator(window=40, generations=4)
+        deduplicator.is_duplicate(1, _make_gift('1'))
+
+        # 不到window * (generations - 1) / generations秒的还在
+        self.now += 25
+        self.assertTrue(deduplicator.is_duplicate(1, _make_gift('1')))
+        deduplicator.is_duplicate(1, _make_gift('2'))
+
+        # 超过window秒的肯定没了
+        self.now += 41
+        self.assertFalse(deduplicator.is_duplicate(1, _make_gift('2')))
+
+    def test_rotate_multiple_generations(self):
+        deduplicator = dedup.MessageDeduplicator(window=40, generations=4)
+        deduplicator.is_duplicate(1, _make_gift('1'))
+
+        # 隔了两代多才有下一条消息，要一次轮换两代
+        self.now += 25
+        deduplicator.is_duplicate(1, _make_gift('2'))
+        self.assertEqual(deduplicator.stats['rotations'], 2)
+        self.now += 20
+        self.assertFalse(deduplicator.is_duplicate(1, _make_gift('1')))
+        self.assertTrue(deduplicator.is_duplicate(1, _make_gift('2')))
+
+        # 超过一个窗口最多轮换generations代
+        self.now += 1000
+        deduplicator.is_duplicate(1, _make_gift('3'))
+        self.assertEqual(deduplicator.stats['rotations'], 4 + 4)
+        self.assertEqual(deduplicator.stats['entries'], 1)
+
+    def test_rotate_when_full(self):
+        deduplicator = dedup.MessageDeduplicator(max_entries=8, generations=4)
+        for i in range(20):
+            deduplicator.is_duplicate(1, _make_gift(str(i)))
+        self.assertLessEqual(deduplicator.stats['entries'], 8)
+        self.assertFalse(deduplicator.is_duplicate(1, _make_gift('0')))
+        self.assertTrue(deduplicator.is_duplicate(1, _make_gift('19')))
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import types
+import unittest
+
+import blivedm
+from benchmarks import frames
+
+_CLIENT = types.SimpleNamespace(room_id=1)
+
+
+def _make_command(cmd, n):
+    return {'cmd': cmd, 'data': {'n': n}}
+
+
+def _get_all(stream):
+    res = []
+    while stream.qsize() != 0:
+        res.append(stream.get_nowait().command)
+    return res
+
+
+class OverflowPolicyTest(unittest.IsolatedAsyncioTestCase):
+    async def test_block(self):
+        stream = blivedm.EventStream(2, blivedm.OverflowPolicy.BLOCK)
+        commands = [_make_command('A', i) for i in range(3)]
+        # 一个WebSocket消息里的不会丢，可以超出缓冲区大小
+        stream.put_commands(_CLIENT, commands)  # noqa
+        self.assertEqual(stream.qsize(), 3)
+        self.assertTrue(stream.full())
+
+        wait_task = asyncio.create_task(stream.wait_not_full())
+        await asyncio.sleep(0)
+        self.assertFalse(wait_task.done())
+        stream.get_nowait()
+        await asyncio.sleep(0)
+        self.assertFalse(wait_task.done())
+        stream.get_nowait()
+        await asyncio.wait_for(wait_task, 1)
+
+        self.assertEqual(_get_all(stream), commands[2:])
+        self.assertEqual(stream.stats[1], {'buffered': 0, 'delivered': 3, 'dropped': 0})
+
+    async def test_block_close_wakes_producer(self):
+        stream = blivedm.EventStream(1, blivedm.OverflowPolicy.BLOCK)
+        stream.put_commands(_CLIENT, [_make_command('A', 0)])  # noqa
+        wait_task = asyncio.create_task(stream.wait_not_full())
+        await asyncio.sleep(0)
+        stream.close()
+        await asyncio.wait_for(wait_task, 1)
+
+    async def test_drop_oldest(self):
+        stream = blivedm.EventStream(2, blivedm.OverflowPolicy.DROP_OLDEST)
+        commands = [_make_command('A', i) for i in range(5)]
+        stream.put_commands(_CLIENT, commands)  # noqa
+        self.assertEqual(stream.qsize(), 2)
+        self.assertEqual(_get_all(stream), commands[3:])
+        self.assertEqual(stream.stats[1], {'buffered': 0, 'delivered': 2, 'dropped': 3})
+
+    async def test_drop_newest(self):
+        stream = blivedm.EventStream(2, blivedm.OverflowPolicy.DROP_NEWEST)
+        commands = [_make_command('A', i) for i in range(5)]
+        stream.put_commands(_CLIENT, commands)  # noqa
+        self.assertEqual(_get_all(stream), commands[:2])
+        self.assertEqual(stream.stats[1]['dropped'], 3)
+
+    async def test_drop_by_priority(self):
+        stream = blivedm.EventStream(
+            3, blivedm.OverflowPolicy.DROP_BY_PRIORITY,
+            cmd_priorities={'HIGH': 2, 'MID': 1}, default_priority=0
+        )
+        low1, low2, low3 = (_make_command('LOW', i) for i in range(3))
+        mid1, mid2 = (_make_command('MID', i) for i in range(2))
+        high1 = _make_command('HIGH:1', 0)
+
+        stream.put_commands(_CLIENT, [low1, mid1, low2])  # noqa
+        # 满了丢弃优先级最低的里最早的一条
+        stream.put_commands(_CLIENT, [high1])  # noqa
+        stream.put_commands(_CLIENT, [mid2])  # noqa
+        # 新消息优先级比缓冲区里的都低时丢弃新消息
+        stream.put_commands(_CLIENT, [low3])  # noqa
+
+        # 取出时保持收到的顺序
+        self.assertEqual(_get_all(stream), [mid1, high1, mid2])
+        self.assertEqual(stream.stats[1], {'buffered': 0, 'delivered': 3, 'dropped': 3})
+
+
+class WantedCmdsTest(unittest.IsolatedAsyncioTestCase):
+    class _DanmakuHandler(blivedm.BaseHandler):
+        def __init__(self):
+            self.messages = []
+
+        def _on_danmaku(self, client, message):
+            self.messages.append(message)
+
+    async def asyncSetUp(self):
+        self.client = blivedm.BLiveClient(1)
+        self.client._room_id = 1  # noqa
+        self.handler = self._DanmakuHandler()
+        self.client.set_handler(self.handler)
+
+    async def asyncTearDown(self):
+        await self.client.close()
+
+    def _get_client_wanted_cmds(self):
+        return self.client._wanted_cmds  # noqa
+
+    async def test_merge_wanted_cmds(self):
+        handler_wanted_cmds = self._get_client_wanted_cmds()
+        self.assertIn('DANMU_MSG', handler_wanted_cmds)
+        self.assertNotIn('SEND_GIFT', handler_wanted_cmds)
+
+        stream = self.client.events(wanted_cmds=['SEND_GIFT'])
+        self.assertEqual(self._get_client_wanted_cmds(), handler_wanted_cmds | {'SEND_GIFT'})
+
+        # 要全部的事件流会关闭过滤
+        all_stream = self.client.events()
+        self.assertIsNone(self._get_client_wanted_cmds())
+        all_stream.close()
+        self.assertEqual(self._get_client_wanted_cmds(), handler_wanted_cmds | {'SEND_GIFT'})
+
+        stream.close()
+        self.assertEqual(self._get_client_wanted_cmds(), handler_wanted_cmds)
+
+    async def test_stream_only_gets_wanted(self):
+        stream = self.client.events(wanted_cmds=['SEND_GIFT'])
+        danmaku = frames.make_danmaku_command(1)
+        gift = frames.make_gift_command(2)
+        interact = frames.make_interact_word_command(3)
+        await self.client._parse_ws_message(frames.make_brotli_frame([danmaku, gift, interact]))  # noqa
+
+        self.assertEqual(_get_all(stream), [gift])
+        self.assertEqual(len(self.handler.messages), 1)
+        self.assertEqual(self.client.skipped_cmd_stats['INTERACT_WORD']['messages'], 1)
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+import types
+import unittest
+
+import blivedm
+import blivedm.models.web as web_models
+from benchmarks import frames
+
+
+class _DanmakuHandler(blivedm.BaseHandler):
+    def __init__(self):
+        self.messages = []
+
+    def _on_danmaku(self, client, message):
+        self.messages.append(message)
+
+
+class BaseHandlerTest(unittest.TestCase):
+    def test_client_without_get_parsed_message(self):
+        handler = _DanmakuHandler()
+        client = types.SimpleNamespace(room_id=1)
+        handler.handle(client, frames.make_danmaku_command(1))  # noqa
+        self.assertEqual(len(handler.messages), 1)
+        self.assertIsInstance(handler.messages[0], web_models.DanmakuMessage)
+
+    def test_wanted_cmds(self):
+        self.assertEqual(_DanmakuHandler().get_wanted_cmds(), {'DANMU_MSG'})
+
+        class HandleOverridden(blivedm.BaseHandler):
+            def handle(self, client, command):
+                pass
+
+        class HandleBatchOverridden(blivedm.BaseHandler):
+            def handle_batch(self, client, commands):
+                pass
+
+        self.assertIsNone(HandleOverridden().get_wanted_cmds())
+        self.assertIsNone(HandleBatchOverridden().get_wanted_cmds())
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import unittest
+
+import blivedm.heartbeat as heartbeat
+
+
+class HeartbeatSchedulerTest(unittest.IsolatedAsyncioTestCase):
+    def _make_callback(self, times):
+        async def callback():
+            times.append(asyncio.get_running_loop().time())
+        return callback
+
+    async def test_spread_over_slots(self):
+        scheduler = heartbeat.HeartbeatScheduler(2.0, 0.5)
+        entries = [scheduler.register(self._make_callback([])) for _ in range(10)]
+        self.addCleanup(lambda: [scheduler.unregister(entry) for entry in entries])
+        slot_sizes = [0] * 4
+        for entry in entries:
+            slot_sizes[entry.slot] += 1
+        self.assertEqual(sorted(slot_sizes), [2, 2, 3, 3])
+
+        # 注销后新注册的放到空出来的格子
+        scheduler.unregister(entries[0])
+        entry = scheduler.register(self._make_callback([]))
+        entries.append(entry)
+        self.assertEqual(entry.slot, entries[0].slot)
+
+    async def test_interval(self):
+        interval = 0.2
+        scheduler = heartbeat.HeartbeatScheduler(interval, 0.05)
+        start_time = asyncio.get_running_loop().time()
+        call_times = [[] for _ in range(4)]
+        entries = [scheduler.register(self._make_callback(times)) for times in call_times]
+        self.addCleanup(lambda: [scheduler.unregister(entry) for entry in entries])
+
+        await asyncio.sleep(interval * 2.5)
+        first_call_times = []
+        for times in call_times:
+            self.assertGreaterEqual(len(times), 2)
+            first_call_times.append(times[0])
+            # 第一次心跳在一个心跳间隔内，之后每个心跳间隔一次
+            self.assertLessEqual(times[0] - start_time, interval * 1.5)
+            for prev_time, next_time in zip(times, times[1:]):
+                self.assertGreaterEqual(next_time - prev_time, interval * 0.9)
+        # 不同格子的心跳错开
+        self.assertEqual(len(set(first_call_times)), 4)
+
+        self.assertEqual(scheduler.stats['registered'], 4)
+        # 等已经开始的心跳协程执行完
+        for entry in entries:
+            scheduler.unregister(entry)
+        await asyncio.sleep(0.01)
+        self.assertEqual(scheduler.stats['sent'], sum(len(times) for times in call_times))
+
+    async def test_unregister(self):
+        scheduler = heartbeat.HeartbeatScheduler(0.1, 0.05)
+        times1 = []
+        times2 = []
+        entry1 = scheduler.register(self._make_callback(times1))
+        entry2 = scheduler.register(self._make_callback(times2))
+
+        scheduler.unregister(entry1)
+        scheduler.unregister(entry1)
+        self.assertEqual(scheduler.stats['registered'], 1)
+        await asyncio.sleep(0.25)
+        self.assertEqual(times1, [])
+        self.assertGreaterEqual(len(times2), 1)
+
+        # 都注销后不再有定时器
+        scheduler.unregister(entry2)
+        self.assertIsNone(scheduler._timer_handle)  # noqa
+        count = len(times2)
+        await asyncio.sleep(0.15)
+        self.assertEqual(len(times2), count)
+
+    async def test_callback_error(self):
+        scheduler = heartbeat.HeartbeatScheduler(0.05, 0.05)
+        times = []
+
+        async def bad_callback():
+            raise RuntimeError('test')
+
+        entries = [scheduler.register(bad_callback), scheduler.register(self._make_callback(times))]
+        self.addCleanup(lambda: [scheduler.unregister(entry) for entry in entries])
+        with self.assertLogs('blivedm', 'ERROR'):
+            await asyncio.sleep(0.08)
+        self.assertGreaterEqual(len(times), 1)
+
+
+class GetHeartbeatSchedulerTest(unittest.TestCase):
+    def test_shared_per_loop_and_interval(self):
+        async def get_schedulers():
+            return (
+                heartbeat.get_heartbeat_scheduler(30),
+                heartbeat.get_heartbeat_scheduler(30),
+                heartbeat.get_heartbeat_scheduler(10),
+            )
+
+        a1, a2, a3 = asyncio.run(get_schedulers())
+        b1, _b2, _b3 = asyncio.run(get_schedulers())
+        self.assertIs(a1, a2)
+        self.assertIsNot(a1, a3)
+        self.assertEqual(a3.interval, 10)
+        self.assertIsNot(a1, b1)
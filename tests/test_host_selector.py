@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+import unittest
+import unittest.mock
+
+import blivedm
+import blivedm.host_selector as host_selector
+
+URLS = ['wss://a:443/sub', 'wss://b:443/sub', 'wss://c:443/sub']
+
+
+class HostSelectorTest(unittest.TestCase):
+    def test_probe_not_in_connect_time(self):
+        selector = host_selector.HostSelector()
+        selector.record_probe(URLS[0], 0.01)
+        stats = selector.stats[URLS[0]]
+        self.assertEqual(stats['probe_time'], 0.01)
+        self.assertIsNone(stats['connect_time'])
+        self.assertEqual(stats['connects'], 0)
+
+    def test_failed_host_ranked_last(self):
+        selector = host_selector.HostSelector()
+        for url in URLS:
+            selector.record_connect(url, 0.1)
+        selector.record_failure(URLS[0])
+        self.assertEqual(selector.rank(URLS)[-1], URLS[0])
+
+    def test_select_excludes_failed_host(self):
+        selector = host_selector.HostSelector()
+        selector.record_connect(URLS[0], 0.1)
+        self.assertEqual(selector.select(URLS, exclude=URLS[0]), URLS[1])
+        self.assertEqual(selector.select(URLS[:1], exclude=URLS[0]), URLS[0])
+        self.assertEqual(selector.select(URLS, 1, exclude=URLS[0]), URLS[2])
+
+
+class SelectWsUrlTest(unittest.IsolatedAsyncioTestCase):
+    async def test_probe_only_on_first_connect(self):
+        selector = host_selector.HostSelector(probe=True)
+        client = blivedm.BLiveClient(1)
+        try:
+            client.set_host_selector(selector)
+            with unittest.mock.patch.object(client, '_get_ws_urls', return_value=URLS), \
+                    unittest.mock.patch.object(selector, 'probe', return_value=URLS[0]) as probe:
+                self.assertEqual(await client._select_ws_url(0), URLS[0])  # noqa
+                self.assertEqual(probe.call_count, 1)
+
+                # 探测选中的服务器握手失败后，重连不再探测，按分数换一个服务器
+                selector.record_failure(URLS[0])
+                self.assertNotEqual(await client._select_ws_url(1), URLS[0])  # noqa
+                self.assertEqual(probe.call_count, 1)
+        finally:
+            await client.close()
+
+    async def test_multi_failure_walk(self):
+        selector = host_selector.HostSelector()
+        for url in URLS:
+            selector.record_connect(url, 0.1)
+        client = blivedm.BLiveClient(1)
+        try:
+            client.set_host_selector(selector)
+            visited = []
+            with unittest.mock.patch.object(client, '_get_ws_urls', return_value=URLS):
+                for retry_count in range(6):
+                    url = await client._select_ws_url(retry_count)  # noqa
+                    visited.append(url)
+                    # 模拟连接失败
+                    selector.record_failure(url)
+                    client._last_ws_url = url  # noqa
+        finally:
+            await client.close()
+        # 每个服务器都试过之后才会再试，不会连续试同一个
+        self.assertEqual(sorted(visited[:3]), sorted(URLS))
+        for prev, cur in zip(visited, visited[1:]):
+            self.assertNotEqual(prev, cur)
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+import json
+import unittest
+
+import blivedm
+import blivedm.clients.ws_base as ws_base
+from benchmarks import frames, json_codec as json_codec_bench
+from blivedm import json_codec
+
+
+class JsonCodecParityTest(unittest.TestCase):
+    def test_parity(self):
+        corpus = json_codec_bench.PARITY_CORPUS + [
+            json.dumps(command, ensure_ascii=False).encode('utf-8') for command in frames.make_commands(200)
+        ]
+        for name in json_codec.get_available_codec_names():
+            codec = json_codec.get_codec(name)
+            for data in corpus:
+                with self.subTest(codec=name, data=data):
+                    self.assertIsNone(json_codec_bench.find_mismatch(codec, data))
+
+    def test_default_is_stdlib(self):
+        self.assertIs(type(json_codec.get_default_codec()), json_codec.StdlibJsonCodec)
+        # 超过64位的整数不能变成float
+        self.assertEqual(json_codec.get_default_codec().loads(json_codec_bench.BIG_INT_CORPUS[0])['big'],
+                         123456789012345678901234567890)
+
+
+class _RecordingCodec(json_codec.StdlibJsonCodec):
+    def __init__(self):
+        self.dumped = []
+
+    def dumps(self, obj):
+        self.dumped.append(obj)
+        return super().dumps(obj)
+
+
+class MakePacketTest(unittest.IsolatedAsyncioTestCase):
+    async def test_uses_client_codec(self):
+        client = blivedm.BLiveClient(1)
+        try:
+            codec = _RecordingCodec()
+            client.set_json_codec(codec)
+            packet = client._make_packet({'roomid': 1}, ws_base.Operation.AUTH)  # noqa
+        finally:
+            await client.close()
+        self.assertEqual(codec.dumped, [{'roomid': 1}])
+        header = ws_base.HeaderTuple(*ws_base.HEADER_STRUCT.unpack_from(packet))
+        self.assertEqual(header.operation, ws_base.Operation.AUTH)
+        self.assertEqual(json.loads(packet[header.raw_header_size:]), {'roomid': 1})
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+import blivedm
+from benchmarks import frames
+
+
+class HistogramTest(unittest.TestCase):
+    def test_percentiles(self):
+        histogram = blivedm.Histogram()
+        for value in range(1, 10001):
+            histogram.record(value)
+        snapshot = histogram.snapshot()
+        self.assertEqual(snapshot['count'], 10000)
+        self.assertEqual(snapshot['min'], 1)
+        self.assertEqual(snapshot['max'], 10000)
+        # 相对误差不超过约3%
+        self.assertAlmostEqual(snapshot['p50'], 5000, delta=5000 * 0.04)
+        self.assertAlmostEqual(snapshot['p99'], 9900, delta=9900 * 0.04)
+
+    def test_merge(self):
+        a = blivedm.Histogram()
+        b = blivedm.Histogram()
+        a.record(10)
+        b.record(1000)
+        a.merge(b)
+        self.assertEqual((a.count, a.snapshot()['min'], a.snapshot()['max']), (2, 10, 1000))
+
+
+class _DanmakuHandler(blivedm.BaseHandler):
+    def _on_danmaku(self, client, message):
+        pass
+
+
+class ClientMetricsTest(unittest.IsolatedAsyncioTestCase):
+    async def test_disabled_by_default(self):
+        client = blivedm.BLiveClient(1)
+        try:
+            self.assertIsNone(client.metrics)
+            client._room_id = 1  # noqa
+            await client._parse_ws_message(frames.make_brotli_frame(frames.make_commands(5)))  # noqa
+        finally:
+            await client.close()
+
+    async def test_enabled(self):
+        client = blivedm.BLiveClient(1)
+        metrics = blivedm.ClientMetrics(timing_sample_interval=1)
+        try:
+            client.set_metrics(metrics)
+            client.set_handler(_DanmakuHandler())
+            client._room_id = 1  # noqa
+            metrics.on_frame(100)
+            commands = [frames.make_danmaku_command(i) for i in range(5)]
+            await client._parse_ws_message(frames.make_brotli_frame(commands))  # noqa
+        finally:
+            await client.close()
+        snapshot = metrics.snapshot()
+        self.assertEqual(snapshot['frames'], 1)
+        self.assertEqual(snapshot['decoded_messages'], 5)
+        self.assertEqual(snapshot['decompress_time']['count'], 1)
+        self.assertEqual(snapshot['json_decode_time']['count'], 5)
+        self.assertEqual(snapshot['packets']['SEND_MSG_REPLY/NORMAL'], 5)
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import json
+import unittest
+
+import aiohttp
+
+import blivedm
+from benchmarks import frames, mock_danmaku_server, ws_load
+from blivedm.clients import ws_base
+
+
+class _RecordingHandler(blivedm.HandlerInterface):
+    def __init__(self):
+        self.commands = []
+
+    def handle(self, client, command):
+        self.commands.append(command)
+
+
+def _make_auth_packet(room_id, key=None):
+    body = {'uid': 0, 'roomid': room_id, 'protover': 3, 'platform': 'web', 'type': 2}
+    if key is not None:
+        body['key'] = key
+    return frames.make_packet(json.dumps(body).encode('utf-8'), ws_base.Operation.AUTH, ws_base.ProtoVer.HEARTBEAT)
+
+
+async def _wait_until(predicate, timeout=5.0):
+    loop = asyncio.get_running_loop()
+    end_time = loop.time() + timeout
+    while not predicate():
+        if loop.time() > end_time:
+            raise AssertionError('timeout')
+        await asyncio.sleep(0.01)
+
+
+class MockDanmakuServerProtocolTest(unittest.IsolatedAsyncioTestCase):
+    """
+    用原始WebSocket连接测试协议
+    """
+
+    async def _start_server(self, **kwargs):
+        server = mock_danmaku_server.MockDanmakuServer(**kwargs)
+        await server.start()
+        self.addAsyncCleanup(server.close)
+        session = aiohttp.ClientSession()
+        self.addAsyncCleanup(session.close)
+        return server, session
+
+    @staticmethod
+    async def _receive_packets(websocket):
+        message = await websocket.receive(timeout=5)
+        return list(ws_base.iter_packets(message.data))
+
+    async def test_auth_and_heartbeat(self):
+        server, session = await self._start_server(message_rate=0, popularity=1234)
+        async with session.ws_connect(server.url) as websocket:
+            await websocket.send_bytes(_make_auth_packet(1))
+            (operation, _ver, body), = await self._receive_packets(websocket)
+            self.assertEqual(operation, ws_base.Operation.AUTH_REPLY)
+            self.assertEqual(json.loads(bytes(body)), {'code': ws_base.AuthReplyCode.OK})
+
+            await websocket.send_bytes(ws_base.HEARTBEAT_PACKET)
+            message = await websocket.receive(timeout=5)
+            header = ws_base.HeaderTuple(*ws_base.HEADER_STRUCT.unpack_from(message.data, 0))
+            self.assertEqual(header.operation, ws_base.Operation.HEARTBEAT_REPLY)
+            popularity = int.from_bytes(message.data[header.raw_header_size: header.raw_header_size + 4], 'big')
+            self.assertEqual(popularity, 1234)
+
+            stats = server.stats
+            self.assertEqual((stats['auth_succeeded'], stats['heartbeats'], stats['rooms']), (1, 1, 1))
+
+    async def test_push_compressed(self):
+        for name, compression in mock_danmaku_server.COMPRESSION_NAMES.items():
+            with self.subTest(compression=name):
+                server, session = await self._start_server(
+                    message_rate=1000, commands_per_frame=5, compression=compression
+                )
+                async with session.ws_connect(server.url) as websocket:
+                    await websocket.send_bytes(_make_auth_packet(1))
+                    await self._receive_packets(websocket)
+
+                    packets = await self._receive_packets(websocket)
+                    if compression == ws_base.ProtoVer.NORMAL:
+                        self.assertEqual(len(packets), 5)
+                    else:
+                        (_operation, ver, _body), = packets
+                        self.assertEqual(ver, compression)
+                await server.close()
+
+    async def test_auth_failures(self):
+        server, session = await self._start_server(message_rate=0, required_token='token')
+        server.fail_next_auth(1)
+        cases = [
+            (_make_auth_packet(1, 'token'), ws_base.AuthReplyCode.TOKEN_ERROR),
+            (_make_auth_packet(1, 'wrong'), ws_base.AuthReplyCode.TOKEN_ERROR),
+            (_make_auth_packet(1, 'token'), ws_base.AuthReplyCode.OK),
+        ]
+        for auth_packet, expected_code in cases:
+            async with session.ws_connect(server.url) as websocket:
+                await websocket.send_bytes(auth_packet)
+                (_operation, _ver, body), = await self._receive_packets(websocket)
+                self.assertEqual(json.loads(bytes(body))['code'], expected_code)
+        self.assertEqual((server.stats['auth_failed'], server.stats['auth_succeeded']), (2, 1))
+
+    async def test_auth_timeout(self):
+        server, session = await self._start_server(message_rate=0, auth_timeout=0.05)
+        async with session.ws_connect(server.url) as websocket:
+            message = await websocket.receive(timeout=5)
+            self.assertEqual(message.type, aiohttp.WSMsgType.CLOSE)
+
+
+class MockDanmakuServerClientTest(unittest.IsolatedAsyncioTestCase):
+    """
+    用真的客户端连接
+    """
+
+    async def asyncSetUp(self):
+        self.server = mock_danmaku_server.MockDanmakuServer(message_rate=500, commands_per_frame=5)
+        await self.server.start()
+        self.session = ws_load.make_offline_session()
+        self.handler = _RecordingHandler()
+        self.client = ws_load.OfflineClient(
+            1, uid=0, session=self.session, host_server_list=self.server.host_server_list, use_wss=False
+        )
+        self.client.set_handler(self.handler)
+        self.client.set_reconnect_policy(lambda _retry_count, _total_retry_count: 0.01)
+
+    async def asyncTearDown(self):
+        await self.client.stop_and_close()
+        await self.server.close()
+        await self.session.close()
+
+    async def test_receive_messages(self):
+        self.client.start()
+        await _wait_until(lambda: len(self.handler.commands) >= 20)
+        cmds = {command['cmd'] for command in self.handler.commands}
+        # 认证后客户端马上发心跳
+        self.assertIn('_HEARTBEAT', cmds)
+        self.assertGreater(len(cmds), 1)
+        self.assertEqual(self.server.stats['auth_succeeded'], 1)
+
+    async def test_reconnect_after_injected_faults(self):
+        self.server.fail_next_auth(1)
+        with self.assertLogs('blivedm', 'ERROR'):
+            self.client.start()
+            await _wait_until(lambda: self.client.is_connected and self.server.stats['auth_succeeded'] == 1)
+        self.assertEqual(self.server.stats['auth_failed'], 1)
+
+        self.assertEqual(await self.server.disconnect_room(1), 1)
+        await _wait_until(lambda: self.server.stats['auth_succeeded'] == 2)
+        stats = self.server.stats
+        self.assertEqual((stats['injected_disconnects'], stats['total_connections']), (1, 3))
+
+        count = len(self.handler.commands)
+        await _wait_until(lambda: len(self.handler.commands) > count)
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import time
+import unittest
+import zlib
+
+import yarl
+
+import blivedm
+from benchmarks import mock_http_server, room_init
+from blivedm.clients import open_live, web
+
+
+class MockHttpServerTest(unittest.IsolatedAsyncioTestCase):
+    async def _start_server(self, **kwargs):
+        server = mock_http_server.MockHttpServer(**kwargs)
+        await server.start()
+        self.addAsyncCleanup(server.close)
+        web.set_base_urls(server.url, server.url, server.url)
+        self.addCleanup(web.set_base_urls)
+        open_live.set_base_url(server.url)
+        self.addCleanup(open_live.set_base_url)
+        session = room_init.make_session()
+        self.addAsyncCleanup(session.close)
+        return server, session
+
+    async def test_web_init_room(self):
+        host_server_list = [{'host': '127.0.0.1', 'port': 1, 'wss_port': 1, 'ws_port': 1}]
+        server, session = await self._start_server(host_server_list=host_server_list, danmaku_token='token')
+        session.cookie_jar.update_cookies({'SESSDATA': 'sessdata'}, yarl.URL(server.url))
+        client = blivedm.BLiveClient(123, session=session)
+        self.addAsyncCleanup(client.close)
+        self.assertTrue(await client.init_room())
+        self.assertEqual((client.room_id, client.room_owner_uid), (123, 1_000_123))
+        # 有SESSDATA时nav返回已登录
+        self.assertEqual(client.uid, zlib.crc32(b'sessdata') % 1_000_000_000 + 1)
+        self.assertEqual(client._host_server_list, host_server_list)  # noqa
+        self.assertEqual(client._host_server_token, 'token')  # noqa
+        # 首页发的buvid3保存到session
+        self.assertNotEqual(web.get_buvid(session), '')
+
+        self.assertEqual(server.stats['requests'], {
+            'nav': 1, 'home': 1, 'room_init': 1, 'danmu_info': 1, 'start': 0, 'heartbeat': 0, 'end': 0
+        })
+        server.reset_stats()
+        self.assertEqual(server.stats['total_requests'], 0)
+
+    async def test_injected_errors(self):
+        server, session = await self._start_server()
+        server.set_error('room_init', -400, 1)
+        server.set_error('danmu_info', 412)
+        client = blivedm.BLiveClient(123, session=session)
+        self.addAsyncCleanup(client.close)
+        with self.assertLogs('blivedm', 'WARNING'):
+            self.assertFalse(await client.init_room())
+        self.assertEqual(server.stats['injected_errors'], 2)
+
+        # 错误次数用完后恢复，一直返回的错误要手动清除
+        with self.assertLogs('blivedm', 'WARNING') as cm:
+            self.assertFalse(await client.init_room())
+        self.assertEqual(len(cm.output), 1)
+        self.assertIn('_init_host_server() failed, status=412', cm.output[0])
+        self.assertEqual(client.room_id, 123)
+
+        server.clear_error()
+        self.assertTrue(await client.init_room())
+
+        with self.assertRaises(ValueError):
+            server.set_error('unknown', -400)
+
+    async def test_rate_limit(self):
+        server, session = await self._start_server(rate_limit=1, rate_limit_burst=2)
+        url = server.url + mock_http_server.ENDPOINT_PATHS['room_init']
+        statuses = []
+        for _ in range(3):
+            async with session.get(url, params={'room_id': 1}) as res:
+                statuses.append(res.status)
+        self.assertEqual(statuses, [200, 200, 412])
+        self.assertEqual(server.stats['rate_limited'], 1)
+
+    async def test_latency(self):
+        server, session = await self._start_server(latency=0.1)
+        url = server.url + mock_http_server.ENDPOINT_PATHS['room_init']
+        start_time = time.perf_counter()
+        async with session.get(url, params={'room_id': 1}) as res:
+            self.assertEqual(res.status, 200)
+        self.assertGreaterEqual(time.perf_counter() - start_time, 0.09)
+
+        server.set_latency(0)
+        start_time = time.perf_counter()
+        async with session.get(url, params={'room_id': 1}) as res:
+            self.assertEqual(res.status, 200)
+        self.assertLess(time.perf_counter() - start_time, 0.09)
+
+    async def test_open_live(self):
+        server, session = await self._start_server(open_live_ws_urls=['ws://127.0.0.1:1/sub'])
+        client = blivedm.OpenLiveClient('key', 'secret', 1, '123', session=session)
+        self.assertTrue(await client.init_room())
+        self.assertEqual((client.room_id, client.room_owner_uid), (123, 1_000_123))
+        self.assertEqual(client._get_ws_urls(), ['ws://127.0.0.1:1/sub'])  # noqa
+        self.assertEqual(server.stats['games'], 1)
+        self.assertTrue(await client._send_game_heartbeat())  # noqa
+
+        # 项目过期后心跳返回7003，客户端要重新开启项目
+        self.assertTrue(server.expire_game(client.game_id))
+        with self.assertLogs('blivedm', 'WARNING') as cm:
+            self.assertFalse(await client._send_game_heartbeat())  # noqa
+        self.assertIn('code=7003', cm.output[0])
+        self.assertTrue(client._need_init_room)  # noqa
+
+        # 关闭已经过期的项目返回7000，也算成功
+        await client.close()
+        self.assertEqual(server.stats['requests']['end'], 1)
+        self.assertEqual(server.stats['games'], 0)
+
+    async def test_open_live_heartbeat_timeout(self):
+        server, session = await self._start_server(game_heartbeat_timeout=0.05)
+        client = blivedm.OpenLiveClient('key', 'secret', 1, 'code', session=session)
+        self.addAsyncCleanup(client.close)
+        self.assertTrue(await client.init_room())
+        await asyncio.sleep(0.1)
+        with self.assertLogs('blivedm', 'WARNING'):
+            self.assertFalse(await client._send_game_heartbeat())  # noqa
+        self.assertEqual(server.stats['games'], 0)
+
+
+class ServerThreadTest(unittest.TestCase):
+    def test_start_and_stop(self):
+        server_thread = mock_http_server.ServerThread(mock_http_server.MockHttpServer())
+        server_thread.start()
+        try:
+            self.assertNotEqual(server_thread.server.port, 0)
+            server_thread.call(server_thread.server.set_error, 'nav', -101, 1)
+
+            async def request():
+                async with room_init.make_session() as session:
+                    async with session.get(server_thread.server.url + '/x/web-interface/nav') as res:
+                        return (await res.json())['code']
+
+            self.assertEqual(asyncio.run(request()), -101)
+            stats = server_thread.call(lambda: server_thread.server.stats)
+            self.assertEqual((stats['requests']['nav'], stats['injected_errors']), (1, 1))
+        finally:
+            server_thread.stop()
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import unittest
+
+import aiohttp
+
+import blivedm
+
+
+class _FakeClient:
+    def __init__(self, room_id, session):
+        self.room_id = room_id
+        self.session = session
+        self.handler = None
+        self.event_streams = []
+        self.init_room_gate = None
+        self.init_room_calls = 0
+        self.started = False
+        self.closed = False
+        self._need_init_room = True
+        self._stopped = asyncio.Event()
+
+    @property
+    def is_connected(self):
+        return self.started and not self._stopped.is_set()
+
+    def set_handler(self, handler):
+        self.handler = handler
+
+    def _add_event_stream(self, stream):
+        self.event_streams.append(stream)
+
+    def _remove_event_stream(self, stream):
+        self.event_streams.remove(stream)
+
+    async def init_room(self):
+        self.init_room_calls += 1
+        if self.init_room_gate is not None:
+            await self.init_room_gate.wait()
+        return True
+
+    def start(self):
+        self.started = True
+
+    async def join(self):
+        await self._stopped.wait()
+
+    def stop_by_itself(self):
+        self._stopped.set()
+
+    async def stop_and_close(self):
+        self._stopped.set()
+        self.closed = True
+
+    async def close(self):
+        self.closed = True
+
+
+class RoomPoolTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.init_room_gate = None
+        self.pool = blivedm.RoomPool(client_factory=self._create_client, max_concurrent_starts=2)
+        self.addAsyncCleanup(self.pool.close)
+
+    def _create_client(self, room_id, session):
+        client = _FakeClient(room_id, session)
+        client.init_room_gate = self.init_room_gate
+        return client
+
+    @staticmethod
+    async def _wait_for_state(pool, room_id, state):
+        for _ in range(100):
+            if pool.get_room_state(room_id) == state:
+                return
+            await asyncio.sleep(0)
+        raise AssertionError(f'room {room_id} state is {pool.get_room_state(room_id)}, expected {state}')
+
+    async def test_add_and_remove(self):
+        handler = blivedm.BaseHandler()
+        self.pool.set_handler(handler)
+        client1 = self.pool.add_room(1)
+        self.assertIs(self.pool.add_room(1), client1)
+        self.pool.add_rooms([2, 3])
+        self.assertEqual(self.pool.room_ids, [1, 2, 3])
+
+        for room_id in (1, 2, 3):
+            await self._wait_for_state(self.pool, room_id, blivedm.RoomState.RUNNING)
+            client = self.pool.get_client(room_id)
+            # 所有房间共享session和消息处理器
+            self.assertIs(client.session, self.pool.session)
+            self.assertIs(client.handler, handler)
+            self.assertTrue(client.started)
+            # 在RoomPool里初始化过，客户端连接前不用再初始化
+            self.assertFalse(client._need_init_room)  # noqa
+        self.assertEqual(self.pool.status['running'], 3)
+        self.assertEqual(self.pool.status['connected'], 3)
+
+        await self.pool.remove_room(1)
+        self.assertTrue(client1.closed)
+        self.assertEqual(self.pool.room_ids, [2, 3])
+        self.assertIsNone(self.pool.get_client(1))
+        await self.pool.remove_room(1)
+
+        # 客户端自己停止的
+        self.pool.get_client(2).stop_by_itself()
+        await self._wait_for_state(self.pool, 2, blivedm.RoomState.FAILED)
+        self.assertEqual(self.pool.status['failed'], 1)
+
+    async def test_max_concurrent_starts(self):
+        self.init_room_gate = asyncio.Event()
+        self.pool.add_rooms(range(1, 6))
+        for _ in range(10):
+            await asyncio.sleep(0)
+        status = self.pool.status
+        self.assertEqual((status['starting'], status['pending']), (2, 3))
+
+        # 还在等待初始化的房间移除后不会初始化
+        pending_room_id = next(
+            room_id for room_id in self.pool.room_ids
+            if self.pool.get_room_state(room_id) == blivedm.RoomState.PENDING
+        )
+        pending_client = self.pool.get_client(pending_room_id)
+        await self.pool.remove_room(pending_room_id)
+        self.assertTrue(pending_client.closed)
+
+        self.init_room_gate.set()
+        for room_id in self.pool.room_ids:
+            await self._wait_for_state(self.pool, room_id, blivedm.RoomState.RUNNING)
+        self.assertEqual(pending_client.init_room_calls, 0)
+        self.assertFalse(pending_client.started)
+
+    async def test_event_streams(self):
+        client1 = self.pool.add_room(1)
+        stream = self.pool.events()
+        client2 = self.pool.add_room(2)
+        # 之后添加的房间也会推到事件流
+        self.assertEqual(client1.event_streams, [stream])
+        self.assertEqual(client2.event_streams, [stream])
+
+        stream.close()
+        self.assertEqual(client1.event_streams, [])
+        self.assertEqual(client2.event_streams, [])
+
+        stream = self.pool.events()
+        await self.pool.close()
+        self.assertTrue(stream.closed)
+
+
+class RoomPoolSessionTest(unittest.IsolatedAsyncioTestCase):
+    async def test_own_session(self):
+        pool = blivedm.RoomPool(client_factory=_FakeClient)
+        client = pool.add_room(1)
+        session = pool.session
+        await pool.close()
+        self.assertTrue(client.closed)
+        self.assertTrue(session.closed)
+        with self.assertRaises(RuntimeError):
+            pool.add_room(2)
+
+    async def test_external_session(self):
+        async with aiohttp.ClientSession() as session:
+            pool = blivedm.RoomPool(session=session, client_factory=_FakeClient)
+            self.assertIs(pool.add_room(1).session, session)
+            await pool.close()
+            self.assertFalse(session.closed)
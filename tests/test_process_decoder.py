@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+import blivedm
+import blivedm.models.web as web_models
+import blivedm.process_decoder as proc_dec
+from blivedm.models import compact
+from benchmarks import frames
+from blivedm import json_codec
+
+STDLIB_CODEC_NAME = json_codec.StdlibJsonCodec.name
+
+
+class _CompactDanmakuHandler(blivedm.BaseHandler):
+    _CMD_CALLBACK_DICT = {
+        **blivedm.BaseHandler._CMD_CALLBACK_DICT,  # noqa
+        'DANMU_MSG': blivedm.handlers._make_msg_callback(  # noqa
+            '_on_danmaku', compact.web.DanmakuMessage, 'info'
+        ),
+    }
+
+    def __init__(self):
+        self.messages = []
+        self.prebuilt = []
+
+    def handle(self, client, command):
+        self.prebuilt.append(client.get_parsed_message(command) is not None)
+        super().handle(client, command)
+
+    def _on_danmaku(self, client, message):
+        self.messages.append(message)
+
+
+class DecodeFrameTest(unittest.TestCase):
+    def test_messages_not_in_commands(self):
+        commands = [frames.make_danmaku_command(1), frames.make_interact_word_command(2)]
+        message_types = {'DANMU_MSG': (web_models.DanmakuMessage, 'info')}
+        res = proc_dec.decode_frame(frames.make_brotli_frame(commands), None, STDLIB_CODEC_NAME, message_types)
+        self.assertEqual(res.commands, commands)
+        self.assertIsInstance(res.messages[0], web_models.DanmakuMessage)
+        self.assertIsNone(res.messages[1])
+
+    def test_no_message_types(self):
+        res = proc_dec.decode_frame(frames.make_brotli_frame([frames.make_danmaku_command(1)]), None, STDLIB_CODEC_NAME)
+        self.assertIsNone(res.messages)
+
+    def test_worker_context_cache(self):
+        data = frames.make_brotli_frame([frames.make_danmaku_command(1)])
+        context = proc_dec._DecodeContext(frozenset({'DANMU_MSG'}), STDLIB_CODEC_NAME, None)  # noqa
+        self.assertIsNone(proc_dec._decode_in_worker(data, -1, None))  # noqa
+        self.assertEqual(len(proc_dec._decode_in_worker(data, -1, context).commands), 1)  # noqa
+        self.assertEqual(len(proc_dec._decode_in_worker(data, -1, None).commands), 1)  # noqa
+
+
+class ProcessDecoderTest(unittest.IsolatedAsyncioTestCase):
+    async def test_handler_message_types(self):
+        decoder = proc_dec.ProcessDecoder(1, build_models=True)
+        client = blivedm.BLiveClient(1)
+        handler = _CompactDanmakuHandler()
+        try:
+            client.set_handler(handler)
+            client.set_process_decoder(decoder)
+            client._room_id = 1  # noqa
+            command = frames.make_danmaku_command(1)
+            for _ in range(2):
+                await client._parse_ws_message_in_process(frames.make_brotli_frame([command]))  # noqa
+        finally:
+            await client.close()
+            decoder.close()
+
+        self.assertEqual(handler.prebuilt, [True, True])
+        self.assertEqual(len(handler.messages), 2)
+        for message in handler.messages:
+            self.assertIsInstance(message, compact.web.DanmakuMessage)
+        self.assertNotIn('_parsed_message', command)
+        self.assertEqual(len(decoder._contexts), 1)  # noqa
+
+    async def test_shared_context_across_clients(self):
+        decoder = proc_dec.ProcessDecoder(1, build_models=True)
+        submit = decoder._executor.submit  # noqa
+        submit_count = 0
+
+        def counting_submit(*args, **kwargs):
+            nonlocal submit_count
+            submit_count += 1
+            return submit(*args, **kwargs)
+        decoder._executor.submit = counting_submit  # noqa
+
+        handler = _CompactDanmakuHandler()
+        clients = [blivedm.BLiveClient(room_id) for room_id in range(1, 201)]
+        data = frames.make_brotli_frame([frames.make_danmaku_command(1)])
+        try:
+            for client in clients:
+                client.set_handler(handler)
+                client.set_process_decoder(decoder)
+                client._room_id = client.tmp_room_id  # noqa
+            for _ in range(3):
+                for client in clients:
+                    await client._parse_ws_message_in_process(data)  # noqa
+        finally:
+            for client in clients:
+                await client.close()
+            decoder.close()
+
+        self.assertEqual(submit_count, 3 * len(clients))
+        self.assertEqual(len(decoder._contexts), 1)  # noqa
+        self.assertEqual(len(handler.messages), 3 * len(clients))
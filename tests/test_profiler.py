@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import random
+import unittest
+
+import blivedm
+import blivedm.profiler as profiler_
+from benchmarks import frames
+
+
+class _DanmakuHandler(blivedm.BaseHandler):
+    def _on_danmaku(self, client, message):
+        pass
+
+
+class _BatchHandler(blivedm.HandlerInterface):
+    def handle(self, client, command):
+        pass
+
+    def handle_batch(self, client, commands):
+        pass
+
+
+class HandlerProfilerTest(unittest.TestCase):
+    def test_invalid_sample_rate(self):
+        for sample_rate in (0, -0.1, 1.5):
+            with self.subTest(sample_rate=sample_rate), self.assertRaises(ValueError):
+                blivedm.HandlerProfiler(sample_rate)
+
+    def test_sample_rate(self):
+        profiler = blivedm.HandlerProfiler(0.1, report_interval=None)
+        profiler._random = random.Random(0)  # noqa
+        samples = sum(profiler.should_sample() for _ in range(10000))
+        self.assertAlmostEqual(samples, 1000, delta=150)
+
+        profiler = blivedm.HandlerProfiler(1, report_interval=None)
+        self.assertTrue(all(profiler.should_sample() for _ in range(100)))
+
+    def test_get_top(self):
+        profiler = blivedm.HandlerProfiler(0.5, report_interval=None)
+        profiler.record(1, 'DANMU_MSG', 'H._on_danmaku', 1000)
+        profiler.record(1, 'DANMU_MSG', 'H._on_danmaku', 3000)
+        profiler.record(2, 'DANMU_MSG', 'H._on_danmaku', 500)
+        profiler.record(2, 'SEND_GIFT', 'H._on_gift', 6000)
+
+        top = profiler.get_top()
+        self.assertEqual([(item['room_id'], item['cmd']) for item in top], [
+            (2, 'SEND_GIFT'), (1, 'DANMU_MSG'), (2, 'DANMU_MSG')
+        ])
+        # 除以抽样比例估算
+        self.assertEqual(top[1]['samples'], 2)
+        self.assertEqual(top[1]['est_messages'], 4)
+        self.assertAlmostEqual(top[1]['est_cpu_seconds'], 8000e-9)
+        self.assertAlmostEqual(top[1]['mean_cpu_seconds'], 2000e-9)
+        self.assertAlmostEqual(top[1]['max_cpu_seconds'], 3000e-9)
+
+        top = profiler.get_top(1, group_by=('room_id',))
+        self.assertEqual(len(top), 1)
+        self.assertEqual(top[0]['room_id'], 2)
+        self.assertNotIn('cmd', top[0])
+        self.assertAlmostEqual(top[0]['est_cpu_seconds'], 13000e-9)
+
+        profiler.reset()
+        self.assertEqual(profiler.get_top(), [])
+
+    def test_method_name(self):
+        profiler = blivedm.HandlerProfiler(report_interval=None)
+        self.assertEqual(profiler.get_method_name(_DanmakuHandler(), 'DANMU_MSG'), '_DanmakuHandler._on_danmaku')
+        self.assertEqual(
+            profiler.get_method_name(_DanmakuHandler(), 'UNKNOWN_CMD'), '_DanmakuHandler.handle(unhandled)'
+        )
+        self.assertEqual(profiler.get_method_name(_BatchHandler(), 'DANMU_MSG'), '_BatchHandler.handle')
+
+
+class ClientProfilingTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.client = blivedm.BLiveClient(1)
+        self.client._room_id = 1  # noqa
+        self.profiler = blivedm.HandlerProfiler(1, report_interval=None)
+        self.client.set_profiler(self.profiler)
+
+    async def asyncTearDown(self):
+        await self.client.close()
+
+    async def test_per_cmd(self):
+        self.client.set_handler(_DanmakuHandler())
+        commands = [frames.make_danmaku_command(i) for i in range(5)] + [frames.make_gift_command(0)]
+        await self.client._parse_ws_message(frames.make_brotli_frame(commands))  # noqa
+
+        # 不要的礼物消息没有反序列化，不会统计
+        top = self.profiler.get_top()
+        self.assertEqual(len(top), 1)
+        self.assertEqual(
+            (top[0]['room_id'], top[0]['cmd'], top[0]['method']), (1, 'DANMU_MSG', '_DanmakuHandler._on_danmaku')
+        )
+        self.assertEqual(top[0]['samples'], 5)
+
+    async def test_custom_batch(self):
+        self.client.set_handler(_BatchHandler())
+        commands = frames.make_commands(5)
+        await self.client._parse_ws_message(frames.make_brotli_frame(commands))  # noqa
+
+        top = self.profiler.get_top()
+        self.assertEqual(len(top), 1)
+        self.assertEqual((top[0]['cmd'], top[0]['method']), (profiler_.BATCH_CMD, '_BatchHandler.handle_batch'))
+        self.assertEqual((top[0]['samples'], top[0]['est_messages']), (1, 5))
+
+
+class ReportTest(unittest.IsolatedAsyncioTestCase):
+    async def test_report(self):
+        reports = []
+        profiler = blivedm.HandlerProfiler(1, report_interval=0.01, report_callback=reports.append)
+        self.addCleanup(profiler.close)
+        profiler.record(1, 'DANMU_MSG', 'H._on_danmaku', 1000)
+        await asyncio.sleep(0.05)
+        self.assertEqual(len(reports), 1)
+        self.assertEqual(reports[0][0]['room_id'], 1)
+        # 报告后清空统计，下次有记录时才重新开始计时
+        self.assertEqual(profiler.get_top(), [])
+
+        profiler.record(2, 'DANMU_MSG', 'H._on_danmaku', 1000)
+        await asyncio.sleep(0.05)
+        self.assertEqual([report[0]['room_id'] for report in reports], [1, 2])
+
+    async def test_report_log(self):
+        profiler = blivedm.HandlerProfiler(1, report_interval=0.01)
+        self.addCleanup(profiler.close)
+        profiler.record(1, 'DANMU_MSG', 'H._on_danmaku', 1000)
+        with self.assertLogs('blivedm', 'INFO') as cm:
+            await asyncio.sleep(0.05)
+        self.assertIn('room=1 cmd=DANMU_MSG method=H._on_danmaku', cm.output[0])
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+import os
+import tempfile
+import unittest
+
+import blivedm.recorder as recorder
+
+
+class FrameRecorderTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self._temp_dir = tempfile.TemporaryDirectory()
+        self.directory = self._temp_dir.name
+
+    def tearDown(self):
+        self._temp_dir.cleanup()
+
+    async def test_max_open_files(self):
+        rec = recorder.FrameRecorder(self.directory, max_open_files=2)
+        try:
+            for i in range(3):
+                for room_id in range(1, 6):
+                    rec.record(room_id, f'{room_id}-{i}'.encode())
+                await rec.flush()
+                self.assertLessEqual(len(rec._writers), 2)  # noqa
+        finally:
+            await rec.close()
+
+        for room_id in range(1, 6):
+            frames = list(recorder.iter_room_frames(self.directory, room_id))
+            self.assertEqual([frame.data for frame in frames], [f'{room_id}-{i}'.encode() for i in range(3)])
+
+    async def test_idle_files_closed(self):
+        rec = recorder.FrameRecorder(self.directory, segment_idle_seconds=0)
+        try:
+            rec.record(1, b'data')
+            await rec.flush()
+            self.assertEqual(len(rec._writers), 0)  # noqa
+        finally:
+            await rec.close()
+        self.assertEqual(len(list(recorder.iter_room_frames(self.directory, 1))), 1)
+
+    async def test_write_error_isolated(self):
+        # 房间目录的位置是个文件，这个房间打开分段会失败
+        with open(os.path.join(self.directory, '1'), 'wb'):
+            pass
+        rec = recorder.FrameRecorder(self.directory)
+        try:
+            rec.record(1, b'lost')
+            rec.record(2, b'kept')
+            with self.assertLogs('blivedm', 'ERROR'):
+                await rec.flush()
+            stats = rec.stats
+            self.assertEqual(stats['write_failed_bytes'], recorder.FRAME_HEADER_STRUCT.size + len(b'lost'))
+            self.assertEqual(stats['written_bytes'], recorder.FRAME_HEADER_STRUCT.size + len(b'kept'))
+        finally:
+            await rec.close()
+        self.assertEqual([frame.data for frame in recorder.iter_room_frames(self.directory, 2)], [b'kept'])
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+import unittest
+import unittest.mock
+
+import blivedm
+
+
+def _make_unkeyed_command(n):
+    return {'cmd': 'ONLINE_RANK_COUNT', 'data': {'count': n}}
+
+
+class RedundantClientTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.members = [blivedm.BLiveClient(1) for _ in range(2)]
+        self.client = blivedm.RedundantClient(self.members, primary_stall_timeout=5.0)
+        self.now = 1000.0
+        patcher = unittest.mock.patch('time.monotonic', lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.connected_members = set(self.members)
+        patcher = unittest.mock.patch.object(
+            blivedm.BLiveClient, 'is_connected', property(lambda client: client in self.connected_members)
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def asyncTearDown(self):
+        await self.client.close()
+
+    def _filter(self, index, commands):
+        return self.members[index]._deduplicator.filter(1, commands)  # noqa
+
+    async def test_stalled_primary_replaced(self):
+        self.assertEqual(self._filter(0, [_make_unkeyed_command(1)]), [_make_unkeyed_command(1)])
+        self.assertEqual(self._filter(1, [_make_unkeyed_command(1)]), [])
+
+        # 主连接半死不活，没有断开但是收不到消息
+        self.now += 6
+        self.assertEqual(self._filter(1, [_make_unkeyed_command(2)]), [_make_unkeyed_command(2)])
+        self.assertIs(self.client.primary, self.members[1])
+        # 原来的主连接恢复后收到的同一条消息不会重复
+        self.assertEqual(self._filter(0, [_make_unkeyed_command(2)]), [])
+
+    async def test_heartbeat_does_not_switch(self):
+        self._filter(0, [_make_unkeyed_command(1)])
+        self.now += 60
+        heartbeat = {'cmd': '_HEARTBEAT', 'data': {'popularity': 1}}
+        self.assertEqual(self._filter(1, [heartbeat]), [])
+        self.assertIs(self.client.primary, self.members[0])
+
+    async def test_stalled_primary_replays_buffered(self):
+        self._filter(0, [_make_unkeyed_command(1)])
+        self.assertEqual(self._filter(1, [_make_unkeyed_command(1)]), [])
+
+        # 主连接卡住以后备用连接收到的消息先缓存，换主连接时补发
+        self.now += 1
+        self.assertEqual(self._filter(1, [_make_unkeyed_command(2)]), [])
+        self.now += 1
+        self.assertEqual(self._filter(1, [_make_unkeyed_command(3)]), [])
+        self.now += 4
+        self.assertEqual(
+            self._filter(1, [_make_unkeyed_command(4)]),
+            [_make_unkeyed_command(2), _make_unkeyed_command(3), _make_unkeyed_command(4)]
+        )
+        self.assertIs(self.client.primary, self.members[1])
+
+        # 补发过的不会再补发
+        self.now += 1
+        self.assertEqual(self._filter(1, [_make_unkeyed_command(5)]), [_make_unkeyed_command(5)])
+
+    async def test_disconnected_primary_replays_buffered(self):
+        self._filter(0, [_make_unkeyed_command(1)])
+        self.now += 1
+        self.assertEqual(self._filter(1, [_make_unkeyed_command(2)]), [])
+        self.now += 1
+        self.assertEqual(self._filter(1, [_make_unkeyed_command(3)]), [])
+
+        # 主连接断开，没等超时马上换主连接
+        self.connected_members.discard(self.members[0])
+        self.now += 0.5
+        self.assertIs(self.client.primary, self.members[1])
+        self.assertEqual(
+            self._filter(1, [_make_unkeyed_command(4)]),
+            [_make_unkeyed_command(2), _make_unkeyed_command(3), _make_unkeyed_command(4)]
+        )
+
+        # 原来的主连接重连后不会切回去
+        self.connected_members.add(self.members[0])
+        self.now += 1
+        self.assertEqual(self._filter(0, [_make_unkeyed_command(5)]), [])
+        self.assertEqual(self._filter(1, [_make_unkeyed_command(5)]), [_make_unkeyed_command(5)])
+
+    async def test_expired_buffer_not_replayed(self):
+        self._filter(0, [_make_unkeyed_command(1)])
+        self.now += 1
+        self._filter(1, [_make_unkeyed_command(2)])
+
+        # 只补发原主连接最后一次收到消息之后的
+        self.now += 1
+        self._filter(0, [_make_unkeyed_command(2)])
+        self.connected_members.discard(self.members[0])
+        self.now += 20
+        self.assertEqual(self._filter(1, [_make_unkeyed_command(3)]), [_make_unkeyed_command(3)])
+
+    async def test_keyed_dedup_across_members(self):
+        gift = {'cmd': 'SEND_GIFT', 'data': {'tid': '123'}}
+        other_gift = {'cmd': 'SEND_GIFT', 'data': {'tid': '456'}}
+
+        self._filter(0, [_make_unkeyed_command(0)])
+        # 有唯一标识的消息不管哪个连接先收到都处理，不管是不是主连接
+        self.assertEqual(self._filter(1, [gift]), [gift])
+        self.assertEqual(self._filter(0, [gift, other_gift]), [other_gift])
+        self.assertEqual(self._filter(1, [other_gift]), [])
+        self.assertIs(self.client.primary, self.members[0])
+
+        # 备用连接缓存的只有没有唯一标识的消息，补发时不会重复处理礼物
+        self.now += 1
+        self._filter(1, [_make_unkeyed_command(1), gift])
+        self.connected_members.discard(self.members[0])
+        self.assertEqual(
+            self._filter(1, [_make_unkeyed_command(2)]), [_make_unkeyed_command(1), _make_unkeyed_command(2)]
+        )
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import json
+import tempfile
+import time
+import unittest
+
+import blivedm
+import blivedm.clients.replay as replay
+import blivedm.recorder as recorder
+from benchmarks import frames
+from blivedm.clients import ws_base
+
+
+class _RecordingHandler(blivedm.HandlerInterface):
+    def __init__(self):
+        self.events = []
+
+    def handle(self, client, command):
+        self.events.append((client.room_id, command['cmd'], asyncio.get_running_loop().time()))
+
+
+def _make_frame(room_id, offset_ms, cmd='TEST'):
+    return recorder.RecordedFrame(
+        room_id, offset_ms * 1_000_000, 1_700_000_000_000_000_000 + offset_ms * 1_000_000,
+        frames.make_normal_payload([{'cmd': cmd}])
+    )
+
+
+class ReplayClientTest(unittest.IsolatedAsyncioTestCase):
+    async def _replay(self, recorded_frames, speed):
+        client = replay.ReplayClient(1, recorded_frames, speed=speed)
+        self.addAsyncCleanup(client.close)
+        handler = _RecordingHandler()
+        client.set_handler(handler)
+        start_time = asyncio.get_running_loop().time()
+        client.start()
+        await client.join()
+        return client, [(cmd, event_time - start_time) for _room_id, cmd, event_time in handler.events]
+
+    async def test_real_time(self):
+        client, events = await self._replay([_make_frame(1, 0, 'A'), _make_frame(1, 100, 'B')], 1)
+        self.assertEqual(client.replayed_frames, 2)
+        self.assertEqual([cmd for cmd, _event_time in events], ['A', 'B'])
+        self.assertGreaterEqual(events[1][1] - events[0][1], 0.09)
+
+    async def test_speed(self):
+        recorded_frames = [_make_frame(1, offset_ms) for offset_ms in (0, 100, 200, 400)]
+        _client, events = await self._replay(recorded_frames, 4)
+        self.assertGreaterEqual(events[-1][1], 0.09)
+        self.assertLess(events[-1][1], 0.3)
+
+        # 录制时的间隔按比例缩短，不会累计误差
+        for (_cmd, event_time), offset_ms in zip(events, (0, 100, 200, 400)):
+            self.assertGreaterEqual(event_time + 0.005, offset_ms / 1000 / 4)
+
+    async def test_max_speed_yields(self):
+        recorded_frames = [_make_frame(1, offset_ms * 1000) for offset_ms in range(600)]
+        other_task_ran_at = []
+
+        async def other_task():
+            await asyncio.sleep(0)
+            other_task_ran_at.append(client.replayed_frames)
+
+        client = replay.ReplayClient(1, recorded_frames, speed=None)
+        self.addAsyncCleanup(client.close)
+        start_time = time.perf_counter()
+        client.start()
+        asyncio.create_task(other_task())
+        await client.join()
+        self.assertLess(time.perf_counter() - start_time, 5)
+        self.assertEqual(client.replayed_frames, 600)
+        # 最快速度回放时定期让出事件循环，其他协程不会等到回放完
+        self.assertEqual(len(other_task_ran_at), 1)
+        self.assertLess(other_task_ran_at[0], 600)
+
+    async def test_auth_reply_error_not_raised(self):
+        body = json.dumps({'code': -101}).encode('utf-8')
+        auth_reply = frames.make_packet(body, ws_base.Operation.AUTH_REPLY, ws_base.ProtoVer.NORMAL)
+        recorded_frames = [
+            recorder.RecordedFrame(1, 0, 0, auth_reply),
+            _make_frame(1, 0, 'A'),
+        ]
+        with self.assertLogs('blivedm', 'WARNING'):
+            _client, events = await self._replay(recorded_frames, None)
+        self.assertEqual([cmd for cmd, _event_time in events], ['A'])
+
+    def test_invalid_args(self):
+        with self.assertRaises(ValueError):
+            replay.ReplayClient(1)
+        for speed in (0, -1):
+            with self.subTest(speed=speed), self.assertRaises(ValueError):
+                replay._Pacer(speed)  # noqa
+
+
+class ReplayEngineTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self._temp_dir = tempfile.TemporaryDirectory()
+        self.directory = self._temp_dir.name
+
+    def tearDown(self):
+        self._temp_dir.cleanup()
+
+    async def _record(self, frame_list):
+        rec = recorder.FrameRecorder(self.directory)
+        base_time = time.monotonic_ns()
+        for room_id, offset_ms, cmd in frame_list:
+            rec.record(room_id, frames.make_normal_payload([{'cmd': cmd}]), base_time + offset_ms * 1_000_000)
+        await rec.close()
+
+    async def test_merge_rooms(self):
+        # 每个房间的帧按录制时间交错
+        await self._record([
+            (1, 0, 'A1'), (1, 30, 'A2'), (2, 10, 'B1'), (2, 20, 'B2'), (3, 15, 'C1'), (1, 40, 'A3'),
+        ])
+        engine = replay.ReplayEngine(self.directory, [1, 2], speed=None)
+        handler = _RecordingHandler()
+        engine.set_handler(handler)
+        await engine.run()
+        await engine.close()
+
+        # 没有要回放的房间3不回放
+        self.assertEqual(
+            [(room_id, cmd) for room_id, cmd, _event_time in handler.events],
+            [(1, 'A1'), (2, 'B1'), (2, 'B2'), (1, 'A2'), (1, 'A3')]
+        )
+        self.assertEqual(engine.replayed_frames, 5)
+        self.assertEqual(engine.clients[1].replayed_frames, 3)
+
+    async def test_pacing(self):
+        await self._record([(1, 0, 'A'), (2, 100, 'B'), (1, 200, 'C')])
+        engine = replay.ReplayEngine(self.directory, [1, 2], speed=2)
+        handler = _RecordingHandler()
+        engine.set_handler(handler)
+        engine.start()
+        self.assertTrue(engine.is_running)
+        await engine.join()
+        self.assertFalse(engine.is_running)
+        await engine.close()
+
+        event_times = [event_time for _room_id, _cmd, event_time in handler.events]
+        self.assertGreaterEqual(event_times[1] - event_times[0], 0.045)
+        self.assertGreaterEqual(event_times[2] - event_times[0], 0.095)
+        self.assertLess(event_times[2] - event_times[0], 0.5)
+
+    async def test_stop(self):
+        await self._record([(1, 0, 'A'), (1, 10_000, 'B')])
+        engine = replay.ReplayEngine(self.directory, [1], speed=1)
+        handler = _RecordingHandler()
+        engine.set_handler(handler)
+        engine.start()
+        await asyncio.sleep(0.05)
+        engine.stop()
+        await asyncio.sleep(0)
+        self.assertFalse(engine.is_running)
+        await engine.close()
+        self.assertEqual([cmd for _room_id, cmd, _event_time in handler.events], ['A'])
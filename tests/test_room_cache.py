@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import os
+import sqlite3
+import tempfile
+import unittest
+
+import blivedm
+import blivedm.room_cache as room_cache
+from benchmarks import mock_http_server, room_init
+from blivedm.clients import web, ws_base
+
+_HOST_SERVER_LIST = [{'host': '127.0.0.1', 'port': 1, 'wss_port': 1, 'ws_port': 1}]
+
+
+class _TempDirTestCase(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self._temp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self._temp_dir.name, 'room_cache.db')
+
+    def tearDown(self):
+        self._temp_dir.cleanup()
+
+    def _open_cache(self, **kwargs):
+        cache = blivedm.RoomInitCache(self.path, **kwargs)
+        self.addAsyncCleanup(cache.close)
+        return cache
+
+
+class RoomInitCacheTest(_TempDirTestCase):
+    async def test_persist(self):
+        cache = self._open_cache()
+        self.assertEqual(cache.get_room_init(1), (None, True))
+        cache.set_room_init(1, 100, 200)
+        cache.set_danmaku_server_conf(100, _HOST_SERVER_LIST, 'token')
+        # 内存里马上能读到
+        self.assertEqual(cache.get_room_init(1), ({'room_id': 100, 'room_owner_uid': 200}, False))
+        await cache.close()
+
+        cache = self._open_cache()
+        self.assertEqual(cache.get_room_init(1), ({'room_id': 100, 'room_owner_uid': 200}, False))
+        self.assertEqual(
+            cache.get_danmaku_server_conf(100),
+            ({'host_server_list': _HOST_SERVER_LIST, 'host_server_token': 'token'}, False)
+        )
+        self.assertEqual(cache.stats, {
+            'room_init_entries': 1, 'danmaku_server_conf_entries': 1, 'hits': 2, 'misses': 0
+        })
+
+    async def test_batched_write(self):
+        cache = self._open_cache(flush_interval=0.05)
+        cache.set_room_init(1, 100, 200)
+        cache.set_room_init(2, 101, 201)
+
+        def count_rows():
+            with sqlite3.connect(self.path) as conn:
+                return conn.execute(f'SELECT COUNT(*) FROM {room_cache.ROOM_INIT_TABLE}').fetchone()[0]
+
+        self.assertEqual(count_rows(), 0)
+        await asyncio.sleep(0.15)
+        self.assertEqual(count_rows(), 2)
+
+        cache.set_room_init(3, 102, 202)
+        await cache.flush()
+        self.assertEqual(count_rows(), 3)
+
+    async def test_expiry_and_refresh_age(self):
+        cache = self._open_cache(room_init_ttl=0.1, room_init_refresh_age=0.05)
+        cache.set_room_init(1, 100, 200)
+        self.assertEqual(cache.get_room_init(1)[1], False)
+        await asyncio.sleep(0.06)
+        # 超过刷新时间还能用，但是要刷新
+        self.assertEqual(cache.get_room_init(1), ({'room_id': 100, 'room_owner_uid': 200}, True))
+        await asyncio.sleep(0.06)
+        # 超过TTL不能用
+        self.assertEqual(cache.get_room_init(1), (None, True))
+        await cache.close()
+
+        # 重新打开时删除过期的
+        cache = self._open_cache(room_init_ttl=0.1)
+        self.assertEqual(cache.stats['room_init_entries'], 0)
+
+    async def test_invalidate(self):
+        cache = self._open_cache()
+        cache.set_danmaku_server_conf(100, _HOST_SERVER_LIST, 'token')
+        cache.invalidate_danmaku_server_conf(100)
+        self.assertEqual(cache.get_danmaku_server_conf(100), (None, True))
+        await cache.close()
+
+        cache = self._open_cache()
+        self.assertEqual(cache.get_danmaku_server_conf(100), (None, True))
+
+    async def test_closed(self):
+        cache = self._open_cache()
+        await cache.close()
+        # 关闭后不再写入
+        cache.set_room_init(1, 100, 200)
+        self.assertEqual(cache.get_room_init(1), (None, True))
+        await cache.close()
+
+
+class ClientRoomInitCacheTest(_TempDirTestCase):
+    async def asyncSetUp(self):
+        self.server = mock_http_server.MockHttpServer(host_server_list=_HOST_SERVER_LIST, danmaku_token='new-token')
+        await self.server.start()
+        self.addAsyncCleanup(self.server.close)
+        web.set_base_urls(self.server.url, self.server.url, self.server.url)
+        self.addCleanup(web.set_base_urls)
+        self.session = room_init.make_session()
+        self.addAsyncCleanup(self.session.close)
+
+    def _create_client(self, cache):
+        client = blivedm.BLiveClient(123, session=self.session)
+        client.set_room_init_cache(cache)
+        self.addAsyncCleanup(client.close)
+        return client
+
+    async def _wait_refreshed(self, client):
+        for _ in range(300):
+            if client._room_init_cache_refresh_future is None:  # noqa
+                return
+            await asyncio.sleep(0.01)
+        raise AssertionError('refresh timeout')
+
+    async def test_fill_cache(self):
+        cache = self._open_cache()
+        self.assertTrue(await self._create_client(cache).init_room())
+        self.assertEqual(cache.get_room_init(123)[0], {'room_id': 123, 'room_owner_uid': 1_000_123})
+        self.assertEqual(cache.get_danmaku_server_conf(123)[0]['host_server_token'], 'new-token')
+
+        # 之后的客户端不请求房间接口
+        self.server.reset_stats()
+        self.assertTrue(await self._create_client(cache).init_room())
+        self.assertEqual(self.server.stats['requests']['room_init'], 0)
+        self.assertEqual(self.server.stats['requests']['danmu_info'], 0)
+
+    async def test_background_refresh(self):
+        cache = self._open_cache(room_init_refresh_age=0, danmaku_server_conf_refresh_age=0)
+        cache.set_room_init(123, 123, 1)
+        cache.set_danmaku_server_conf(123, [], 'old-token')
+
+        # 用旧的缓存马上返回，在后台刷新
+        client = self._create_client(cache)
+        self.server.set_latency(0.05)
+        self.assertTrue(await client.init_room())
+        self.assertEqual(client.room_owner_uid, 1)
+        self.assertEqual(client._host_server_token, 'old-token')  # noqa
+        self.assertEqual(self.server.stats['requests']['room_init'], 0)
+
+        await self._wait_refreshed(client)
+        self.assertEqual(client.room_owner_uid, 1_000_123)
+        self.assertEqual(client._host_server_token, 'new-token')  # noqa
+        self.assertEqual(cache.get_room_init(123)[0]['room_owner_uid'], 1_000_123)
+        self.assertEqual(cache.get_danmaku_server_conf(123)[0]['host_server_list'], _HOST_SERVER_LIST)
+
+    async def test_background_refresh_failed(self):
+        cache = self._open_cache(room_init_refresh_age=0)
+        cache.set_room_init(123, 123, 1)
+        cache.set_danmaku_server_conf(123, _HOST_SERVER_LIST, 'old-token')
+        self.server.set_error('room_init', -400)
+
+        client = self._create_client(cache)
+        with self.assertLogs('blivedm', 'WARNING'):
+            self.assertTrue(await client.init_room())
+            await self._wait_refreshed(client)
+        # 刷新失败则保留缓存的值
+        self.assertEqual(client.room_owner_uid, 1)
+        self.assertEqual(cache.get_room_init(123)[0]['room_owner_uid'], 1)
+        self.assertEqual(self.server.stats['requests']['danmu_info'], 0)
+
+    async def test_refresh_concurrency(self):
+        cache = self._open_cache(room_init_refresh_age=0, max_concurrent_refreshes=2)
+        clients = []
+        for room_id in range(1, 7):
+            cache.set_room_init(room_id, room_id, 1)
+            cache.set_danmaku_server_conf(room_id, _HOST_SERVER_LIST, 'token')
+            client = blivedm.BLiveClient(room_id, session=self.session)
+            client.set_room_init_cache(cache)
+            self.addAsyncCleanup(client.close)
+            clients.append(client)
+
+        self.server.set_latency(0.1)
+        await asyncio.gather(*(client.init_room() for client in clients))
+        await asyncio.sleep(0.05)
+        # 同时只有2个在刷新
+        self.assertEqual(self.server.stats['requests']['room_init'], 2)
+        for client in clients:
+            await self._wait_refreshed(client)
+        self.assertEqual(self.server.stats['requests']['room_init'], 6)
+
+    async def test_auth_failure_invalidates(self):
+        cache = self._open_cache()
+        client = self._create_client(cache)
+        self.assertTrue(await client.init_room())
+        self.assertIsNotNone(cache.get_danmaku_server_conf(123)[0])
+
+        with self.assertRaises(ws_base.AuthError):
+            await client._on_auth_reply({'code': ws_base.AuthReplyCode.TOKEN_ERROR})  # noqa
+        self.assertEqual(cache.get_danmaku_server_conf(123), (None, True))
+        # 房间ID的缓存还能用
+        self.assertIsNotNone(cache.get_room_init(123)[0])
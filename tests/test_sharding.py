@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import unittest
+
+import blivedm
+import blivedm.sharding as sharding
+
+
+class _FakeProcess:
+    def __init__(self, **_kwargs):
+        self.alive = False
+        self.exitcode = None
+
+    def start(self):
+        self.alive = True
+
+    def is_alive(self):
+        return self.alive
+
+    def join(self, _timeout=None):
+        # 收到停止命令后退出
+        self.alive = False
+
+    def terminate(self):
+        self.alive = False
+
+    def crash(self):
+        self.alive = False
+        self.exitcode = 1
+
+
+class _FakeQueue:
+    def __init__(self):
+        self.items = []
+
+    def put(self, item):
+        self.items.append(item)
+
+    def get(self):
+        # 让父进程读消息的线程马上退出
+        return None
+
+    def close(self):
+        pass
+
+
+class _FakeContext:
+    @staticmethod
+    def Queue():  # noqa
+        return _FakeQueue()
+
+    @staticmethod
+    def Process(**kwargs):  # noqa
+        return _FakeProcess(**kwargs)
+
+
+class ShardedSupervisorTest(unittest.IsolatedAsyncioTestCase):
+    def _make_supervisor(self, num_workers=2, max_restarts=10):
+        self.restart_policy_args = []
+
+        def restart_policy(retry_count, total_retry_count):
+            self.restart_policy_args.append((retry_count, total_retry_count))
+            return 0.01
+
+        supervisor = blivedm.ShardedSupervisor(
+            blivedm.BaseHandler, num_workers=num_workers, mp_context=_FakeContext(),  # noqa
+            report_interval=1000, restart_policy=restart_policy, max_restarts=max_restarts
+        )
+        supervisor.add_rooms(range(1, 5))
+        supervisor.start()
+        self.addAsyncCleanup(supervisor.stop)
+        return supervisor
+
+    @staticmethod
+    def _get_workers(supervisor):
+        return supervisor._workers  # noqa
+
+    async def test_restart_with_backoff(self):
+        supervisor = self._make_supervisor()
+        worker0, worker1 = self._get_workers(supervisor)
+
+        worker0.process.crash()
+        supervisor._restart_dead_workers()  # noqa
+        self.assertEqual(self.restart_policy_args, [(1, 1)])
+        # 等待重启时房间分到其他进程
+        self.assertEqual(worker0.room_keys, set())
+        self.assertEqual(worker1.room_keys, {1, 2, 3, 4})
+        self.assertIn((sharding._CMD_ADD_ROOMS, [1]), worker1.command_queue.items)  # noqa
+        self.assertFalse(supervisor.status['workers'][0]['alive'])
+
+        # 等待期间不会重复重启
+        supervisor._restart_dead_workers()  # noqa
+        self.assertEqual(self.restart_policy_args, [(1, 1)])
+
+        await asyncio.sleep(0.05)
+        self.assertTrue(worker0.process.is_alive())
+        self.assertEqual(worker0.restart_count, 1)
+
+        # 刚启动就退出，连续重启次数增加
+        worker0.process.crash()
+        supervisor._restart_dead_workers()  # noqa
+        await asyncio.sleep(0.05)
+        self.assertEqual(self.restart_policy_args, [(1, 1), (2, 2)])
+
+        # 运行够久以后退出，连续重启次数从头算
+        worker0.start_time -= sharding._RESTART_RESET_TIME  # noqa
+        worker0.process.crash()
+        supervisor._restart_dead_workers()  # noqa
+        await asyncio.sleep(0.05)
+        self.assertEqual(self.restart_policy_args, [(1, 1), (2, 2), (1, 3)])
+        self.assertEqual(worker0.restart_count, 3)
+
+    async def test_give_up_after_max_restarts(self):
+        supervisor = self._make_supervisor(max_restarts=1)
+        worker0, worker1 = self._get_workers(supervisor)
+
+        worker0.process.crash()
+        supervisor._restart_dead_workers()  # noqa
+        await asyncio.sleep(0.05)
+        self.assertTrue(worker0.process.is_alive())
+
+        worker0.process.crash()
+        with self.assertLogs('blivedm', 'ERROR') as cm:
+            supervisor._restart_dead_workers()  # noqa
+        self.assertEqual(len(cm.records), 1)
+        self.assertTrue(worker0.gave_up)
+        self.assertTrue(supervisor.status['workers'][0]['gave_up'])
+        self.assertEqual(worker1.room_keys, {1, 2, 3, 4})
+
+        # 放弃以后不再记录日志，新房间不会分给它
+        with self.assertNoLogs('blivedm'):
+            supervisor._restart_dead_workers()  # noqa
+        await asyncio.sleep(0.05)
+        self.assertFalse(worker0.process.is_alive())
+        self.assertEqual(self.restart_policy_args, [(1, 1)])
+        supervisor.add_room(5)
+        self.assertIn(5, worker1.room_keys)
+
+    async def test_rooms_resent_when_no_other_worker(self):
+        supervisor = self._make_supervisor(num_workers=1)
+        worker, = self._get_workers(supervisor)
+
+        worker.process.crash()
+        supervisor._restart_dead_workers()  # noqa
+        self.assertEqual(worker.room_keys, {1, 2, 3, 4})
+        self.assertIsNone(worker.command_queue)
+
+        # 等待重启时添加的房间也留在这个进程
+        supervisor.add_room(5)
+        await asyncio.sleep(0.05)
+        self.assertTrue(worker.process.is_alive())
+        cmd, room_keys = worker.command_queue.items[0]
+        self.assertEqual(cmd, sharding._CMD_ADD_ROOMS)  # noqa
+        self.assertEqual(set(room_keys), {1, 2, 3, 4, 5})
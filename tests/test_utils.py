@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from blivedm import utils
+
+
+class ExponentialRetryPolicyTest(unittest.TestCase):
+    def test_growth(self):
+        policy = utils.make_exponential_retry_policy(1, 30)
+        for retry_count, upper in ((1, 1), (2, 2), (3, 4), (5, 16), (6, 30), (10, 30)):
+            interval = policy(retry_count, retry_count)
+            self.assertGreaterEqual(interval, upper / 2)
+            self.assertLessEqual(interval, upper)
+
+    def test_large_retry_count(self):
+        policy = utils.make_exponential_retry_policy(1, 30)
+        for retry_count in (1024, 1100, 10 ** 6):
+            interval = policy(retry_count, retry_count)
+            self.assertGreaterEqual(interval, 15)
+            self.assertLessEqual(interval, 30)
+
+    def test_decorrelated_jitter_large_retry_count(self):
+        policy = utils.make_decorrelated_jitter_retry_policy(1, 30)
+        for retry_count in range(1, 2000):
+            interval = policy(retry_count, retry_count)
+            self.assertGreaterEqual(interval, 1)
+            self.assertLessEqual(interval, 30)
+
+
+if __name__ == '__main__':
+    unittest.main()
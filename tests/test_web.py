@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+import unittest
+from typing import *
+
+import aiohttp
+import aiohttp.web
+import yarl
+
+from blivedm import wbi
+from blivedm.clients import web
+
+
+class _NavServerTestCase(unittest.IsolatedAsyncioTestCase):
+    nav_body: Any = {}
+
+    async def asyncSetUp(self):
+        app = aiohttp.web.Application()
+        app.router.add_get('/x/web-interface/nav', self._on_nav)
+        app.router.add_get('/', self._on_home)
+        self._runner = aiohttp.web.AppRunner(app)
+        await self._runner.setup()
+        site = aiohttp.web.TCPSite(self._runner, '127.0.0.1', 0)
+        await site.start()
+        port = self._runner.addresses[0][1]
+        self.base_url = f'http://127.0.0.1:{port}'
+        web.set_base_urls(self.base_url, self.base_url, self.base_url)
+
+        self.session = aiohttp.ClientSession(cookie_jar=aiohttp.CookieJar(unsafe=True))
+        self.session.cookie_jar.update_cookies({'SESSDATA': 'x'}, yarl.URL(web.UID_INIT_URL))
+        self.nav_requests = 0
+
+    async def asyncTearDown(self):
+        await self.session.close()
+        await self._runner.cleanup()
+        web.set_base_urls()
+
+    async def _on_nav(self, _request):
+        self.nav_requests += 1
+        return aiohttp.web.json_response(self.nav_body)
+
+    async def _on_home(self, _request):
+        res = aiohttp.web.Response(text='')
+        res.set_cookie('buvid3', 'test-buvid')
+        return res
+
+
+class InitUidErrorTest(_NavServerTestCase):
+    nav_body = {'code': -352, 'message': 'risk control'}
+
+    async def test_error_without_data(self):
+        identity = web.SessionIdentity()
+        self.assertFalse(await identity._init_uid(self.session))  # noqa
+
+
+class InitUidNotLoginTest(_NavServerTestCase):
+    nav_body = {
+        'code': -101,
+        'message': '账号未登录',
+        'data': {
+            'isLogin': False,
+            'wbi_img': {
+                'img_url': 'https://i0.hdslb.com/bfs/wbi/7cd084941338484aae1ad9425b84077c.png',
+                'sub_url': 'https://i0.hdslb.com/bfs/wbi/4932caff0ff746eab6f01bf08b70ac45.png',
+            },
+        },
+    }
+
+    async def test_not_login_updates_wbi_keys(self):
+        signer = wbi.get_wbi_signer()
+        signer.invalidate()
+        identity = web.SessionIdentity()
+        self.assertTrue(await identity._init_uid(self.session))  # noqa
+        self.assertEqual(identity.uid, 0)
+        self.assertFalse(signer.is_expired)
+
+
+class ExplicitUidTest(_NavServerTestCase):
+    nav_body = {'code': 0, 'message': '0', 'data': {'isLogin': True, 'mid': 1}}
+
+    async def test_explicit_uid_skips_nav(self):
+        # 签名用的密钥已经有了，nav只可能是获取身份时请求的
+        wbi.get_wbi_signer().update_keys('7cd084941338484aae1ad9425b84077c', '4932caff0ff746eab6f01bf08b70ac45')
+        client = web.BLiveClient(1, uid=123, session=self.session)
+        await client.init_room()
+        self.assertEqual(self.nav_requests, 0)
+        self.assertEqual(client._uid, 123)  # noqa
+        self.assertEqual(web.get_buvid(self.session), 'test-buvid')
+        await client.close()
+
+    async def test_auto_uid_requests_nav(self):
+        client = web.BLiveClient(1, session=self.session)
+        await client.init_room()
+        self.assertEqual(self.nav_requests, 1)
+        self.assertEqual(client._uid, 1)  # noqa
+        await client.close()
+
+
+class FetchKeysNotDictTest(_NavServerTestCase):
+    nav_body = ['not', 'a', 'dict']
+
+    async def test_not_dict_is_failure(self):
+        signer = wbi.WbiSigner()
+        self.assertFalse(await signer._fetch_keys(self.session, web.UID_INIT_URL))  # noqa
+        self.assertIsNone(await signer.ensure_keys(self.session, web.UID_INIT_URL))
+        self.assertIsNone(signer.mixin_key)
+        self.assertEqual(self.nav_requests, 2)
+
+
+class UpdateKeysFromNavTest(unittest.TestCase):
+    def test_invalid_nav_data(self):
+        signer = wbi.WbiSigner()
+        self.assertFalse(signer.update_keys_from_nav(None))  # noqa
+        self.assertFalse(signer.update_keys_from_nav({}))
+        self.assertFalse(signer.update_keys_from_nav({'wbi_img': None}))
+        self.assertIsNone(signer.mixin_key)
+
+
+if __name__ == '__main__':
+    unittest.main()
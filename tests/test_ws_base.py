@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+import json
+import struct
+import unittest
+
+import brotli
+
+import blivedm
+from benchmarks import frames
+from blivedm.clients import ws_base
+
+_NORMAL = ws_base.ProtoVer.NORMAL
+_BROTLI = ws_base.ProtoVer.BROTLI
+_SEND_MSG_REPLY = ws_base.Operation.SEND_MSG_REPLY
+
+
+def _make_json_packet(command):
+    return frames.make_packet(json.dumps(command).encode('utf-8'), _SEND_MSG_REPLY, _NORMAL)
+
+
+class _RecordingHandler(blivedm.HandlerInterface):
+    def __init__(self):
+        self.commands = []
+
+    def handle(self, client, command):
+        self.commands.append(command)
+
+
+class IterPacketsTest(unittest.TestCase):
+    def test_zero_copy(self):
+        data = frames.make_packet(b'abc', _SEND_MSG_REPLY, _NORMAL) + frames.make_packet(b'', _SEND_MSG_REPLY, _BROTLI)
+        view = memoryview(data)
+        packets = list(ws_base.iter_packets(view))
+        self.assertEqual([(operation, ver, bytes(body)) for operation, ver, body in packets], [
+            (_SEND_MSG_REPLY, _NORMAL, b'abc'),
+            (_SEND_MSG_REPLY, _BROTLI, b''),
+        ])
+        # 包体是原数据的切片
+        self.assertIs(packets[0][2].obj, data)
+
+    def test_bytes_input(self):
+        data = frames.make_packet(b'abc', _SEND_MSG_REPLY, _NORMAL)
+        (_operation, _ver, body), = ws_base.iter_packets(data)
+        self.assertIsInstance(body, memoryview)
+        self.assertEqual(body, b'abc')
+
+    def test_truncated_header(self):
+        data = frames.make_packet(b'abc', _SEND_MSG_REPLY, _NORMAL)
+        packet_iter = ws_base.iter_packets(data + data[:ws_base.HEADER_STRUCT.size - 1])
+        self.assertEqual(bytes(next(packet_iter)[2]), b'abc')
+        with self.assertRaises(struct.error):
+            next(packet_iter)
+
+    def test_pack_len_past_buffer(self):
+        data = frames.make_packet(b'abc', _SEND_MSG_REPLY, _NORMAL)
+        with self.assertRaises(struct.error):
+            list(ws_base.iter_packets(data[:-1]))
+
+    def test_invalid_header(self):
+        header = ws_base.HEADER_STRUCT.pack(0, ws_base.HEADER_STRUCT.size, _NORMAL, _SEND_MSG_REPLY, 0)
+        with self.assertRaises(struct.error):
+            # pack_len为0时不能死循环
+            list(ws_base.iter_packets(header))
+
+        header = ws_base.HEADER_STRUCT.pack(ws_base.HEADER_STRUCT.size, 4, _NORMAL, _SEND_MSG_REPLY, 0)
+        with self.assertRaises(struct.error):
+            list(ws_base.iter_packets(header))
+
+
+class ParseWsMessageTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.client = blivedm.BLiveClient(1)
+        self.client._room_id = 1  # noqa
+        self.handler = _RecordingHandler()
+        self.client.set_handler(self.handler)
+
+    async def asyncTearDown(self):
+        await self.client.close()
+
+    async def test_nested_frames(self):
+        commands = frames.make_commands(6)
+        # 未压缩的包和压缩的包混在一起，压缩的包里还有压缩的包
+        inner = frames.make_packet(
+            brotli.compress(frames.make_normal_payload(commands[2:4])), _SEND_MSG_REPLY, _BROTLI
+        )
+        outer = frames.make_packet(
+            brotli.compress(frames.make_normal_payload(commands[1:2]) + inner), _SEND_MSG_REPLY, _BROTLI
+        )
+        data = _make_json_packet(commands[0]) + outer + frames.make_normal_payload(commands[4:])
+        await self.client._parse_ws_message(data)  # noqa
+        self.assertEqual(self.handler.commands, commands)
+
+    async def test_corrupted_nested_frame(self):
+        commands = frames.make_commands(3)
+        # 压缩包里的最后一个包被截断，前面的消息和外层后面的消息还要处理
+        inner_payload = frames.make_normal_payload(commands[:2])
+        inner = frames.make_packet(brotli.compress(inner_payload[:-1]), _SEND_MSG_REPLY, _BROTLI)
+        data = inner + _make_json_packet(commands[2])
+        with self.assertLogs('blivedm', 'ERROR'):
+            await self.client._parse_ws_message(data)  # noqa
+        self.assertEqual(self.handler.commands, [commands[0], commands[2]])
+
+    async def test_truncated_frame(self):
+        commands = frames.make_commands(2)
+        data = frames.make_normal_payload(commands)
+        with self.assertLogs('blivedm', 'ERROR'):
+            await self.client._parse_ws_message(data[:-1])  # noqa
+        self.assertEqual(self.handler.commands, commands[:1])
+
+        self.handler.commands = []
+        with self.assertLogs('blivedm', 'ERROR'):
+            await self.client._parse_ws_message(data[:ws_base.HEADER_STRUCT.size - 1])  # noqa
+        self.assertEqual(self.handler.commands, [])
+
+
+class PeekCmdTest(unittest.TestCase):
+    def test_peek(self):
+        cases = [
+            (b'{"cmd":"DANMU_MSG","info":[]}', 'DANMU_MSG'),
+            (b' {\n  "cmd" : "SEND_GIFT", "data": {}}', 'SEND_GIFT'),
+            (b'{"cmd":"DANMU_MSG:4:0:2:2:2:0","info":[]}', 'DANMU_MSG'),
+            ('{"cmd":"弹幕"}'.encode('utf-8'), '弹幕'),
+            (memoryview(b'xx{"cmd":"A"}')[2:], 'A'),
+        ]
+        for body, expected in cases:
+            with self.subTest(body=bytes(body)):
+                self.assertEqual(ws_base.peek_cmd(body), expected)
+
+    def test_cannot_peek(self):
+        # 读不出来时返回None，要反序列化才能知道cmd
+        cases = [
+            b'{"cmd":"DANMU\\u005fMSG","info":[]}',
+            b'{"cmd":"A\\"B"}',
+            b'{"data":{},"cmd":"SEND_GIFT"}',
+            b'{"data":{}}',
+            b'{"cmd":1}',
+            b'{"cmd":"DANMU_MSG',
+            b'',
+            b'not json',
+        ]
+        for body in cases:
+            with self.subTest(body=body):
+                self.assertIsNone(ws_base.peek_cmd(body))
+
+
+class SkipUnwantedCmdTest(unittest.IsolatedAsyncioTestCase):
+    class _DanmakuHandler(blivedm.BaseHandler):
+        def __init__(self):
+            self.messages = []
+
+        def _on_danmaku(self, client, message):
+            self.messages.append(message)
+
+    async def test_skip_unwanted(self):
+        client = blivedm.BLiveClient(1)
+        self.addAsyncCleanup(client.close)
+        client._room_id = 1  # noqa
+        handler = self._DanmakuHandler()
+        client.set_handler(handler)
+
+        danmaku = frames.make_danmaku_command(1)
+        interact = frames.make_interact_word_command(2)
+        danmaku2 = frames.make_danmaku_command(3)
+        escaped_danmaku = json.dumps(danmaku2).replace('DANMU_MSG', 'DANMU\\u005fMSG', 1)
+        no_cmd = {'data': {}}
+        data = (
+            _make_json_packet(danmaku) + _make_json_packet(interact) + _make_json_packet(no_cmd)
+            + frames.make_packet(escaped_danmaku.encode('utf-8'), _SEND_MSG_REPLY, _NORMAL)
+        )
+        await client._parse_ws_message(data)  # noqa
+
+        # 读不出cmd的消息照常反序列化处理
+        self.assertEqual([message.msg for message in handler.messages], [danmaku['info'][1], danmaku2['info'][1]])
+        self.assertEqual(client.skipped_cmd_stats, {
+            'INTERACT_WORD': {'messages': 1, 'bytes': len(json.dumps(interact))},
+        })